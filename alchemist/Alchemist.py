@@ -1,14 +1,19 @@
 from .Client import DriverClient, WorkerClients
 from .MatrixHandle import MatrixHandle
+from .Message import Message
+from .ShardedArray import ShardedArray
+from .ArrowBlocks import ArrowBlocks
 from .Parameter import Parameter
+from .Tracer import Tracer
+from .BufferPool import BufferPool
+from .BlockCache import BlockCache
+from .MatrixRegistry import MatrixRegistry
+from concurrent.futures import ThreadPoolExecutor
 import time
-import h5py
 import os
+import tempfile
 import importlib
 import numpy as np
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
 
 
 class AlchemistSession:
@@ -19,11 +24,40 @@ class AlchemistSession:
 
     workers_connected = False
 
+    buffer_pool = None
+    block_cache = None
+    # Digests of the blocks last sent by send_matrix or update_matrix, by matrix ID
+    block_hashes = {}
+    matrix_registry = None
+
+    # send_matrix hashes the blocks of dense matrices as it sends them, so that the first update_matrix only sends
+    # the blocks that changed. Hashing takes several times as long as copying the matrix, so it is off by default and
+    # only worth turning on for matrices that are updated.
+    hash_sent_blocks = False
+
+    # Size of the bands of rows that send_hdf5 reads from a dataset at a time
+    hdf5_band_bytes = 64000000
+    # Size of the blocks of rows that iter_rows yields when it is not given a number of rows
+    iter_chunk_bytes = 64000000
+
     def __init__(self, driver_buffer_length = 10000, worker_buffer_length = 10000000,
-                 verbose = True, show_overheads = False):
+                 verbose = True, show_overheads = False, max_concurrent_transfers = None, send_window = 1,
+                 trace_level = None, buffer_pool_bytes = 100000000, block_cache_bytes = 0):
         print("Starting Alchemist session ... ", end="", flush=True)
-        self.driver = DriverClient(driver_buffer_length, verbose, show_overheads)
-        self.workers = WorkerClients(worker_buffer_length, verbose, show_overheads)
+        # Tracing goes to one logger shared by all sessions (and is off until a level is set), so it is only changed
+        # when a level is given
+        if trace_level is not None:
+            Tracer.set_level(trace_level)
+        # Message buffers of all connections are borrowed from this pool, which keeps at most buffer_pool_bytes of
+        # idle buffers around for reuse
+        self.buffer_pool = BufferPool(buffer_pool_bytes)
+        # Fetched blocks are kept for later fetches of the same rows and columns, up to block_cache_bytes (0 disables
+        # the cache)
+        self.block_cache = BlockCache(block_cache_bytes)
+        self.block_hashes = {}
+        self.driver = DriverClient(driver_buffer_length, verbose, show_overheads, self.buffer_pool)
+        self.workers = WorkerClients(worker_buffer_length, verbose, show_overheads, max_concurrent_transfers,
+                                     send_window, self.buffer_pool)
         self.workers_connected = False
         print("ready")
 
@@ -31,43 +65,344 @@ class AlchemistSession:
         print("Ending Alchemist session")
         self.close()
 
+    def set_trace_level(self, level, stream=None):
+        # Protocol tracing goes to the 'alchemist.protocol' logger, for all sessions; pass a stream such as sys.stdout
+        # to see it without configuring logging
+        Tracer.set_level(level, stream)
+
+    def set_min_message_bytes(self, min_message_bytes):
+        # Matrix transfers fill messages up to at least this size when Alchemist accepts messages that long (as
+        # negotiated in the handshake); otherwise messages are as long as the worker buffer length
+        self.workers.set_min_message_bytes(min_message_bytes)
+
+    def set_max_part_length(self, max_part_length):
+        # Messages longer than this are sent in parts, 0 splits only what is longer than Alchemist accepts
+        self.driver.set_max_part_length(max_part_length)
+        self.workers.set_max_part_length(max_part_length)
+
+    def set_block_cache_bytes(self, block_cache_bytes):
+        self.block_cache.set_max_bytes(block_cache_bytes)
+
+    def enable_matrix_registry(self, path=None):
+        # Dense matrices that are sent again with the same contents, shape, element type and layout then return the
+        # handle of the matrix already in Alchemist instead of being sent; with a path the registry is kept in that
+        # JSON file and shared with later sessions
+        self.matrix_registry = MatrixRegistry(path)
+        return self.matrix_registry
+
+    def get_server_name(self):
+        return "{0}:{1}".format(self.driver.hostname, self.driver.port)
+
     def namestr(self, obj, namespace):
         return [name for name in namespace if namespace[name] is obj]
 
     def read_from_hdf5(self, filename):
+        # h5py, pandas and pyarrow are optional and slow to import, so they are only imported when needed
+        import h5py
+
         print("Loaded " + filename)
         return h5py.File(filename, 'r')
 
-    def send_matrix(self, matrix, print_times=False, layout="MC_MR"):
+    def send_matrix(self, matrix, print_times=False, layout="MC_MR", name=""):
         max_block_rows = 100
         max_block_cols = 20000
 
+        # Matrices on disk (a .npy file, a directory of .npy row shards, a shard manifest or an np.memmap) are read
+        # a message at a time while they are sent
+        if isinstance(matrix, str):
+            matrix = ShardedArray.open(matrix)
+            if matrix is None:
+                return None
+        elif isinstance(matrix, np.memmap):
+            matrix = ShardedArray.from_memmap(matrix)
+
         (num_rows, num_cols) = matrix.shape
 
+        # scipy.sparse matrices are sent as their nonzero entries
+        sparse = hasattr(matrix, "tocoo")
+
+        key = None
+        if self.matrix_registry is not None and not sparse:
+            key = MatrixRegistry.get_key(matrix, layout)
+            mh = self.matrix_registry.lookup(key, self.get_server_name())
+            if mh is not None:
+                print("Array already in Alchemist as matrix {0}".format(mh.id))
+                return mh.set_session(self)
+
         print("Sending array info to Alchemist ... ", end="", flush=True)
         start = time.time()
-        mh = self.get_matrix_handle(matrix, layout=layout)
+        mh = self.get_matrix_handle(matrix, name, sparse=1 if sparse else 0, layout=layout)
         end = time.time()
         print("done ({0:.4e}s)".format(end - start))
 
         print("Sending array data to Alchemist ... ", end="", flush=True)
         start = time.time()
-        times = self.workers.send_matrix_blocks(mh, matrix)
+        hashes = None
+        if sparse:
+            times = self.workers.send_sparse_blocks(mh, matrix)
+        elif self.hash_sent_blocks:
+            hashes = {worker.id: {} for worker in self.workers.workers}
+            times = self.workers.update_matrix_blocks(mh, matrix, hashes)
+        else:
+            times = self.workers.send_matrix_blocks(mh, matrix)
         end = time.time()
         print("done ({0:.4e}s)".format(end - start))
         if print_times:
             self.print_times(times, name=mh.name)
         #     self.driver.send_block(mh, block)
 
+        if all(error_code == 0 for worker in self.workers.workers for error_code in worker.error_codes):
+            if hashes is not None:
+                self.block_hashes[mh.id] = hashes
+            if key is not None:
+                self.matrix_registry.add(key, mh, self.get_server_name())
+
         return mh
 
-    def fetch_matrix(self, mh, print_times=False):
+    def send_matrices(self, matrices, print_times=False, layout="MC_MR", names=None):
+        # Sends many (typically small) dense matrices, returning their handles in the same order. The information of
+        # all matrices is sent to the driver in one batch, and the blocks of all matrices to each worker, without
+        # waiting for replies in between, so a matrix costs far less than a round trip. Matrices that are not NumPy
+        # arrays (files, memmaps or sparse matrices) are sent one at a time with send_matrix. If Alchemist does not
+        # create one of the matrices, no blocks are sent and None is returned.
+        if names is None:
+            names = [""] * len(matrices)
+        handles = [None] * len(matrices)
+        batch = []
+        for i, (matrix, name) in enumerate(zip(matrices, names)):
+            if not isinstance(matrix, np.ndarray) or isinstance(matrix, np.memmap):
+                handles[i] = self.send_matrix(matrix, print_times, layout, name)
+                continue
+            if matrix.ndim == 1:
+                matrix = matrix.reshape((-1, 1))
+            key = None
+            if self.matrix_registry is not None:
+                key = MatrixRegistry.get_key(matrix, layout)
+                handles[i] = self.matrix_registry.lookup(key, self.get_server_name())
+                if handles[i] is not None:
+                    handles[i].set_session(self)
+                    continue
+            batch.append((i, matrix, name, key))
+
+        if len(batch) == 0:
+            return handles
+
+        print("Sending info of {0} arrays to Alchemist ... ".format(len(batch)), end="", flush=True)
+        start = time.time()
+        infos = [(name, matrix.shape[0], matrix.shape[1], 0, MatrixHandle.layouts[layout])
+                 for _, matrix, name, _ in batch]
+        created_handles = self.driver.send_matrix_infos(infos)
+        end = time.time()
+        failed = [k for k, ah in enumerate(created_handles) if not isinstance(ah, MatrixHandle)]
+        if len(failed) > 0:
+            # No blocks are sent, since the handles returned could not all be used
+            print("failed")
+            for k in failed:
+                i, matrix, name, _ = batch[k]
+                print("ERROR: Alchemist did not create array {0} ({1} x {2}, matrix {3} of {4})".format(
+                    name, matrix.shape[0], matrix.shape[1], i + 1, len(matrices)))
+            return None
+        batch_handles = [self.attach_matrix_handle(ah, matrix.dtype)
+                         for ah, (_, matrix, _, _) in zip(created_handles, batch)]
+        print("done ({0:.4e}s)".format(end - start))
+
+        print("Sending data of {0} arrays to Alchemist ... ".format(len(batch)), end="", flush=True)
+        start = time.time()
+        times = self.workers.send_matrices(batch_handles, [matrix for _, matrix, _, _ in batch])
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times)
+
+        succeeded = all(error_code == 0 for worker in self.workers.workers for error_code in worker.error_codes)
+        for mh, (i, _, _, key) in zip(batch_handles, batch):
+            handles[i] = mh
+            if key is not None and succeeded:
+                self.matrix_registry.add(key, mh, self.get_server_name())
+        return handles
+
+    def fetch_matrices(self, handles, print_times=False):
+        # Fetches many (typically small) matrices, returning them in the same order; the requests for the blocks of
+        # all dense matrices are sent to each worker without waiting for replies in between
+        matrices = [None] * len(handles)
+        dense = []
+        for i, mh in enumerate(handles):
+            if mh.sparse:
+                matrices[i] = self.fetch_sparse_matrix(mh, print_times)
+            else:
+                matrices[i] = np.zeros((mh.num_rows, mh.num_cols), dtype=mh.dtype)
+                dense.append(i)
 
-        matrix = np.zeros((mh.num_rows, mh.num_cols))
+        if len(dense) == 0:
+            return matrices
+
+        print("Fetching data of {0} arrays from Alchemist ... ".format(len(dense)), end="", flush=True)
+        start = time.time()
+        times = self.workers.get_matrices([handles[i] for i in dense], [matrices[i] for i in dense])
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times)
+        return matrices
+
+    def fetch_matrix(self, mh, print_times=False, dtype=None, out=None, rows=None, cols=None):
+
+        # rows and cols select a range of rows and columns (a slice or a (start, stop) pair), the whole matrix if
+        # they are not given
+        row_range = self.get_fetch_range(rows, mh.num_rows)
+        col_range = self.get_fetch_range(cols, mh.num_cols)
+        if row_range is None or col_range is None:
+            return None
+        shape = (row_range[1] - row_range[0], col_range[1] - col_range[0])
+
+        if mh.sparse:
+            if out is not None:
+                print("ERROR: Sparse matrices cannot be fetched into an output array")
+                return None
+            matrix = self.fetch_sparse_matrix(mh, print_times, dtype)
+            if rows is None and cols is None:
+                return matrix
+            return matrix[row_range[0]:row_range[1], col_range[0]:col_range[1]]
+
+        if out is None:
+            # The array has the element type the matrix was sent with unless another dtype is asked for
+            matrix = np.zeros(shape, dtype=mh.dtype if dtype is None else dtype)
+        elif out.shape != shape:
+            print("ERROR: Output array has shape {0}, the fetched part of the matrix has shape {1}".format(
+                out.shape, shape))
+            return None
+        else:
+            # Blocks are written straight into out (which may be an np.memmap), so no other copy of the matrix is made
+            matrix = out
 
         print("Fetching data for array {0} from Alchemist ... ".format(mh.name), end="", flush=True)
         start = time.time()
-        matrix, times = self.workers.get_matrix_blocks(mh, matrix)
+        # Ranges larger than the cache, and matrices whose tiles do not fit in it, are fetched straight into the
+        # array without the cache
+        max_bytes = self.block_cache.max_bytes
+        if 0 < shape[0] * shape[1] * mh.dtype.itemsize <= max_bytes and \
+                self.block_cache.get_tile_bytes(mh.num_rows, mh.num_cols, mh.dtype.itemsize) <= max_bytes:
+            matrix, times = self.fetch_cached_blocks(mh, matrix, row_range, col_range)
+        else:
+            matrix, times = self.workers.get_matrix_blocks(mh, matrix, row_range[0], col_range[0])
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times and times is not None:
+            self.print_times(times, name=mh.name)
+        return matrix
+
+    def fetch_cached_blocks(self, mh, matrix, row_range, col_range):
+        # Fills matrix, which holds the rows and columns in row_range and col_range, from the cached tiles of the
+        # matrix; the tiles that are not cached are fetched and cached, in as few rectangles of missing tiles as
+        # possible. Rectangles inside the range are received straight into matrix, only those that stick out of it
+        # (or need another element type) go through a temporary array. Returns no times if nothing had to be fetched.
+        cache = self.block_cache
+
+        def copy_tile(block, tile_rows, tile_cols):
+            first_row, last_row = max(tile_rows[0], row_range[0]), min(tile_rows[1], row_range[1])
+            first_col, last_col = max(tile_cols[0], col_range[0]), min(tile_cols[1], col_range[1])
+            matrix[first_row - row_range[0]:last_row - row_range[0],
+                   first_col - col_range[0]:last_col - col_range[0]] = \
+                block[first_row - tile_rows[0]:last_row - tile_rows[0],
+                      first_col - tile_cols[0]:last_col - tile_cols[0]]
+
+        missing = []
+        for tile in cache.get_tiles(row_range, col_range):
+            tile_rows, tile_cols = cache.get_tile_range(tile, mh.num_rows, mh.num_cols)
+            block = cache.get(mh.id, tile)
+            if block is None:
+                missing.append(tile)
+            else:
+                copy_tile(block, tile_rows, tile_cols)
+
+        if len(missing) == 0:
+            return matrix, None
+
+        times = [[[], [], [], []] for _ in range(self.workers.num_workers)]
+        for first_row, last_row, first_col, last_col in cache.get_tile_rectangles(missing):
+            rows = (cache.get_tile_range((first_row, 0), mh.num_rows, mh.num_cols)[0][0],
+                    cache.get_tile_range((last_row, 0), mh.num_rows, mh.num_cols)[0][1])
+            cols = (cache.get_tile_range((0, first_col), mh.num_rows, mh.num_cols)[1][0],
+                    cache.get_tile_range((0, last_col), mh.num_rows, mh.num_cols)[1][1])
+            direct = row_range[0] <= rows[0] and rows[1] <= row_range[1] and \
+                col_range[0] <= cols[0] and cols[1] <= col_range[1] and matrix.dtype == mh.dtype
+            if direct:
+                fetched = matrix[rows[0] - row_range[0]:rows[1] - row_range[0],
+                                 cols[0] - col_range[0]:cols[1] - col_range[0]]
+            else:
+                fetched = np.zeros((rows[1] - rows[0], cols[1] - cols[0]), dtype=mh.dtype)
+            fetched, fetch_times = self.workers.get_matrix_blocks(mh, fetched, rows[0], cols[0])
+            for worker_times, block_times in zip(times, fetch_times):
+                for k in range(4):
+                    worker_times[k].extend(block_times[k])
+
+            for i in range(first_row, last_row + 1):
+                for j in range(first_col, last_col + 1):
+                    tile_rows, tile_cols = cache.get_tile_range((i, j), mh.num_rows, mh.num_cols)
+                    block = fetched[tile_rows[0] - rows[0]:tile_rows[1] - rows[0],
+                                    tile_cols[0] - cols[0]:tile_cols[1] - cols[0]]
+                    if not direct:
+                        copy_tile(block, tile_rows, tile_cols)
+                    cache.put(mh.id, (i, j), block.copy())
+        return matrix, times
+
+    def iter_rows(self, mh, chunk_rows=0, rows=None):
+        # Yields the rows of a matrix (or the rows in rows, a slice or (start, stop) pair) in blocks of chunk_rows
+        # rows. The next block is fetched in the background while the caller works on the current one, so at most
+        # two blocks are held at a time. Other transfers of the session wait for the block being prefetched.
+        if mh.sparse:
+            print("ERROR: Rows of sparse matrices cannot be iterated over, use fetch_matrix instead")
+            return
+        row_range = self.get_fetch_range(rows, mh.num_rows)
+        if row_range is None:
+            return
+        if chunk_rows <= 0:
+            chunk_rows = max(1, self.iter_chunk_bytes // max(1, mh.num_cols * mh.dtype.itemsize))
+
+        def fetch_rows(start):
+            block = np.zeros((min(chunk_rows, row_range[1] - start), mh.num_cols), dtype=mh.dtype)
+            block, _ = self.workers.get_matrix_blocks(mh, block, start, 0)
+            return block
+
+        starts = range(row_range[0], row_range[1], chunk_rows)
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        try:
+            for i, start in enumerate(starts):
+                block = fetch_rows(start) if pending is None else pending.result()
+                pending = executor.submit(fetch_rows, starts[i + 1]) if i + 1 < len(starts) else None
+                yield block
+        finally:
+            # A block may still be arriving if the caller stopped early, the connections are only free once it has
+            if pending is not None:
+                pending.exception()
+            executor.shutdown()
+
+    @staticmethod
+    def get_fetch_range(r, length):
+        if r is None:
+            return 0, length
+        start, stop, step = (r if isinstance(r, slice) else slice(*r)).indices(length)
+        if step != 1:
+            print("ERROR: Only contiguous ranges of rows and columns can be fetched")
+            return None
+        return start, max(start, stop)
+
+    def fetch_sparse_matrix(self, mh, print_times=False, dtype=None):
+        # scipy is optional and only needed for sparse matrices
+        import scipy.sparse
+
+        print("Fetching data for sparse array {0} from Alchemist ... ".format(mh.name), end="", flush=True)
+        start = time.time()
+        entries, times = self.workers.get_sparse_blocks(mh)
+        if len(entries) == 0:
+            entries = [(np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=mh.dtype))]
+        row_indices, col_indices, values = (np.concatenate(e) for e in zip(*entries))
+        # Layouts that replicate the matrix return the same entries from several workers, each is only kept once
+        _, unique = np.unique(row_indices * mh.num_cols + col_indices, return_index=True)
+        row_indices, col_indices, values = row_indices[unique], col_indices[unique], values[unique]
+        matrix = scipy.sparse.csr_matrix((values, (row_indices, col_indices)), shape=(mh.num_rows, mh.num_cols),
+                                         dtype=mh.dtype if dtype is None else dtype)
         end = time.time()
         print("done ({0:.4e}s)".format(end - start))
         if print_times:
@@ -89,6 +424,11 @@ class AlchemistSession:
             receive_times = times[i][2]
             deserialization_times = times[i][3]
 
+            if len(serialization_times) == 0:
+                print("{0}    {1:3d}   |       no messages".format(spacing, i + 1))
+                if i < self.workers.num_workers - 1:
+                    print("{0}{1}".format(spacing, ' -' * 55))
+                continue
             print("{0}    {1:3d}   |       {2:.4e}       |       {3:.4e}       |       {4:.4e}       |       {5:.4e}       ".format(
                     spacing, i + 1, serialization_times[0], send_times[0], receive_times[0], deserialization_times[0]))
             for j in range(1, len(serialization_times)):
@@ -99,32 +439,281 @@ class AlchemistSession:
         print("{}---------------------------------------------------------------------------------------------------------------".format(spacing))
         print("")
 
-    def send_hdf5(self, f):
+    def send_hdf5(self, f, name="", print_times=False, layout="MC_MR"):
+        # f is an h5py dataset, or a file or group holding the dataset called name. The dataset is read in bands of
+        # whole rows of its chunks, so that every chunk is read once and in order, and each band is sent to the
+        # workers while the next one is read from disk.
+        dataset = f if hasattr(f, "shape") else f[name]
+        (num_rows, num_cols) = dataset.shape
+
+        print("Sending array info to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        mh = self.get_matrix_handle(dataset, name=name, layout=layout)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+
+        # One band is read ahead while the other is sent, so two band buffers are enough
+        band_rows = self.get_hdf5_band_rows(dataset, mh.dtype)
+        bands = [np.empty((band_rows, num_cols), dtype=mh.dtype) for _ in range(2)]
+
+        def read_band(b):
+            row_start = b * band_rows
+            row_end = min(num_rows, row_start + band_rows)
+            band = bands[b % 2][0:row_end - row_start]
+            dataset.read_direct(band, np.s_[row_start:row_end], np.s_[0:row_end - row_start])
+            return band
+
+        print("Sending array data to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        times = self.send_bands(mh, list(range(0, num_rows, band_rows)), read_band)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times, name=mh.name)
+
+        return mh
+
+    def update_matrix(self, mh, matrix, print_times=False):
+        # Sends a new version of a matrix to Alchemist in place of the old one. Each worker's share is hashed in the
+        # blocks it is sent in, and only the blocks that changed since the matrix was last sent or updated are sent.
+        # Values are sent with the element type of the matrix.
+        if isinstance(matrix, np.memmap):
+            matrix = ShardedArray.from_memmap(matrix)
+        if mh.sparse or hasattr(matrix, "tocoo"):
+            print("ERROR: Sparse matrices cannot be updated, send them again with send_matrix")
+            return None
+        if matrix.shape != (mh.num_rows, mh.num_cols):
+            print("ERROR: Array of shape {0} cannot update array {1} of shape {2}".format(
+                matrix.shape, mh.name, (mh.num_rows, mh.num_cols)))
+            return None
+        if isinstance(matrix, ShardedArray):
+            # Arrays on disk are not cast, that would read them into memory
+            if matrix.dtype != mh.dtype:
+                print("ERROR: Array of type {0} cannot update array {1} of type {2}".format(
+                    matrix.dtype, mh.name, mh.dtype))
+                return None
+        else:
+            matrix = np.asarray(matrix).astype(mh.dtype, copy=False)
 
-        sh = f.shape
+        hashes = self.block_hashes.get(mh.id)
+        if hashes is None:
+            hashes = {worker.id: {} for worker in self.workers.workers}
+        # Dropped before sending, so that the hashes are not trusted if the update fails part of the way
+        self.invalidate_matrix(mh.id)
 
-        num_rows = sh[0]
-        num_cols = sh[1]
+        print("Updating array {0} ... ".format(mh.name), end="", flush=True)
+        start = time.time()
+        times = self.workers.update_matrix_blocks(mh, matrix, hashes)
+        end = time.time()
+        num_sent = sum(len(worker_times[1]) for worker_times in times)
+        num_blocks = sum(len(worker_hashes) for worker_hashes in hashes.values())
+        print("done, {0} of {1} blocks sent ({2:.4e}s)".format(num_sent, num_blocks, end - start))
 
-        mh = self.get_matrix_handle(f)
+        if all(error_code == 0 for worker in self.workers.workers for error_code in worker.error_codes):
+            self.block_hashes[mh.id] = hashes
+        if print_times:
+            self.print_times(times, name=mh.name)
+        return mh
 
-        chunk = 1000
+    def invalidate_matrix(self, matrix_id):
+        # Forgets the cached blocks, block hashes and registry entry of a matrix whose contents may have changed
+        self.block_cache.invalidate(matrix_id)
+        self.block_hashes.pop(matrix_id, None)
+        if self.matrix_registry is not None:
+            self.matrix_registry.remove(matrix_id, self.get_server_name())
 
-        for i in range(0, num_rows, chunk):
-            self.workers.send_matrix_blocks(mh, np.float64(f[i:min(num_rows, i+chunk), :]), i)
+    def create_matrix(self, num_rows, num_cols, dtype=np.float64, name="", layout="MC_MR"):
+        # Creates a matrix with room for num_rows rows, which are then sent in batches with append_rows
+        print("Sending array info to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        mh = self.create_matrix_handle(num_rows, num_cols, dtype, name, layout=layout)
+        mh.set_num_appended_rows(0)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        return mh
 
+    def append_rows(self, mh, rows, print_times=False):
+        # Sends rows as the next rows of a matrix made with create_matrix; each worker gets the rows it owns under
+        # the matrix's layout. Alchemist cannot resize matrices, so the rows must fit into the matrix.
+        rows = np.asarray(rows)
+        if rows.ndim == 1:
+            rows = rows.reshape((1, -1))
+        if rows.shape[1] != mh.num_cols:
+            print("ERROR: Rows with {0} columns cannot be appended to array {1} with {2} columns".format(
+                rows.shape[1], mh.name, mh.num_cols))
+            return None
+        if mh.num_appended_rows + rows.shape[0] > mh.num_rows:
+            print("ERROR: Array {0} has room for {1} more rows, {2} rows cannot be appended".format(
+                mh.name, mh.num_rows - mh.num_appended_rows, rows.shape[0]))
+            return None
+
+        print("Appending {0} rows to array {1} ... ".format(rows.shape[0], mh.name), end="", flush=True)
+        start = time.time()
+        times = self.workers.send_matrix_band(mh, rows.astype(mh.dtype, copy=False), mh.num_appended_rows)
+        mh.set_num_appended_rows(mh.num_appended_rows + rows.shape[0])
+        self.invalidate_matrix(mh.id)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times, name=mh.name)
         return mh
 
+    def send_row_batches(self, batches, max_rows=0, name="", print_times=False, layout="MC_MR"):
+        # Sends the batches of rows produced by an iterable as one matrix. With max_rows, an upper bound on the total
+        # number of rows, every batch is appended as it arrives to a matrix of max_rows rows (rows after the last
+        # batch are left unset). Otherwise the batches are written to temporary .npy shards, which are sent as a
+        # matrix of the right size after the last batch. Empty batches are skipped.
+        if max_rows > 0:
+            mh = None
+            for batch in batches:
+                batch = np.asarray(batch)
+                if batch.ndim == 1:
+                    batch = batch.reshape((1, -1))
+                if batch.shape[0] == 0:
+                    continue
+                if mh is None:
+                    mh = self.create_matrix(max_rows, batch.shape[1], batch.dtype, name, layout)
+                if self.append_rows(mh, batch, print_times) is None:
+                    return None
+            if mh is None:
+                print("ERROR: No rows to send")
+            return mh
+
+        with tempfile.TemporaryDirectory() as directory:
+            first = None
+            for i, batch in enumerate(batches):
+                batch = np.asarray(batch)
+                if batch.ndim == 1:
+                    batch = batch.reshape((1, -1))
+                if batch.shape[0] == 0:
+                    continue
+                if first is None:
+                    first = batch
+                elif batch.shape[1] != first.shape[1]:
+                    print("ERROR: Batch {0} has {1} columns, the first batch has {2}".format(
+                        i + 1, batch.shape[1], first.shape[1]))
+                    return None
+                np.save(os.path.join(directory, "{0:08d}.npy".format(i)), batch.astype(first.dtype, copy=False))
+            if first is None:
+                print("ERROR: No rows to send")
+                return None
+            return self.send_matrix(directory, print_times, layout, name)
+
+    def send_bands(self, mh, band_offsets, read_band, num_readers=1):
+        # Sends the bands of rows returned by read_band(b), which start at rows band_offsets[b] of the matrix. Up to
+        # num_readers bands are read on separate threads while the current band is sent to the workers.
+        times = [[[], [], [], []] for _ in range(self.workers.num_workers)]
+        num_bands = len(band_offsets)
+        with ThreadPoolExecutor(max_workers=num_readers) as reader:
+            pending = [reader.submit(read_band, b) for b in range(min(num_readers, num_bands))]
+            for b in range(num_bands):
+                band = pending.pop(0).result()
+                if b + num_readers < num_bands:
+                    pending.append(reader.submit(read_band, b + num_readers))
+                for worker_times, band_times in zip(times, self.workers.send_matrix_band(mh, band, band_offsets[b])):
+                    for k in range(4):
+                        worker_times[k].extend(band_times[k])
+        return times
+
+    def send_parquet(self, path, columns=None, name="", print_times=False, layout="MC_MR", num_readers=4):
+        # Sends the numeric columns (or the given columns) of a Parquet file as a matrix with one row per record.
+        # Each row group is a band of rows; num_readers row groups are decoded in parallel while others are sent.
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        schema = parquet_file.schema_arrow
+        columns = ArrowBlocks.get_columns(schema, columns)
+        if columns is None:
+            return None
+        dtype = ArrowBlocks.get_dtype(schema, columns)
+
+        metadata = parquet_file.metadata
+        band_offsets = [0]
+        for g in range(metadata.num_row_groups):
+            band_offsets.append(band_offsets[-1] + metadata.row_group(g).num_rows)
+        num_rows = band_offsets.pop()
+
+        print("Sending array info to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        mh = self.create_matrix_handle(num_rows, len(columns), dtype, name, layout=layout)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+
+        def read_band(g):
+            # Every reader opens the file itself, since ParquetFile objects are not safe to share between threads
+            row_group = pq.ParquetFile(path).read_row_group(g, columns=columns, use_threads=False)
+            return ArrowBlocks.to_rows(row_group, columns, mh.dtype)
+
+        print("Sending array data to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        times = self.send_bands(mh, band_offsets, read_band, num_readers)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times, name=mh.name)
+
+        return mh
+
+    def send_arrow_table(self, table, columns=None, name="", print_times=False, layout="MC_MR", band_rows=100000,
+                         num_readers=4):
+        # Sends the numeric columns (or the given columns) of a pyarrow Table, assembled into row-major bands of
+        # band_rows rows on num_readers threads while other bands are sent
+        columns = ArrowBlocks.get_columns(table.schema, columns)
+        if columns is None:
+            return None
+
+        print("Sending array info to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        mh = self.create_matrix_handle(table.num_rows, len(columns), ArrowBlocks.get_dtype(table.schema, columns),
+                                       name, layout=layout)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+
+        band_offsets = list(range(0, table.num_rows, band_rows))
+
+        def read_band(b):
+            return ArrowBlocks.to_rows(table.slice(band_offsets[b], band_rows), columns, mh.dtype)
+
+        print("Sending array data to Alchemist ... ", end="", flush=True)
+        start = time.time()
+        times = self.send_bands(mh, band_offsets, read_band, num_readers)
+        end = time.time()
+        print("done ({0:.4e}s)".format(end - start))
+        if print_times:
+            self.print_times(times, name=mh.name)
+
+        return mh
+
+    def get_hdf5_band_rows(self, dataset, dtype):
+        # Bands are about hdf5_band_bytes long and made of whole rows of chunks, two of them are held in memory
+        row_bytes = max(1, dataset.shape[1] * dtype.itemsize)
+        chunk_rows = dataset.chunks[0] if dataset.chunks is not None else 1
+        num_chunk_rows = max(1, self.hdf5_band_bytes // (row_bytes * chunk_rows))
+        return max(1, min(dataset.shape[0], num_chunk_rows * chunk_rows))
+
     def get_matrix_handle(self, data=[], name="", sparse=0, layout="MC_MR"):
         # print("Sending matrix info to Alchemist ... ", end="", flush=True)
         # start = time.time()
         (num_rows, num_cols) = data.shape
 
-        ah = self.driver.send_matrix_info(name, num_rows, num_cols, sparse, MatrixHandle.layouts[layout])
+        ah = self.create_matrix_handle(num_rows, num_cols, data.dtype, name, sparse, layout)
         # end = time.time()
         # print("done ({0:.4e})".format(end - start))
         return ah
 
+    def create_matrix_handle(self, num_rows, num_cols, dtype=np.float64, name="", sparse=0, layout="MC_MR"):
+        ah = self.driver.send_matrix_info(name, num_rows, num_cols, sparse, MatrixHandle.layouts[layout])
+        return self.attach_matrix_handle(ah, dtype)
+
+    def attach_matrix_handle(self, ah, dtype):
+        # Element types that cannot be sent as they are (such as bool or float16) are sent as float64
+        ah.set_dtype(Message.get_element_dtype(dtype).newbyteorder('='))
+        ah.set_session(self)
+        ah.set_num_appended_rows(ah.num_rows)
+        # Alchemist may reuse the ID of a matrix that no longer exists
+        self.invalidate_matrix(ah.id)
+        return ah
+
     def load_library(self, name, path=""):
         if self.workers_connected:
             lib_id = self.driver.load_library(name, path)
@@ -150,6 +739,17 @@ class AlchemistSession:
         print("Alchemist started task '" + name + "' ... ", end="", flush=True)
         start = time.time()
         out_args = self.driver.run_task(lib_id, name, in_args)
+        # Tasks may overwrite the matrices they are given or return (also under existing IDs), so what is known
+        # about their blocks is dropped
+        for p in list(in_args.values()) + list(out_args.values()):
+            if p.datatype == Parameter.datatypes["MATRIX_ID"]:
+                self.invalidate_matrix(p.value)
+            elif isinstance(p.value, MatrixHandle):
+                self.invalidate_matrix(p.value.id)
+        # Handles of the matrices a task returns can be fetched, sliced and iterated over like those of sent matrices
+        for p in out_args.values():
+            if isinstance(p.value, MatrixHandle):
+                p.value.set_session(self)
         end = time.time()
         print("done ({0:.4e}s)".format(end - start))
         return out_args
@@ -183,6 +783,9 @@ class AlchemistSession:
         self.driver.list_available_libraries()
 
     def convert_hdf5_to_parquet(self, h5_file, parquet_file, chunksize=100000):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
 
         stream = pd.read_hdf(h5_file, chunksize=chunksize)
 
@@ -291,6 +894,9 @@ class AlchemistSession:
     def close(self):
         self.driver.close()
         self.workers.close()
+        self.buffer_pool.clear()
+        self.block_cache.clear()
+        self.block_hashes = {}
 
 
 
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class ArrowBlocks:
+
+    # Assembles numeric Arrow columns into row-major blocks. Values are read straight from the Arrow buffers, which
+    # avoids pandas (pyarrow's to_numpy imports it) and copies every value once, into the block. pyarrow is optional
+    # and only imported when these methods are used.
+
+    @staticmethod
+    def is_numeric(arrow_type):
+        import pyarrow as pa
+
+        return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_boolean(arrow_type)
+
+    @staticmethod
+    def get_columns(schema, columns=None):
+        # The named columns, or all numeric columns of the schema; returns None after printing an error if a named
+        # column is not numeric
+        if columns is None:
+            return [field.name for field in schema if ArrowBlocks.is_numeric(field.type)]
+
+        for name in columns:
+            if not ArrowBlocks.is_numeric(schema.field(name).type):
+                print("ERROR: Column '{0}' is not numeric and cannot be sent to Alchemist".format(name))
+                return None
+        return list(columns)
+
+    @staticmethod
+    def get_dtype(schema, columns):
+        dtypes = [ArrowBlocks.get_value_dtype(schema.field(name).type) for name in columns]
+        return np.result_type(*dtypes)
+
+    @staticmethod
+    def get_value_dtype(arrow_type):
+        import pyarrow as pa
+
+        if pa.types.is_boolean(arrow_type):
+            return np.dtype(np.uint8)
+        return np.dtype(arrow_type.to_pandas_dtype())
+
+    @staticmethod
+    def get_values(array):
+        # Values of a numeric pyarrow Array, as a view of its data buffer except for booleans (which are bit-packed).
+        # Nulls are replaced by NaN in floating point columns and by 0 in the others.
+        import pyarrow as pa
+
+        validity, data = array.buffers()[0:2]
+        if pa.types.is_boolean(array.type):
+            bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")
+            values = bits[array.offset:array.offset + len(array)]
+        else:
+            dtype = ArrowBlocks.get_value_dtype(array.type)
+            values = np.frombuffer(data, dtype=dtype, count=len(array), offset=array.offset * dtype.itemsize)
+
+        if array.null_count > 0:
+            bits = np.unpackbits(np.frombuffer(validity, dtype=np.uint8), bitorder="little")
+            valid = bits[array.offset:array.offset + len(array)].astype(bool)
+            values = np.where(valid, values, np.nan if values.dtype.kind == "f" else 0)
+        return values
+
+    @staticmethod
+    def to_rows(table, columns, dtype):
+        # Returns the columns of a pyarrow Table (or RecordBatch) as a row-major array
+        block = np.empty((table.num_rows, len(columns)), dtype=dtype)
+        for j, name in enumerate(columns):
+            column = table.column(name)
+            chunks = column.chunks if hasattr(column, "chunks") else [column]
+            row = 0
+            for chunk in chunks:
+                block[row:row + len(chunk), j] = ArrowBlocks.get_values(chunk)
+                row += len(chunk)
+        return block
@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+
+
+class BlockCache:
+
+    # Blocks of fetched matrices, kept on the client so that fetching the same rows and columns again needs no
+    # transfer. The matrix is divided into tiles of tile_rows x tile_cols elements, so overlapping fetches share
+    # tiles; the least recently used tiles are dropped once the cached tiles hold more than max_bytes.
+    tile_rows = 1024
+    tile_cols = 1024
+    max_bytes = 0
+
+    num_bytes = 0
+    hits = 0
+    misses = 0
+    blocks = {}
+
+    def __init__(self, max_bytes=0, tile_rows=1024, tile_cols=1024):
+        self.max_bytes = max_bytes
+        self.tile_rows = tile_rows
+        self.tile_cols = tile_cols
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Keyed by (matrix ID, tile row, tile column), in order of use from least to most recent
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_tiles(self, rows, cols):
+        # The tiles that hold part of the rows and columns in [start, stop)
+        if rows[1] <= rows[0] or cols[1] <= cols[0]:
+            return []
+        return [(i, j) for i in range(rows[0] // self.tile_rows, (rows[1] - 1) // self.tile_rows + 1)
+                for j in range(cols[0] // self.tile_cols, (cols[1] - 1) // self.tile_cols + 1)]
+
+    def get_tile_range(self, tile, num_rows, num_cols):
+        # The rows and columns [start, stop) of a tile of a num_rows x num_cols matrix
+        row_start = tile[0] * self.tile_rows
+        col_start = tile[1] * self.tile_cols
+        return ((row_start, min(num_rows, row_start + self.tile_rows)),
+                (col_start, min(num_cols, col_start + self.tile_cols)))
+
+    def get_tile_bytes(self, num_rows, num_cols, item_size):
+        # Size of the largest tile of a num_rows x num_cols matrix
+        return min(num_rows, self.tile_rows) * min(num_cols, self.tile_cols) * item_size
+
+    def get_tile_rectangles(self, tiles):
+        # Groups tiles, given in row-major order, into rectangles of tiles [first row, last row, first column, last
+        # column] that hold no other tiles: consecutive tiles of a tile row form a run, and runs over the same tile
+        # columns in consecutive tile rows are joined
+        runs = []
+        for i, j in tiles:
+            if len(runs) > 0 and runs[-1][0] == i and runs[-1][2] == j - 1:
+                runs[-1][2] = j
+            else:
+                runs.append([i, j, j])
+
+        rectangles = []
+        last = {}
+        for i, first_col, last_col in runs:
+            rectangle = last.get((first_col, last_col))
+            if rectangle is not None and rectangle[1] == i - 1:
+                rectangle[1] = i
+            else:
+                rectangle = [i, i, first_col, last_col]
+                rectangles.append(rectangle)
+                last[(first_col, last_col)] = rectangle
+        return rectangles
+
+    def get(self, matrix_id, tile):
+        key = (matrix_id, tile[0], tile[1])
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, matrix_id, tile, block):
+        if block.nbytes > self.max_bytes:
+            return
+        key = (matrix_id, tile[0], tile[1])
+        with self.lock:
+            previous = self.blocks.pop(key, None)
+            if previous is not None:
+                self.num_bytes -= previous.nbytes
+            self.blocks[key] = block
+            self.num_bytes += block.nbytes
+            self.evict()
+
+    def evict(self):
+        while self.num_bytes > self.max_bytes and self.blocks:
+            _, block = self.blocks.popitem(last=False)
+            self.num_bytes -= block.nbytes
+
+    def invalidate(self, matrix_id):
+        # Drops the tiles of a matrix whose contents have changed
+        with self.lock:
+            for key in [key for key in self.blocks if key[0] == matrix_id]:
+                self.num_bytes -= self.blocks.pop(key).nbytes
+
+    def clear(self):
+        with self.lock:
+            self.blocks = OrderedDict()
+            self.num_bytes = 0
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    def get_num_bytes(self):
+        return self.num_bytes
+
+    def get_hits(self):
+        return self.hits
+
+    def get_misses(self):
+        return self.misses
+
+    def reset_counters(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,63 @@
+import threading
+
+
+class BufferPool:
+
+    # Buffers are handed out in power-of-two size classes so that released buffers can be reused for messages of
+    # similar size. Idle buffers are kept for reuse up to max_pooled_bytes in total, beyond that they are freed.
+    min_buffer_length = 4096
+    max_pooled_bytes = 0
+
+    pooled_bytes = 0
+    free_buffers = {}
+
+    def __init__(self, max_pooled_bytes=100000000):
+        self.max_pooled_bytes = max_pooled_bytes
+        self.pooled_bytes = 0
+        self.free_buffers = {}
+        self.lock = threading.Lock()
+
+    def get_size_class(self, length):
+        size = self.min_buffer_length
+        while size < length:
+            size *= 2
+        return size
+
+    def acquire(self, length):
+        size = self.get_size_class(length)
+        with self.lock:
+            buffers = self.free_buffers.get(size)
+            if buffers:
+                self.pooled_bytes -= size
+                return buffers.pop()
+        return bytearray(size)
+
+    def release(self, buffer):
+        size = len(buffer)
+        if size < self.min_buffer_length:
+            return
+        with self.lock:
+            if self.pooled_bytes + size <= self.max_pooled_bytes:
+                self.free_buffers.setdefault(size, []).append(buffer)
+                self.pooled_bytes += size
+
+    def get_pooled_bytes(self):
+        return self.pooled_bytes
+
+    def set_max_pooled_bytes(self, max_pooled_bytes):
+        with self.lock:
+            self.max_pooled_bytes = max_pooled_bytes
+            for size in sorted(self.free_buffers.keys(), reverse=True):
+                buffers = self.free_buffers[size]
+                while buffers and self.pooled_bytes > self.max_pooled_bytes:
+                    buffers.pop()
+                    self.pooled_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.free_buffers = {}
+            self.pooled_bytes = 0
+
+
+# Pool shared by messages that are not given one explicitly
+BufferPool.default = BufferPool()
@@ -0,0 +1,54 @@
+class ChunkPlanner:
+
+    # Splits a share of a matrix, given by strided [start, end, skip] row and column ranges with inclusive ends, into
+    # the blocks sent in one message each. Blocks are bands of whole rows when at least one row fits in a message,
+    # otherwise every row is split into column bands, so that each message is as full as the target allows.
+    min_message_bytes = 1048576
+
+    # Room left in every message for its header and the items that come before the block data
+    overhead_bytes = 100
+
+    buffer_length = 0
+    max_message_length = 0
+
+    def __init__(self, buffer_length, max_message_length=0, min_message_bytes=1048576):
+        self.buffer_length = buffer_length
+        self.max_message_length = max_message_length
+        self.min_message_bytes = min_message_bytes
+
+    def get_message_bytes(self):
+        # Small client buffers are raised to min_message_bytes to amortize the per-message overhead, but never
+        # beyond the length Alchemist accepts, as negotiated in the handshake. Without one (0), messages stay within
+        # the buffer length the client announced.
+        if self.max_message_length > 0:
+            message_bytes = min(max(self.buffer_length, self.min_message_bytes), self.max_message_length)
+        else:
+            message_bytes = self.buffer_length
+        return max(1, message_bytes - self.overhead_bytes)
+
+    def get_chunk_shape(self, num_rows, num_cols, item_size):
+        max_elements = max(1, self.get_message_bytes() // item_size)
+        if num_cols <= max_elements:
+            return max(1, min(num_rows, max_elements // max(1, num_cols))), num_cols
+        return 1, max_elements
+
+    def plan(self, rows, cols, item_size):
+        # Returns the row and column ranges of every block of the share, in row-major order
+        num_rows = len(range(rows[0], rows[1] + 1, rows[2]))
+        num_cols = len(range(cols[0], cols[1] + 1, cols[2]))
+        if num_rows == 0 or num_cols == 0:
+            return []
+
+        chunk_rows, chunk_cols = self.get_chunk_shape(num_rows, num_cols, item_size)
+
+        chunks = []
+        for i in range(0, num_rows, chunk_rows):
+            message_rows = self.get_range(rows, i, min(num_rows, i + chunk_rows))
+            for j in range(0, num_cols, chunk_cols):
+                chunks.append((message_rows, self.get_range(cols, j, min(num_cols, j + chunk_cols))))
+        return chunks
+
+    @staticmethod
+    def get_range(r, first, last):
+        # Range of the elements of r with positions first up to (but excluding) last
+        return [r[0] + first * r[2], r[0] + (last - 1) * r[2], r[2]]
@@ -1,12 +1,20 @@
+import os
 import socket
+import threading
 import time
 import numpy as np
 import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from .Message import Message
 from .Parameter import Parameter
 from .LibraryHandle import LibraryHandle
 from .MatrixHandle import MatrixHandle
+from .MatrixBlock import MatrixBlock
+from .ChunkPlanner import ChunkPlanner
+from .ShardedArray import ShardedArray
 from .WorkerInfo import WorkerInfo
+from .Tracer import Tracer
 
 
 class Client:
@@ -21,12 +29,22 @@ class Client:
 
     sock = []
 
+    # Longest message Alchemist accepts, as negotiated in the handshake (0 if unknown)
+    max_message_length = 0
+
+    # Longer messages are sent in parts; 0 uses max_message_length, or the limit of the body length field
+    max_part_length = 0
+
+    # Messages written back to back by pipeline() before their replies are read
+    queued_messages = bytearray()
+    max_pipelined_messages = 256
+
     connected = False
     verbose = False
     show_overheads = False
 
     def __init__(self, id=0, hostname="host", address="0.0.0.0", port=24960,
-                 buffer_length=10000, verbose=True, show_overheads=False):
+                 buffer_length=10000, verbose=True, show_overheads=False, buffer_pool=None):
         self.id = id
         self.hostname = hostname
         self.address = address
@@ -37,9 +55,10 @@ class Client:
         self.show_overheads = show_overheads
 
         self.sock = []
+        self.queued_messages = bytearray()
 
-        self.input_message = Message(buffer_length + 10)
-        self.output_message = Message(buffer_length + 10)
+        self.input_message = Message(buffer_length + 10, buffer_pool)
+        self.output_message = Message(buffer_length + 10, buffer_pool)
 
     def connect(self):
 
@@ -72,15 +91,39 @@ class Client:
 
         return self.connected
 
+    def release_buffers(self):
+        # Returns the message buffers to the pool while the connection is idle
+        self.input_message.release()
+        self.output_message.release()
+
+    def get_peer_name(self):
+        return "{0}:{1}".format(self.hostname, self.port)
+
     def start_message(self, command):
         return self.output_message.start(self.client_id, self.session_id, command)
 
+    def set_max_part_length(self, max_part_length):
+        self.max_part_length = max_part_length
+
+    def get_max_part_length(self):
+        if self.max_part_length > 0:
+            return min(self.max_part_length, Message.max_message_length)
+        if self.max_message_length > 0:
+            return self.max_message_length
+        return Message.max_message_length
+
     def send_message(self):
         try:
             self.output_message.finish()
-            self.output_message.print()
+            if Tracer.level:
+                Tracer.trace(self.output_message, "Sent to", self.get_peer_name())
             start_time = time.time()
-            self.sock.sendall(self.output_message.get())
+            max_part_length = self.get_max_part_length()
+            if self.output_message.get_message_length() > max_part_length:
+                for segments in self.output_message.get_parts(max_part_length):
+                    self.send_segments(segments)
+            else:
+                self.send_segments(self.output_message.get_segments())
             send_time = time.time() - start_time
             self.output_message.reset()
             return True, send_time
@@ -91,22 +134,144 @@ class Client:
             print("ERROR: Unable to send message (ConnectionError)")
             self.reset_socket(), 0.0
 
-    def receive_message(self):
+    def queue_message(self):
+        # Like send_message, but small messages are collected and sent together by flush_messages, so that many
+        # small messages take few system calls; messages that do not fit into the output buffer are sent at once
+        self.output_message.update_body_length()
+        length = self.output_message.get_message_length()
+        if len(self.queued_messages) + length > self.output_message.max_body_length:
+            self.flush_messages()
+        if length > self.output_message.max_body_length:
+            return self.send_message()
+        self.output_message.finish()
+        if Tracer.level:
+            Tracer.trace(self.output_message, "Queued for", self.get_peer_name())
+        start_time = time.time()
+        for segment in self.output_message.get_segments():
+            self.queued_messages += segment
+        self.output_message.reset()
+        return True, time.time() - start_time
+
+    def flush_messages(self):
+        try:
+            start_time = time.time()
+            if len(self.queued_messages) > 0:
+                self.sock.sendall(self.queued_messages)
+            self.queued_messages = bytearray()
+            return True, time.time() - start_time
+        except InterruptedError:
+            print("ERROR: Unable to send messages (InterruptedError)")
+            self.reset_socket(), 0.0
+        except ConnectionError:
+            print("ERROR: Unable to send messages (ConnectionError)")
+            self.reset_socket(), 0.0
+
+    def pipeline(self, requests):
+        # requests is a list of (write, read, reply_length) triples: write() writes a request into the output message,
+        # read(error_code) reads its reply from the input message, and reply_length is about how long the reply is.
+        # Requests are sent in batches without waiting for replies, which are then read in the order of the requests
+        # (Alchemist handles the messages of a connection in order). A batch ends after max_pipelined_messages
+        # requests or when its replies would no longer fit into the input buffer, so that Alchemist is never left
+        # waiting on a full connection while requests are still being sent.
+        serialization_times = []
+        send_times = []
+        receive_times = []
+        deserialization_times = []
+
+        start = 0
+        while start < len(requests):
+            end = start + 1
+            reply_length = requests[start][2]
+            while end < len(requests) and end - start < self.max_pipelined_messages and \
+                    reply_length + requests[end][2] <= self.input_message.max_body_length:
+                reply_length += requests[end][2]
+                end += 1
+
+            for write, _, _ in requests[start:end]:
+                start_time = time.time()
+                write()
+                serialization_times.append(time.time() - start_time)
+                _, send_time = self.queue_message()
+                send_times.append(send_time)
+            _, send_time = self.flush_messages()
+            send_times[-1] += send_time
+
+            for _, read, _ in requests[start:end]:
+                _, receive_time, error_code = self.receive_message(stream=True)
+                receive_times.append(receive_time)
+                start_time = time.time()
+                read(error_code)
+                deserialization_times.append(time.time() - start_time)
+            start = end
+
+        self.release_buffers()
+
+        return [serialization_times, send_times, receive_times, deserialization_times]
+
+    def send_segments(self, segments):
+        # Sends all buffers with as few system calls as possible, without first joining them into one buffer
+        if len(segments) == 1 or not hasattr(self.sock, "sendmsg"):
+            for segment in segments:
+                self.sock.sendall(segment)
+            return
+
+        while len(segments) > 0:
+            sent = self.sock.sendmsg(segments)
+            while len(segments) > 0 and sent >= len(segments[0]):
+                sent -= len(segments[0])
+                segments.pop(0)
+            if sent > 0:
+                segments[0] = segments[0][sent:]
+
+    def receive_into(self, view):
+        # Fills the memoryview from the socket, looping over short reads; returns False if the connection closed
+        num_bytes = len(view)
+        received = 0
+        while received < num_bytes:
+            packet_length = self.sock.recv_into(view[received:], num_bytes - received)
+            if packet_length == 0:
+                return False
+            received += packet_length
+        return True
+
+    def receive_part(self, message):
+        # Receives the next part of a multipart message and appends its body, without the prefix, to the message
+        header = bytearray(Message.part_header_struct.size)
+        if not self.receive_into(memoryview(header)):
+            raise ConnectionError
+        body_length, _, part, _ = Message.part_header_struct.unpack(header)[4:8]
+        with message.get_part_view(body_length - Message.part_struct.size) as body:
+            if not self.receive_into(body):
+                raise ConnectionError
+        message.message_part = part
+
+    def receive_message(self, stream=False):
+        # The parts of a multipart message are appended to the first as they arrive, unless stream is set: then only
+        # the first part is received here and the others are received while the message is read (see Message.fill),
+        # so that the buffer never holds more than about one part
         try:
-            header = self.sock.recv(self.input_message.get_header_length())
             self.input_message.reset()
+            with self.input_message.get_header_view() as header:
+                if not self.receive_into(header):
+                    return False, 0.0, 0
             start_time = time.time()
-            self.input_message.add_header(header)
+            self.input_message.read_header()
             error_code = self.input_message.get_error_code()
-            remaining_body_length = self.input_message.get_body_length()
-            while remaining_body_length > 0:
-                packet = self.sock.recv(min(remaining_body_length, 8192))
-                if not packet:
+            with self.input_message.get_body_view() as body:
+                if not self.receive_into(body):
                     return False, 0.0, 0
-                remaining_body_length -= len(packet)
-                self.input_message.add_packet(packet)
+            if self.input_message.is_part():
+                self.input_message.read_part_prefix()
+                if stream:
+                    self.input_message.part_source = self.receive_part
+                else:
+                    while self.input_message.message_part < self.input_message.message_parts:
+                        self.receive_part(self.input_message)
+                    self.input_message.finish_parts()
             receive_time = time.time() - start_time
-            self.input_message.print()
+            if Tracer.level:
+                streamed = self.input_message.message_part < self.input_message.message_parts
+                Tracer.trace(self.input_message, "Received from", self.get_peer_name(), streamed)
             return True, receive_time, error_code
         except InterruptedError:
             print("ERROR: Unable to receive message (InterruptedError)")
@@ -137,6 +302,10 @@ class Client:
                 self.input_message.read_string() == "DCBA" and self.input_message.read_double():
             self.client_id = self.input_message.read_client_id()
             self.session_id = self.input_message.read_session_id()
+            # Alchemist may reply with the longest message it accepts, which caps the size of matrix transfers
+            if not self.input_message.eom() and \
+                    self.input_message.preview_next_datatype() == self.input_message.int_code:
+                self.max_message_length = self.input_message.read_int()
             return True
         return False
 
@@ -185,8 +354,9 @@ class DriverClient(Client):
 
     max_alchemist_workers = 0
 
-    def __init__(self, buffer_length=10000, verbose=True, show_overheads=False):
-        Client.__init__(self, buffer_length=buffer_length, verbose=verbose, show_overheads=show_overheads)
+    def __init__(self, buffer_length=10000, verbose=True, show_overheads=False, buffer_pool=None):
+        Client.__init__(self, buffer_length=buffer_length, verbose=verbose, show_overheads=show_overheads,
+                        buffer_pool=buffer_pool)
 
     def __del__(self):
         print("Closing driver client")
@@ -234,13 +404,32 @@ class DriverClient(Client):
         self.receive_message()
         return self.input_message.read_matrix_info()
 
-    def extract_layout(self, num_rows):
-        layout = np.zeros(num_rows, dtype=np.int16)
+    def send_matrix_infos(self, infos):
+        # Sends the information of several matrices, given as (name, num_rows, num_cols, sparse, layout) tuples, in
+        # few round trips; returns their handles in the same order, with 0 for the matrices Alchemist did not create
+        handles = [None] * len(infos)
+        requests = []
+        for i, (name, num_rows, num_cols, sparse, layout) in enumerate(infos):
+
+            def write(name=name, num_rows=num_rows, num_cols=num_cols, sparse=sparse, layout=layout):
+                self.start_message("SEND_MATRIX_INFO")
+                self.output_message.write_string(name)
+                self.output_message.write_long(num_rows)
+                self.output_message.write_long(num_cols)
+                self.output_message.write_byte(1 if sparse else 0)
+                self.output_message.write_byte(layout)
+
+            def read(error_code, i=i):
+                # Rejected requests get a reply with an error code instead of a MATRIX_INFO, their handles are 0
+                handles[i] = self.input_message.read_matrix_info() if error_code == 0 else 0
+
+            requests.append((write, read, 1000))
 
-        for i in range(0, num_rows):
-            layout[i] = self.input_message.read_short()
+        self.pipeline(requests)
+        return handles
 
-        return layout
+    def extract_layout(self, num_rows):
+        return self.input_message.read_shorts(num_rows)
 
     def request_workers(self, num_requested_workers):
         if num_requested_workers == 1:
@@ -256,8 +445,7 @@ class DriverClient(Client):
         if error_code == 0:
             num_allocated_workers = self.input_message.read_short()
             print("{} allocated workers:".format(num_allocated_workers))
-            for i in range(0, num_allocated_workers):
-                workers.append(self.input_message.read_worker_info())
+            workers = self.input_message.read_worker_infos(num_allocated_workers)
 
         return workers
 
@@ -269,50 +457,35 @@ class DriverClient(Client):
         self.send_message()
         self.receive_message()
         num_deallocated_workers = self.input_message.read_short()
-        workers = []
-        for _ in range(num_deallocated_workers):
-            workers.append(self.input_message.read_worker_info())
-        return workers
+        return self.input_message.read_worker_infos(num_deallocated_workers)
 
     def list_all_workers(self):
         self.start_message("LIST_ALL_WORKERS")
         self.send_message()
         self.receive_message()
         num_workers = self.input_message.read_short()
-        workers = []
-        for _ in range(num_workers):
-            workers.append(self.input_message.read_worker_info())
-        return workers
+        return self.input_message.read_worker_infos(num_workers)
 
     def list_active_workers(self):
         self.start_message("LIST_ACTIVE_WORKERS")
         self.send_message()
         self.receive_message()
         num_active_workers = self.input_message.read_short()
-        workers = []
-        for _ in range(num_active_workers):
-            workers.append(self.input_message.read_worker_info())
-        return workers
+        return self.input_message.read_worker_infos(num_active_workers)
 
     def list_inactive_workers(self):
         self.start_message("LIST_INACTIVE_WORKERS")
         self.send_message()
         self.receive_message()
         num_inactive_workers = self.input_message.read_short()
-        workers = []
-        for _ in range(num_inactive_workers):
-            workers.append(self.input_message.read_worker_info())
-        return workers
+        return self.input_message.read_worker_infos(num_inactive_workers)
 
     def list_assigned_workers(self):
         self.start_message("LIST_ASSIGNED_WORKERS")
         self.send_message()
         self.receive_message()
         num_assigned_workers = self.input_message.read_short()
-        workers = []
-        for _ in range(num_assigned_workers):
-            workers.append(self.input_message.read_worker_info())
-        return workers
+        return self.input_message.read_worker_infos(num_assigned_workers)
 
     def get_matrix_info(self):
         self.start_message("REQUEST_MATRIX_INFO")
@@ -335,34 +508,50 @@ class DriverClient(Client):
 
 class WorkerClient(Client):
 
+    # Number of SEND_MATRIX_BLOCKS messages that may be in flight before waiting for an acknowledgement
+    send_window = 1
+
+    # Error codes returned by Alchemist for each message of the last matrix transfer
+    error_codes = []
+
+    # Messages of matrix transfers are filled to at least this many bytes, even if the buffer length is smaller
+    min_message_bytes = ChunkPlanner.min_message_bytes
+
     def __init__(self, id=0, hostname="host", address="0.0.0.0", port=24960,
-                 buffer_length=10000000, verbose=True, show_overheads=False):
+                 buffer_length=10000000, verbose=True, show_overheads=False, send_window=1, buffer_pool=None):
         Client.__init__(self, id=id, hostname=hostname, address=address, port=port,
-                        buffer_length=buffer_length, verbose=verbose, show_overheads=show_overheads)
+                        buffer_length=buffer_length, verbose=verbose, show_overheads=show_overheads,
+                        buffer_pool=buffer_pool)
+        self.send_window = send_window
+        self.error_codes = []
 
     def __del__(self):
         print("Closing worker client")
         self.close()
 
-    def send_matrix_block(self, ah, matrix, rows=[0, 0, 1], cols=[0, 0, 1]):
+    def set_min_message_bytes(self, min_message_bytes):
+        self.min_message_bytes = min_message_bytes
 
-        if rows[1] == 0:
-            rows[1] = matrix.shape[0]
-        row_range = np.array(np.arange(rows[0], rows[1], rows[2]), dtype=np.intp)
-        rows[1] -= 1
+    def get_chunk_planner(self):
+        return ChunkPlanner(self.output_message.get_buffer_length(), self.max_message_length, self.min_message_bytes)
 
-        if cols[1] == 0:
-            cols[1] = matrix.shape[1]
-        col_range = np.array(np.arange(cols[0], cols[1], cols[2]), dtype=np.intp)
-        cols[1] -= 1
+    @staticmethod
+    def get_share(shape, rows, cols):
+        # Converts the layout ranges of a share, which have exclusive ends (0 for the whole matrix), to block ranges
+        row_end = shape[0] if rows[1] == 0 else rows[1]
+        col_end = shape[1] if cols[1] == 0 else cols[1]
+        return [rows[0], row_end - 1, rows[2]], [cols[0], col_end - 1, cols[2]]
 
-        buffer_length = self.output_message.get_buffer_length() - 100
-        num_rows = len(row_range)
-        num_cols = len(col_range)
+    def send_matrix_block(self, ah, matrix, rows=[0, 0, 1], cols=[0, 0, 1], row_offset=0, hashes=None):
 
-        # Assume a whole row can fit in a message
-        num_message_rows = math.floor(buffer_length / (8. * num_cols))
-        num_messages = math.ceil(num_rows / num_message_rows)
+        rows, cols = self.get_share(matrix.shape, rows, cols)
+
+        # matrix may be a band of rows of the whole matrix, starting at row row_offset; only the rows of the share
+        # that are in the band are sent
+        if row_offset > 0 or rows[1] >= matrix.shape[0]:
+            rows = MatrixBlock.intersect(rows, row_offset, row_offset + matrix.shape[0] - 1)
+        item_size = self.output_message.get_element_dtype(matrix.dtype).itemsize
+        chunks = self.get_chunk_planner().plan(rows, cols, item_size)
 
         times = []
         serialization_times = []
@@ -370,65 +559,192 @@ class WorkerClient(Client):
         receive_times = []
         deserialization_times = []
 
-        message_row_start = 0
-        message_row_end = num_message_rows
+        # Up to send_window messages are sent ahead of their acknowledgements, which Alchemist returns in order
+        window = max(1, self.send_window)
+        num_acknowledged = 0
+        num_sent = 0
+        num_messages = len(chunks)
+        self.error_codes = []
 
-        for m in range(num_messages):
+        # Matrices read from disk on demand are asked to read ahead the rows of the next message and to drop the
+        # rows of messages that have been sent
+        on_disk = isinstance(matrix, ShardedArray)
+        if on_disk and num_messages > 0:
+            matrix.will_need(chunks[0][0])
 
-            self.output_message.start(self.client_id, self.session_id, "SEND_MATRIX_BLOCKS")
-            self.output_message.write_matrix_id(ah.id)
+        for m, (message_rows, message_cols) in enumerate(chunks):
+
+            if on_disk and m + 1 < num_messages and chunks[m + 1][0] != message_rows:
+                matrix.will_need(chunks[m + 1][0])
+
+            start = time.time()
+            # A strided view of the matrix; whole consecutive rows are contiguous and are sent without being copied
+            block = MatrixBlock.pack(matrix, message_rows, message_cols, row_offset)
+
+            # With hashes (a dict from block ranges to the digests of the blocks last sent), unchanged blocks are
+            # skipped
+            unchanged = False
+            if hashes is not None:
+                block = np.ascontiguousarray(block, dtype=self.output_message.get_element_dtype(block.dtype))
+                key = (tuple(message_rows), tuple(message_cols))
+                digest = hashlib.blake2b(memoryview(block).cast('B'), digest_size=16).digest()
+                unchanged = hashes.get(key) == digest
+                hashes[key] = digest
+
+            if not unchanged:
+                self.output_message.start(self.client_id, self.session_id, "SEND_MATRIX_BLOCKS")
+                self.output_message.write_matrix_id(ah.id)
+                self.output_message.write_matrix_block(block, message_rows, message_cols, copy=False)
+                serialization_times.append(time.time() - start)
+
+                _, send_time = self.send_message()
+                send_times.append(send_time)
+                num_sent += 1
+
+            if on_disk and (m + 1 == num_messages or chunks[m + 1][0] != message_rows):
+                matrix.dont_need(message_rows)
+
+            if num_sent - num_acknowledged >= window:
+                self.receive_matrix_block_ack(num_acknowledged, receive_times, deserialization_times)
+                num_acknowledged += 1
+
+        while num_acknowledged < num_sent:
+            self.receive_matrix_block_ack(num_acknowledged, receive_times, deserialization_times)
+            num_acknowledged += 1
+
+        self.release_buffers()
+
+        times.append(serialization_times)
+        times.append(send_times)
+        times.append(receive_times)
+        times.append(deserialization_times)
+
+        return times
 
-            message_row_range = row_range[message_row_start:message_row_end]
-            message_col_range = col_range
+    def send_matrices(self, handles, matrices):
+        # Sends this worker's share of every matrix, with the messages of all matrices pipelined
+        self.error_codes = []
+        requests = []
+        for mh, matrix in zip(handles, matrices):
+            rows, cols = self.get_share(matrix.shape, *self.get_layout(mh))
+            item_size = self.output_message.get_element_dtype(matrix.dtype).itemsize
+            for message_rows, message_cols in self.get_chunk_planner().plan(rows, cols, item_size):
+
+                def write(mh=mh, matrix=matrix, rows=message_rows, cols=message_cols):
+                    self.output_message.start(self.client_id, self.session_id, "SEND_MATRIX_BLOCKS")
+                    self.output_message.write_matrix_id(mh.id)
+                    self.output_message.write_matrix_block(MatrixBlock.pack(matrix, rows, cols), rows, cols, copy=False)
+
+                def read(error_code, mh=mh):
+                    self.input_message.read_matrix_id()
+                    self.error_codes.append(error_code)
+                    if error_code != 0:
+                        print("ERROR: Worker-{0} returned error {1} ({2}) for a block of matrix {3}".format(
+                            self.id, error_code, self.input_message.get_error_name(error_code), mh.id))
+
+                requests.append((write, read, 100))
+
+        return self.pipeline(requests)
+
+    def get_matrices(self, handles, matrices):
+        # Fetches this worker's share of every matrix, with the requests for all matrices pipelined
+        requests = []
+        for mh, matrix in zip(handles, matrices):
+            rows, cols = self.get_share(matrix.shape, *self.get_layout(mh))
+            item_size = self.input_message.get_element_dtype(matrix.dtype).itemsize
+            for message_rows, message_cols in self.get_chunk_planner().plan(rows, cols, item_size):
+
+                def write(mh=mh, rows=message_rows, cols=message_cols):
+                    self.output_message.start(self.client_id, self.session_id, "REQUEST_MATRIX_BLOCKS")
+                    self.output_message.write_matrix_id(mh.id)
+                    self.output_message.write_matrix_block(np.zeros((0, 0)), rows, cols)
+
+                def read(error_code, matrix=matrix):
+                    self.input_message.read_matrix_id()
+                    self.input_message.read_matrix_block(matrix)
+
+                num_elements = len(range(message_rows[0], message_rows[1] + 1, message_rows[2])) * \
+                    len(range(message_cols[0], message_cols[1] + 1, message_cols[2]))
+                requests.append((write, read, 100 + num_elements * item_size))
+
+        return self.pipeline(requests)
+
+    def receive_matrix_block_ack(self, message_index, receive_times, deserialization_times):
+        _, receive_time, error_code = self.receive_message()
+        receive_times.append(receive_time)
+
+        start = time.time()
+        self.input_message.read_matrix_id()
+        deserialization_times.append(time.time() - start)
+
+        self.error_codes.append(error_code)
+        if error_code != 0:
+            print("ERROR: Worker-{0} returned error {1} ({2}) for matrix block message {3}".format(
+                self.id, error_code, self.input_message.get_error_name(error_code), message_index + 1))
+
+        return error_code
+
+    def get_matrix_block(self, mh, matrix, rows=[0, 0, 1], cols=[0, 0, 1], row_offset=0, col_offset=0):
+
+        # matrix may hold only part of the whole matrix, from row row_offset and column col_offset on; only the part
+        # of the share that falls into it is requested
+        rows, cols = self.get_share((mh.num_rows, mh.num_cols), rows, cols)
+        rows = MatrixBlock.intersect(rows, row_offset, row_offset + matrix.shape[0] - 1)
+        cols = MatrixBlock.intersect(cols, col_offset, col_offset + matrix.shape[1] - 1)
+        item_size = self.input_message.get_element_dtype(matrix.dtype).itemsize
+        chunks = self.get_chunk_planner().plan(rows, cols, item_size)
 
-            message_cols = cols
-            message_rows = [int(message_row_range[0]), int(message_row_range[-1]), rows[2]]
+        times = []
+        serialization_times = []
+        send_times = []
+        receive_times = []
+        deserialization_times = []
 
-            grid = np.ix_(message_row_range, message_col_range)
+        for message_rows, message_cols in chunks:
+
+            self.output_message.start(self.client_id, self.session_id, "REQUEST_MATRIX_BLOCKS")
+            self.output_message.write_matrix_id(mh.id)
 
             start = time.time()
-            self.output_message.write_matrix_block(matrix[grid], message_rows, message_cols)
+            self.output_message.write_matrix_block(np.zeros((0,0)), message_rows, message_cols)
             serialization_times.append(time.time() - start)
 
             _, send_time = self.send_message()
             send_times.append(send_time)
 
-            _, receive_time, error_code = self.receive_message()
+            _, receive_time, error_code = self.receive_message(stream=True)
             receive_times.append(receive_time)
 
             start = time.time()
             self.input_message.read_matrix_id()
+            self.input_message.read_matrix_block(matrix, row_offset, col_offset)
             deserialization_times.append(time.time() - start)
 
-            message_row_start += num_message_rows
-            message_row_end += num_message_rows
+        self.release_buffers()
 
         times.append(serialization_times)
         times.append(send_times)
         times.append(receive_times)
         times.append(deserialization_times)
 
-        return times
-
-    def get_matrix_block(self, mh, matrix, rows=[0, 0, 1], cols=[0, 0, 1]):
+        return matrix, times
 
-        if rows[1] == 0:
-            rows[1] = matrix.shape[0]
-        row_range = np.array(np.arange(rows[0], rows[1], rows[2]), dtype=np.intp)
-        rows[1] -= 1
+    def send_sparse_block(self, mh, entries, rows, cols):
 
-        if cols[1] == 0:
-            cols[1] = matrix.shape[1]
-        col_range = np.array(np.arange(cols[0], cols[1], cols[2]), dtype=np.intp)
-        cols[1] -= 1
+        # Only the nonzero entries that belong to this worker's share are sent, in messages of up to as many entries
+        # as fit in the buffer
+        rows = [rows[0], rows[1] - 1, rows[2]]
+        cols = [cols[0], cols[1] - 1, cols[2]]
+        row_indices, col_indices, values = entries
 
-        buffer_length = self.output_message.get_buffer_length() - 100
-        num_rows = len(row_range)
-        num_cols = len(col_range)
+        start = time.time()
+        share = np.flatnonzero(MatrixBlock.contains(rows, row_indices) & MatrixBlock.contains(cols, col_indices))
+        share_time = time.time() - start
 
-        # Assume a whole column can fit in a message
-        num_message_rows = math.floor(buffer_length / (8. * num_cols))
-        num_messages = math.ceil(num_rows / num_message_rows)
+        message_bytes = self.get_chunk_planner().get_message_bytes()
+        entry_size = 2 * Message.index_dtype.itemsize + self.output_message.get_element_dtype(values.dtype).itemsize
+        num_message_entries = max(1, math.floor(message_bytes / (1. * entry_size)))
+        num_messages = max(1, math.ceil(len(share) / num_message_entries))
 
         times = []
         serialization_times = []
@@ -436,68 +752,100 @@ class WorkerClient(Client):
         receive_times = []
         deserialization_times = []
 
-        message_row_start = 0
-        message_row_end = num_message_rows
-
-        # print(num_message_rows)
+        window = max(1, self.send_window)
+        num_acknowledged = 0
+        self.error_codes = []
 
         for m in range(num_messages):
 
-            self.output_message.start(self.client_id, self.session_id, "REQUEST_MATRIX_BLOCKS")
+            self.output_message.start(self.client_id, self.session_id, "SEND_MATRIX_BLOCKS")
             self.output_message.write_matrix_id(mh.id)
 
-            message_row_range = row_range[message_row_start:message_row_end]
-            message_col_range = col_range
-
-            message_cols = cols
-            message_rows = [int(message_row_range[0]), int(message_row_range[-1]), rows[2]]
-
             start = time.time()
-            self.output_message.write_matrix_block(np.zeros((0,0)), message_rows, message_cols)
-            #
-            # self.output_message.write_long(message_rows[0])
-            # self.output_message.write_long(message_rows[1])
-            # self.output_message.write_long(message_rows[2])
-            # self.output_message.write_long(message_cols[0])
-            # self.output_message.write_long(message_cols[1])
-            # self.output_message.write_long(message_cols[2])
-            serialization_times.append(time.time() - start)
+            message_share = share[m * num_message_entries:(m + 1) * num_message_entries]
+            self.output_message.write_sparse_block(row_indices[message_share], col_indices[message_share],
+                                                   values[message_share], rows, cols)
+            serialization_times.append(time.time() - start + (share_time if m == 0 else 0))
 
             _, send_time = self.send_message()
             send_times.append(send_time)
 
-            _, receive_time, error_code = self.receive_message()
-            receive_times.append(receive_time)
+            if m + 1 - num_acknowledged >= window:
+                self.receive_matrix_block_ack(num_acknowledged, receive_times, deserialization_times)
+                num_acknowledged += 1
 
-            start = time.time()
+        while num_acknowledged < num_messages:
+            self.receive_matrix_block_ack(num_acknowledged, receive_times, deserialization_times)
+            num_acknowledged += 1
+
+        self.release_buffers()
+
+        times.append(serialization_times)
+        times.append(send_times)
+        times.append(receive_times)
+        times.append(deserialization_times)
+
+        return times
+
+    def get_sparse_block(self, mh, rows, cols):
+
+        # The whole share is requested at once, Alchemist replies with the nonzero entries of its blocks
+        rows = [rows[0], rows[1] - 1, rows[2]]
+        cols = [cols[0], cols[1] - 1, cols[2]]
+
+        times = []
+        serialization_times = []
+        send_times = []
+        receive_times = []
+        deserialization_times = []
+
+        self.output_message.start(self.client_id, self.session_id, "REQUEST_MATRIX_BLOCKS")
+        self.output_message.write_matrix_id(mh.id)
+
+        start = time.time()
+        self.output_message.write_matrix_block(np.zeros((0, 0), dtype=mh.dtype), rows, cols)
+        serialization_times.append(time.time() - start)
+
+        _, send_time = self.send_message()
+        send_times.append(send_time)
+
+        _, receive_time, error_code = self.receive_message()
+        receive_times.append(receive_time)
+
+        start = time.time()
+        entries = []
+        if error_code != 0:
+            print("ERROR: Worker-{0} returned error {1} ({2}) for sparse matrix block request".format(
+                self.id, error_code, self.input_message.get_error_name(error_code)))
+        else:
             self.input_message.read_matrix_id()
-            matrix, local_row_range, local_col_range = self.input_message.read_matrix_block(matrix)
-            deserialization_times.append(time.time() - start)
+            while not self.input_message.eom():
+                entries.append(self.input_message.read_sparse_block())
+        deserialization_times.append(time.time() - start)
 
-            message_row_start += num_message_rows
-            message_row_end += num_message_rows
+        self.release_buffers()
 
         times.append(serialization_times)
         times.append(send_times)
         times.append(receive_times)
         times.append(deserialization_times)
 
-        return matrix, times
+        return entries, times
 
     def get_layout(self, mh):
 
-        col_skip = 0
-        for k, v in mh.grid.array.items():
-            col_skip += 1
-            if v[0] == 1:
-                break
+        # Number of grid entries up to and including the first one in grid row 1
+        second_row = np.flatnonzero(mh.grid.array["row"] == 1)
+        if len(second_row) > 0:
+            col_skip = int(second_row[0]) + 1
+        else:
+            col_skip = mh.grid.get_num_workers()
 
         row_start = 0
         col_start = 0
-        for k, v in mh.grid.array.items():
-            if k == self.id:
-                row_start = v[0]
-                col_start = v[1]
+        position = mh.grid.get_position(self.id)
+        if position is not None:
+            row_start, col_start = position
 
         row_skip = int(mh.num_partitions / col_skip)
 
@@ -554,11 +902,36 @@ class WorkerClients:
     verbose = False
     show_overheads = False
 
-    def __init__(self, buffer_length=10000000, verbose=True, show_overheads=False):
+    # Maximum number of worker sockets driven at once during matrix transfers: None drives as many as there are
+    # CPUs, 0 drives all workers concurrently (however many there are), 1 transfers to one worker at a time
+    max_concurrency = None
+
+    # Number of unacknowledged SEND_MATRIX_BLOCKS messages allowed per worker, 1 waits for every acknowledgement
+    send_window = 1
+
+    # Smallest message size that matrix transfers aim for, see ChunkPlanner
+    min_message_bytes = ChunkPlanner.min_message_bytes
+
+    # Longest message sent to a worker without splitting it into parts, 0 for the default of each worker
+    max_part_length = 0
+
+    buffer_pool = None
+
+    # Held for every transfer, so that a transfer started on another thread (such as the block prefetched by
+    # iter_rows) ends before the next one uses the worker sockets
+    lock = None
+
+    def __init__(self, buffer_length=10000000, verbose=True, show_overheads=False, max_concurrency=None,
+                 send_window=1, buffer_pool=None):
+        self.buffer_pool = buffer_pool
+        self.lock = threading.Lock()
+        self.workers = []
         self.num_workers = 0
         self.buffer_length = buffer_length
         self.verbose = verbose
         self.show_overheads = show_overheads
+        self.max_concurrency = max_concurrency
+        self.send_window = send_window
 
     def add_workers(self, new_workers):
         for i in range(self.num_workers, len(new_workers)):
@@ -568,7 +941,11 @@ class WorkerClients:
                                   new_workers[i].port,
                                   self.buffer_length,
                                   self.verbose,
-                                  self.show_overheads)
+                                  self.show_overheads,
+                                  self.send_window,
+                                  self.buffer_pool)
+            worker.set_min_message_bytes(self.min_message_bytes)
+            worker.set_max_part_length(self.max_part_length)
             self.workers.append(worker)
         self.num_workers = len(new_workers)
         return self.num_workers
@@ -590,32 +967,137 @@ class WorkerClients:
         for i in range(self.num_workers):
             self.workers[i].handshake()
 
+    def set_max_concurrency(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+
+    def set_send_window(self, send_window):
+        self.send_window = send_window
+        for w in self.workers:
+            w.send_window = send_window
+
+    def set_min_message_bytes(self, min_message_bytes):
+        self.min_message_bytes = min_message_bytes
+        for w in self.workers:
+            w.set_min_message_bytes(min_message_bytes)
+
+    def set_max_part_length(self, max_part_length):
+        self.max_part_length = max_part_length
+        for w in self.workers:
+            w.set_max_part_length(max_part_length)
+
+    def map_workers(self, task):
+        # Runs task(worker) for every worker and returns the results in worker order. Each worker has its own
+        # socket and message buffers, so the transfers can proceed concurrently on separate threads.
+        workers = self.workers[0:self.num_workers]
+
+        with self.lock:
+            if self.max_concurrency == 1 or len(workers) <= 1:
+                return [task(w) for w in workers]
+
+            if self.max_concurrency is None:
+                num_threads = min(len(workers), os.cpu_count() or 1)
+            elif self.max_concurrency <= 0:
+                num_threads = len(workers)
+            else:
+                num_threads = min(self.max_concurrency, len(workers))
+
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                return list(executor.map(task, workers))
+
     def send_matrix_blocks(self, mh, matrix):
-        self.times = []
 
-        for i in range(self.num_workers):
-            rows, cols = self.workers[i].get_layout(mh)
-            times = self.workers[i].send_matrix_block(mh, matrix, rows, cols)
-            self.times.append(times)
+        def send(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.send_matrix_block(mh, matrix, rows, cols)
+
+        self.times = self.map_workers(send)
         return self.times
 
-    def get_matrix_blocks(self, mh, matrix):
-        self.times = []
+    def send_matrix_band(self, mh, band, row_offset):
 
-        for i in range(self.num_workers):
-            rows, cols = self.workers[i].get_layout(mh)
-            matrix, times = self.workers[i].get_matrix_block(mh, matrix, rows, cols)
+        def send(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.send_matrix_block(mh, band, rows, cols, row_offset)
+
+        self.times = self.map_workers(send)
+        return self.times
+
+    def update_matrix_blocks(self, mh, matrix, hashes):
+
+        # hashes holds a dict of the digests of the blocks last sent to each worker, by worker ID; workers without
+        # one (for example after the worker set changed) are sent every block
+        for worker in self.workers:
+            hashes.setdefault(worker.id, {})
+
+        def send(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.send_matrix_block(mh, matrix, rows, cols, hashes=hashes[worker.id])
+
+        self.times = self.map_workers(send)
+        return self.times
+
+    def send_matrices(self, handles, matrices):
+        self.times = self.map_workers(lambda worker: worker.send_matrices(handles, matrices))
+        return self.times
+
+    def get_matrices(self, handles, matrices):
+        self.times = self.map_workers(lambda worker: worker.get_matrices(handles, matrices))
+        return self.times
+
+    def get_matrix_blocks(self, mh, matrix, row_offset=0, col_offset=0):
+
+        def get(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.get_matrix_block(mh, matrix, rows, cols, row_offset, col_offset)
+
+        # Workers own disjoint parts of the matrix, so they can all write into it at the same time
+        results = self.map_workers(get)
+
+        self.times = []
+        for block_matrix, times in results:
+            matrix = block_matrix
             self.times.append(times)
         return matrix, self.times
 
+    def send_sparse_blocks(self, mh, matrix):
+
+        # Converting through CSR sums duplicate entries, every worker then picks its share of the entries
+        coo = matrix.tocsr().tocoo()
+        entries = (coo.row.astype(Message.index_dtype), coo.col.astype(Message.index_dtype), coo.data)
+
+        def send(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.send_sparse_block(mh, entries, rows, cols)
+
+        self.times = self.map_workers(send)
+        return self.times
+
+    def get_sparse_blocks(self, mh):
+
+        def get(worker):
+            rows, cols = worker.get_layout(mh)
+            return worker.get_sparse_block(mh, rows, cols)
+
+        results = self.map_workers(get)
+
+        entries = []
+        self.times = []
+        for worker_entries, times in results:
+            entries.extend(worker_entries)
+            self.times.append(times)
+        return entries, self.times
+
     def send_test_string(self):
-        for i in range(0, self.num_workers):
-            self.workers[i].send_test_string()
+        with self.lock:
+            for i in range(0, self.num_workers):
+                self.workers[i].send_test_string()
 
     def request_test_string(self):
-        for i in range(0, self.num_workers):
-            self.workers[i].request_test_string()
+        with self.lock:
+            for i in range(0, self.num_workers):
+                self.workers[i].request_test_string()
 
     def close(self):
-        for i in range(0, self.num_workers):
-            self.workers[i].close()
\ No newline at end of file
+        with self.lock:
+            for i in range(0, self.num_workers):
+                self.workers[i].close()
\ No newline at end of file
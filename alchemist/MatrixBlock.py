@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class MatrixBlock:
 
     data = None
@@ -24,6 +27,79 @@ class MatrixBlock:
         self.rows = (r, r, 1)
         self.cols = (c, c, 1)
 
+    # Block ranges are [start, end, skip] with an inclusive end. Evenly strided ranges, such as those of the cyclic
+    # layouts, are expressed with basic slicing so that they are views of the matrix; any other index set (a list or
+    # array of indices) falls back to fancy indexing.
+    @staticmethod
+    def is_strided(r):
+        return not isinstance(r, np.ndarray) and len(r) == 3
+
+    @staticmethod
+    def get_slice(r, offset=0):
+        return slice(r[0] - offset, r[1] - offset + 1, r[2])
+
+    @staticmethod
+    def get_index(rows, cols, row_offset=0, col_offset=0):
+        if MatrixBlock.is_strided(rows) and MatrixBlock.is_strided(cols):
+            return MatrixBlock.get_slice(rows, row_offset), MatrixBlock.get_slice(cols, col_offset)
+        if MatrixBlock.is_strided(rows):
+            rows = np.arange(rows[0], rows[1] + 1, rows[2])
+        if MatrixBlock.is_strided(cols):
+            cols = np.arange(cols[0], cols[1] + 1, cols[2])
+        return np.ix_(np.asarray(rows, dtype=np.intp) - row_offset, np.asarray(cols, dtype=np.intp) - col_offset)
+
+    @staticmethod
+    def pack(matrix, rows, cols, row_offset=0, col_offset=0):
+        # Returns the block of matrix, as a view whenever the ranges are strided
+        return matrix[MatrixBlock.get_index(rows, cols, row_offset, col_offset)]
+
+    @staticmethod
+    def unpack(matrix, rows, cols, block, row_offset=0, col_offset=0):
+        # Writes block into matrix without building index arrays whenever the ranges are strided. Values are cast to
+        # the element type of matrix as an assignment would, since Alchemist may reply with DOUBLE blocks for any matrix
+        index = MatrixBlock.get_index(rows, cols, row_offset, col_offset)
+        if isinstance(index[0], slice):
+            np.copyto(matrix[index], block, casting='unsafe')
+        else:
+            matrix[index] = block
+        return matrix
+
+    @staticmethod
+    def unpack_range(block, start, values):
+        # Writes values into block at the row-major positions from start onwards: the rest of a started row, whole
+        # rows, then the start of a last row
+        num_cols = block.shape[1]
+        row, col = divmod(start, num_cols)
+        position = 0
+        if col > 0:
+            count = min(len(values), num_cols - col)
+            block[row, col:col + count] = values[0:count]
+            position = count
+            row += 1
+        num_rows = (len(values) - position) // num_cols
+        if num_rows > 0:
+            block[row:row + num_rows] = values[position:position + num_rows * num_cols].reshape((num_rows, num_cols))
+            position += num_rows * num_cols
+            row += num_rows
+        if position < len(values):
+            block[row, 0:len(values) - position] = values[position:]
+        return block
+
+    @staticmethod
+    def intersect(r, first, last):
+        # The elements of the strided range r that lie in [first, last], as a strided range (empty if end < start)
+        start = max(r[0], first)
+        start += (r[0] - start) % r[2]
+        end = min(r[1], last)
+        if end >= start:
+            end -= (end - start) % r[2]
+        return [start, end, r[2]]
+
+    @staticmethod
+    def contains(r, indices):
+        # Which of the given indices lie in the strided range r
+        return (indices >= r[0]) & (indices <= r[1]) & ((indices - r[0]) % r[2] == 0)
+
     def to_string(self, space="", print_data=False):
 
         data_str = "Rows: {0} {1} {2}\n".format(self.cols[0], self.cols[1], self.cols[2])
@@ -1,4 +1,5 @@
 from .ProcessGrid import ProcessGrid
+import numpy as np
 
 
 class MatrixHandle:
@@ -18,6 +19,8 @@ class MatrixHandle:
                "VR_STAR": 12,
                "CIRC_CIRC": 13}
 
+    layout_names = {v: k for k, v in layouts.items()}
+
     id = 0
     name = ""
     num_rows = 0
@@ -26,6 +29,10 @@ class MatrixHandle:
     layout = 0
     num_partitions = 0
     grid = {}
+    dtype = np.dtype(np.float64)
+    session = None
+    # Rows filled in by append_rows so far; matrices that are sent whole have no room for more
+    num_appended_rows = 0
 
     def __init__(self, id=0, name="", num_rows=0, num_cols=0, sparse=0, layout=0, grid=ProcessGrid()):
         self.id = id
@@ -76,17 +83,76 @@ class MatrixHandle:
         self.num_partitions = num_partitions
         return self
 
-    def fetch(self, mode='all'):
-        data = 0
-        # if mode == 'diagonal':
-            # data = np.transpose(sorted((100*np.random.rand(self.num_rows, 1) + 20), reverse=True))
-            # data = np.random.rand(self.num_rows, 1).tolist()
-            # print("{}".format(data))
+    def set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        return self
+
+    def set_num_appended_rows(self, num_appended_rows):
+        self.num_appended_rows = num_appended_rows
+        return self
+
+    def set_session(self, session):
+        self.session = session
+        return self
 
-        return data
+    def fetch(self, out=None, rows=None, cols=None):
+        if self.session is None:
+            print("ERROR: Matrix handle '{0}' is not attached to an Alchemist session".format(self.name))
+            return None
+        return self.session.fetch_matrix(self, out=out, rows=rows, cols=cols)
+
+    def iter_rows(self, chunk_rows=0, rows=None):
+        if self.session is None:
+            print("ERROR: Matrix handle '{0}' is not attached to an Alchemist session".format(self.name))
+            return iter([])
+        return self.session.iter_rows(self, chunk_rows, rows)
+
+    def append_rows(self, rows, print_times=False):
+        if self.session is None:
+            print("ERROR: Matrix handle '{0}' is not attached to an Alchemist session".format(self.name))
+            return None
+        return self.session.append_rows(self, rows, print_times)
+
+    def __getitem__(self, index):
+        # NumPy-style indexing with integers and slices. Only the range of rows and columns spanned by the index is
+        # requested, from the workers that own part of it; steps other than 1 are then applied to the fetched range.
+        if not isinstance(index, tuple):
+            index = (index, slice(None))
+        if len(index) != 2:
+            print("ERROR: Matrix handles take one row index and one column index")
+            return None
+
+        ranges = []
+        local_index = []
+        for i, length in zip(index, (self.num_rows, self.num_cols)):
+            if isinstance(i, (int, np.integer)):
+                if i < -length or i >= length:
+                    print("ERROR: Index {0} is out of range for a dimension of length {1}".format(i, length))
+                    return None
+                i = int(i) % length
+                ranges.append((i, i + 1))
+                local_index.append(0)
+            elif isinstance(i, slice):
+                r = range(*i.indices(length))
+                if len(r) == 0:
+                    ranges.append((0, 0))
+                    local_index.append(slice(None))
+                    continue
+                first = min(r[0], r[-1])
+                ranges.append((first, max(r[0], r[-1]) + 1))
+                stop = r.stop - first
+                local_index.append(slice(r.start - first, stop if stop >= 0 else None, r.step))
+            else:
+                print("ERROR: Matrix handles can only be indexed with integers and slices")
+                return None
+
+        matrix = self.fetch(rows=ranges[0], cols=ranges[1])
+        if matrix is None:
+            return None
+        return matrix[tuple(local_index)]
 
     def get_layout_name(self, l):
-        return list(self.layouts.keys())[list(self.layouts.values()).index(l)]
+        return self.layout_names[l]
 
     def to_string(self, display_layout=False, space=""):
         meta = "{0} Name:                  {1}\n".format(space, self.name)
@@ -94,10 +160,11 @@ class MatrixHandle:
         meta += "{0} Number of rows:        {1}\n".format(space, self.num_rows)
         meta += "{0} Number of columns:     {1}\n\n".format(space, self.num_cols)
         meta += "{0} Sparse:                {1}\n".format(space, self.sparse)
+        meta += "{0} Element type:          {1}\n".format(space, self.dtype.name)
         meta += "{0} Layout:                {1}\n".format(space, self.get_layout_name(self.layout))
         meta += "{0} Number of partitions:  {1}\n".format(space, self.num_partitions)
         if display_layout:
-            meta += "{0} Worker assignments:    {1}".format(space, self.grid)
+            meta += "{0} Worker assignments:    {1}".format(space, self.grid.to_string())
 
         return meta
 
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import numpy as np
+from .MatrixHandle import MatrixHandle
+from .ProcessGrid import ProcessGrid
+
+
+class MatrixRegistry:
+
+    # Remembers the matrices sent to Alchemist by a digest of their contents, shape, element type and layout, so that
+    # sending the same matrix again can return the handle of the matrix that is already there. With a path the
+    # registry is also kept in a JSON file and shared between sessions; this assumes that the Alchemist server keeps
+    # the matrices between sessions, and matrices changed by another session are not noticed.
+    path = None
+    entries = {}
+    handles = {}
+
+    # Rows are hashed in bands of about this many bytes, so that strided or on-disk matrices are never copied whole
+    hash_band_bytes = 64000000
+
+    def __init__(self, path=None):
+        self.path = path
+        # Records of the matrices sent, by key; handles are only kept for matrices sent in this process
+        self.entries = {}
+        self.handles = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_key(matrix, layout):
+        digest = hashlib.blake2b(digest_size=16)
+        num_rows, num_cols = matrix.shape
+        # Empty matrices have no data to hash (and their buffers cannot be cast), the shape tells them apart
+        if matrix.size == 0:
+            pass
+        elif isinstance(matrix, np.ndarray) and matrix.flags.c_contiguous:
+            digest.update(memoryview(matrix).cast('B'))
+        else:
+            band_rows = max(1, MatrixRegistry.hash_band_bytes // max(1, num_cols * matrix.dtype.itemsize))
+            for start in range(0, num_rows, band_rows):
+                band = np.ascontiguousarray(matrix[start:start + band_rows, 0:num_cols])
+                digest.update(memoryview(band).cast('B'))
+        return "{0}:{1}x{2}:{3}:{4}".format(digest.hexdigest(), num_rows, num_cols, matrix.dtype.str, layout)
+
+    def lookup(self, key, server):
+        # The handle of the matrix with this key on server (a "hostname:port" string), if there is one; handles kept
+        # in memory are checked against the server like the entries read from the file
+        entry = self.entries.get(key)
+        if entry is None or entry["server"] != server:
+            return None
+        if key in self.handles:
+            return self.handles[key]
+        records = np.array([tuple(record) for record in entry["grid"]], dtype=ProcessGrid.dtype)
+        grid = ProcessGrid(entry["grid_rows"], entry["grid_cols"], records)
+        mh = MatrixHandle(entry["id"], entry["name"], entry["num_rows"], entry["num_cols"], 0, entry["layout"], grid)
+        mh.set_dtype(entry["dtype"])
+        mh.set_num_appended_rows(entry["num_rows"])
+        self.handles[key] = mh
+        return mh
+
+    def add(self, key, mh, server):
+        self.handles[key] = mh
+        self.entries[key] = {"server": server,
+                             "id": int(mh.id),
+                             "name": mh.name,
+                             "num_rows": int(mh.num_rows),
+                             "num_cols": int(mh.num_cols),
+                             "layout": int(mh.layout),
+                             "dtype": mh.dtype.str,
+                             "grid_rows": int(mh.grid.num_rows),
+                             "grid_cols": int(mh.grid.num_cols),
+                             "grid": mh.grid.array.tolist()}
+        self.save()
+
+    def remove(self, matrix_id, server):
+        # Forgets a matrix whose contents may have changed
+        keys = [key for key, entry in self.entries.items() if entry["id"] == matrix_id and entry["server"] == server]
+        for key in keys:
+            del self.entries[key]
+            self.handles.pop(key, None)
+        if len(keys) > 0:
+            self.save()
+
+    def clear(self):
+        self.entries = {}
+        self.handles = {}
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        # Written to a temporary file first, so that an interrupted write does not leave a broken registry
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(temporary_path, self.path)
@@ -1,11 +1,12 @@
 import numpy as np
-import pyarrow as pa
 import time
 import math
 from .Parameter import Parameter
 from .MatrixHandle import MatrixHandle
+from .MatrixBlock import MatrixBlock
 from .ProcessGrid import ProcessGrid
 from .WorkerInfo import WorkerInfo
+from .BufferPool import BufferPool
 import struct
 
 
@@ -51,6 +52,8 @@ class Message:
                  "LONG": 36,
                  "FLOAT": 15,
                  "DOUBLE": 16,
+                 "COMPLEX_FLOAT": 17,
+                 "COMPLEX_DOUBLE": 18,
                  "CHAR": 1,
                  "STRING": 46,
                  "COMMAND_CODE": 48,
@@ -61,6 +64,7 @@ class Message:
                  "MATRIX_ID": 53,
                  "MATRIX_INFO": 54,
                  "MATRIX_BLOCK": 55,
+                 "MESSAGE_PART": 56,
                  "PARAMETER": 100}
 
     errors = {"NONE": 0,
@@ -71,7 +75,88 @@ class Message:
               "ERR_NO_WORKERS": 5,
               "ERR_NONPOS_WORKER_REQUEST": 6}
 
-    message_buffer = bytearray(header_length + max_body_length)
+    # Flag after a matrix block's descriptor: the block has no data, has DOUBLE data, or has data whose element
+    # datatype code follows the flag. SPARSE blocks carry the datatype code, the number of entries and then the row
+    # indices, column indices and values of the block's nonzero entries.
+    block_flags = {"EMPTY": 0,
+                   "DOUBLE": 1,
+                   "TYPED": 2,
+                   "SPARSE": 3}
+
+    # Row and column indices of SPARSE block entries are global indices into the matrix
+    index_dtype = np.dtype("<i8")
+
+    # Element types of matrix block data, which is sent in little-endian byte order
+    element_dtypes = {datatypes["BYTE"]: np.dtype("u1"),
+                      datatypes["SHORT"]: np.dtype("<i2"),
+                      datatypes["INT"]: np.dtype("<i4"),
+                      datatypes["LONG"]: np.dtype("<i8"),
+                      datatypes["FLOAT"]: np.dtype("<f4"),
+                      datatypes["DOUBLE"]: np.dtype("<f8"),
+                      datatypes["COMPLEX_FLOAT"]: np.dtype("<c8"),
+                      datatypes["COMPLEX_DOUBLE"]: np.dtype("<c16")}
+
+    element_codes = {v: k for k, v in element_dtypes.items()}
+
+    # Datatype codes used on the hot read and write paths
+    byte_code = datatypes["BYTE"]
+    char_code = datatypes["CHAR"]
+    short_code = datatypes["SHORT"]
+    int_code = datatypes["INT"]
+    long_code = datatypes["LONG"]
+    float_code = datatypes["FLOAT"]
+    double_code = datatypes["DOUBLE"]
+    string_code = datatypes["STRING"]
+    library_id_code = datatypes["LIBRARY_ID"]
+    worker_id_code = datatypes["WORKER_ID"]
+    worker_info_code = datatypes["WORKER_INFO"]
+    matrix_id_code = datatypes["MATRIX_ID"]
+    matrix_info_code = datatypes["MATRIX_INFO"]
+    matrix_block_code = datatypes["MATRIX_BLOCK"]
+    message_part_code = datatypes["MESSAGE_PART"]
+    parameter_code = datatypes["PARAMETER"]
+
+    # Reverse lookup tables for the names of codes
+    command_names = {v: k for k, v in commands.items()}
+    datatype_names = {v: k for k, v in datatypes.items()}
+    error_names = {v: k for k, v in errors.items()}
+
+    # Precompiled codecs for the big-endian wire format
+    header_struct = struct.Struct('>HHBBI')         # client ID, session ID, command code, error code, body length
+    header_start_struct = struct.Struct('>HHBB')
+    byte_struct = struct.Struct('>B')
+    short_struct = struct.Struct('>H')
+    int_struct = struct.Struct('>I')
+    long_struct = struct.Struct('>Q')
+    float_struct = struct.Struct('>f')
+    double_struct = struct.Struct('>d')
+    block_struct = struct.Struct('>QQQQQQB')        # row start, end, skip, column start, end, skip, data flag
+    worker_info_head_struct = struct.Struct('>BHH')  # datatype code, worker ID, hostname length
+    worker_info_tail_struct = struct.Struct('>HH')   # port, group ID
+
+    # Messages longer than the receiver accepts are sent in parts, each a message of its own with the same header
+    # fields whose body starts with this prefix: MESSAGE_PART code, part number (from 1), number of parts
+    part_struct = struct.Struct('>BII')
+    part_header_struct = struct.Struct('>HHBBIBII')
+
+    # The body length field limits a single message to this length
+    max_message_length = header_length + 0xFFFFFFFF
+
+    # A SHORT value preceded by its datatype code, for decoding arrays of shorts in one pass
+    typed_short_dtype = np.dtype([("code", "u1"), ("value", ">u2")])
+
+    # Datatype code followed by a value, for reading and writing typed values with a single call
+    typed_byte_struct = struct.Struct('>BB')
+    typed_short_struct = struct.Struct('>BH')
+    typed_int_struct = struct.Struct('>BI')
+    typed_long_struct = struct.Struct('>BQ')
+    typed_float_struct = struct.Struct('>Bf')
+    typed_double_struct = struct.Struct('>Bd')
+
+    # The buffer is borrowed from a BufferPool when the message is written or received and returned on reset, so
+    # that idle connections do not hold on to memory
+    message_buffer = bytearray()
+    buffer_pool = None
 
     current_datatype = datatypes["NONE"]
 
@@ -87,17 +172,43 @@ class Message:
     read_pos = header_length                # for reading data
     write_pos = header_length               # for writing data
 
-    def __init__(self, buffer_length):
+    # Matrix block data that is sent straight from the array's memory after the buffered part of the message
+    payload = None
+    payload_pos = header_length
+
+    # Receives the next part of a streamed multipart message into it, see fill
+    part_source = None
+
+    def __init__(self, buffer_length, buffer_pool=None):
+        if buffer_pool is None:
+            buffer_pool = BufferPool.default
+        self.buffer_pool = buffer_pool
+        self.message_buffer = bytearray()
         self.set_max_length(buffer_length)
         self.reset()
 
     def eom(self):
+        if self.message_part < self.message_parts and self.read_pos >= self.body_length + self.header_length:
+            self.fill(1)
         return self.read_pos >= self.body_length + self.header_length
 
     def set_max_length(self, max_length):
+        # Maximum message length used to size data transfers, the buffer itself only grows as needed
         self.max_body_length = max_length - self.header_length
 
-        self.message_buffer = bytearray(self.header_length + self.max_body_length)
+    def reserve(self, length):
+        # Grows the buffer, keeping its contents, so that it can hold at least length bytes
+        if len(self.message_buffer) < length:
+            buffer = self.buffer_pool.acquire(length)
+            used_length = len(self.message_buffer)
+            buffer[0:used_length] = self.message_buffer
+            self.release()
+            self.message_buffer = buffer
+
+    def release(self):
+        if len(self.message_buffer) > 0:
+            self.buffer_pool.release(self.message_buffer)
+            self.message_buffer = bytearray()
 
     def reset(self):
         self.current_datatype = self.datatypes["NONE"]
@@ -111,6 +222,15 @@ class Message:
         self.write_pos = self.header_length
         self.read_pos = self.header_length
 
+        self.payload = None
+        self.payload_pos = self.header_length
+
+        self.message_part = 0
+        self.message_parts = 0
+        self.part_source = None
+
+        self.release()
+
     # Utility methods
     def get_header_length(self):
         return self.header_length
@@ -125,16 +245,36 @@ class Message:
         return self.max_body_length
 
     def get_command_name(self, v):
-        return list(self.commands.keys())[list(self.commands.values()).index(v)]
+        return self.command_names[v]
 
     def get_error_code(self):
         return self.error_code
 
     def get_error_name(self, v):
-        return list(self.errors.keys())[list(self.errors.values()).index(v)]
+        return self.error_names[v]
 
     def get_datatype_name(self, v):
-        return list(self.datatypes.keys())[list(self.datatypes.values()).index(v)]
+        return self.datatype_names[v]
+
+    @classmethod
+    def get_element_code(cls, dtype):
+        # Datatype code used to send arrays of the given dtype, types without one are sent as DOUBLE
+        return cls.element_codes.get(np.dtype(dtype).newbyteorder('<'), cls.double_code)
+
+    @classmethod
+    def get_element_dtype(cls, dtype):
+        return cls.element_dtypes[cls.get_element_code(dtype)]
+
+    # Views into the buffer that a socket can read directly into
+    def get_header_view(self):
+        self.reserve(self.header_length)
+        return memoryview(self.message_buffer)[0:self.header_length]
+
+    def get_body_view(self):
+        end = self.header_length + self.body_length
+        self.reserve(end)
+        self.write_pos = end
+        return memoryview(self.message_buffer)[self.header_length:end]
 
     # Return raw byte matrix
     def get(self):
@@ -143,14 +283,89 @@ class Message:
 
         return self.message_buffer[0:self.header_length + self.body_length]
 
+    # Return the message as a list of buffers for scatter-gather sending
+    def get_segments(self):
+        segments = [memoryview(self.message_buffer)[0:self.payload_pos]]
+        if self.payload is not None:
+            segments.append(memoryview(self.payload).cast('B'))
+
+        return segments
+
+    def get_message_length(self):
+        if self.payload is None:
+            return self.payload_pos
+        return self.payload_pos + self.payload.nbytes
+
+    def get_parts(self, max_message_length):
+        # Splits the message into parts of at most max_message_length bytes. Every part is a list of segments for
+        # scatter-gather sending: the part's header and prefix followed by views of the body, which is not copied.
+        body = [memoryview(self.message_buffer)[self.header_length:self.payload_pos]]
+        if self.payload is not None:
+            body.append(memoryview(self.payload).cast('B'))
+
+        body_length = self.get_message_length() - self.header_length
+        max_part_body_length = max(1, max_message_length - self.part_header_struct.size)
+        num_parts = max(1, math.ceil(body_length / max_part_body_length))
+
+        parts = []
+        for part in range(1, num_parts + 1):
+            part_body_length = min(max_part_body_length, body_length - (part - 1) * max_part_body_length)
+            segments = [self.part_header_struct.pack(self.client_id, self.session_id, self.command_code,
+                                                     self.error_code, self.part_struct.size + part_body_length,
+                                                     self.message_part_code, part, num_parts)]
+            while part_body_length > 0:
+                length = min(part_body_length, len(body[0]))
+                segments.append(body[0][0:length])
+                body[0] = body[0][length:]
+                if len(body[0]) == 0:
+                    body.pop(0)
+                part_body_length -= length
+            parts.append(segments)
+
+        return parts
+
+    # Receiving multipart messages
+    def is_part(self):
+        return self.body_length >= self.part_struct.size and \
+               self.message_buffer[self.header_length] == self.message_part_code
+
+    def read_part_prefix(self):
+        _, self.message_part, self.message_parts = self.part_struct.unpack_from(self.message_buffer, self.read_pos)
+        self.read_pos += self.part_struct.size
+
+    def get_part_view(self, length):
+        # View of the buffer after the received body for the body of the next part, which is appended to it
+        end = self.header_length + self.body_length
+        self.reserve(end + length)
+        self.body_length += length
+        self.write_pos = end + length
+        return memoryview(self.message_buffer)[end:end + length]
+
+    def finish_parts(self):
+        # Once all parts are appended the message reads like a single message (starting with the first prefix)
+        self.int_struct.pack_into(self.message_buffer, 6, min(self.body_length, 0xFFFFFFFF))
+
+    def fill(self, length):
+        # Streamed multipart messages hold one part at a time: the unread end of the current part is moved to the
+        # start of the body and the next parts are received after it until length more bytes can be read
+        end = self.header_length + self.body_length
+        while self.read_pos + length > end and self.message_part < self.message_parts:
+            unread = end - self.read_pos
+            self.message_buffer[self.header_length:self.header_length + unread] = \
+                self.message_buffer[self.read_pos:end]
+            self.read_pos = self.header_length
+            self.body_length = unread
+            self.part_source(self)
+            end = self.header_length + self.body_length
+
     # ============================================ Reading data ============================================
 
     # Reading header
     def read_client_id(self):
-        return int.from_bytes(self.message_buffer[0:2], 'big')
+        return self.short_struct.unpack_from(self.message_buffer, 0)[0]
 
     def read_session_id(self):
-        return int.from_bytes(self.message_buffer[2:4], 'big')
+        return self.short_struct.unpack_from(self.message_buffer, 2)[0]
 
     def read_command_code(self):
         return self.message_buffer[4]
@@ -159,53 +374,81 @@ class Message:
         return self.message_buffer[5]
 
     def read_body_length(self):
-        return int.from_bytes(self.message_buffer[6:10], 'big')
+        return self.int_struct.unpack_from(self.message_buffer, 6)[0]
 
     def read_header(self):
-        self.client_id = self.read_client_id()
-        self.session_id = self.read_session_id()
-        self.command_code = self.read_command_code()
-        self.error_code = self.read_error_code()
-        self.body_length = self.read_body_length()
+        self.client_id, self.session_id, self.command_code, self.error_code, self.body_length = \
+            self.header_struct.unpack_from(self.message_buffer, 0)
 
     # Reading body
     def preview_next_datatype(self):
+        if self.message_part < self.message_parts:
+            self.fill(1)
         return self.message_buffer[self.read_pos]
 
     def get_code(self):
+        if self.message_part < self.message_parts:
+            self.fill(1)
         self.read_pos += 1
-        return int.from_bytes(self.message_buffer[self.read_pos-1:self.read_pos], 'big')
+        return self.message_buffer[self.read_pos-1]
 
     def get_byte(self):
+        if self.message_part < self.message_parts:
+            self.fill(1)
         self.read_pos += 1
-        return int.from_bytes(self.message_buffer[self.read_pos-1:self.read_pos], 'big')
+        return self.message_buffer[self.read_pos-1]
 
     def get_char(self):
+        if self.message_part < self.message_parts:
+            self.fill(1)
         self.read_pos += 1
         return self.message_buffer[self.read_pos-1]
 
     def get_short(self):
+        if self.message_part < self.message_parts:
+            self.fill(2)
         self.read_pos += 2
-        return int.from_bytes(self.message_buffer[self.read_pos-2:self.read_pos], 'big')
+        return self.short_struct.unpack_from(self.message_buffer, self.read_pos-2)[0]
 
     def get_int(self):
+        if self.message_part < self.message_parts:
+            self.fill(4)
         self.read_pos += 4
-        return int.from_bytes(self.message_buffer[self.read_pos-4:self.read_pos], 'big')
+        return self.int_struct.unpack_from(self.message_buffer, self.read_pos-4)[0]
 
     def get_long(self):
+        if self.message_part < self.message_parts:
+            self.fill(8)
         self.read_pos += 8
-        return int.from_bytes(self.message_buffer[self.read_pos-8:self.read_pos], 'big')
+        return self.long_struct.unpack_from(self.message_buffer, self.read_pos-8)[0]
 
     def get_float(self):
+        if self.message_part < self.message_parts:
+            self.fill(4)
         self.read_pos += 4
-        return struct.unpack('>f', self.message_buffer[self.read_pos - 4:self.read_pos])[0]
+        return self.float_struct.unpack_from(self.message_buffer, self.read_pos-4)[0]
 
     def get_double(self):
+        if self.message_part < self.message_parts:
+            self.fill(8)
         self.read_pos += 8
-        return struct.unpack('>d', self.message_buffer[self.read_pos - 8:self.read_pos])[0]
+        return self.double_struct.unpack_from(self.message_buffer, self.read_pos-8)[0]
+
+    def get_typed(self, code, typed_struct):
+        # Checks the datatype code and decodes the value after it in one call. On a mismatch only the code is
+        # consumed and None is returned.
+        if self.message_part < self.message_parts:
+            self.fill(typed_struct.size)
+        if self.message_buffer[self.read_pos] != code:
+            self.read_pos += 1
+            return None
+        self.read_pos += typed_struct.size
+        return typed_struct.unpack_from(self.message_buffer, self.read_pos - typed_struct.size)[1]
 
     def get_string(self):
         str_length = self.get_short()
+        if self.message_part < self.message_parts:
+            self.fill(str_length)
         self.read_pos += str_length
         return self.message_buffer[self.read_pos - str_length:self.read_pos].decode('utf-8')
 
@@ -221,45 +464,121 @@ class Message:
         layout = self.get_byte()
         num_grid_rows = self.get_short()
         num_grid_cols = self.get_short()
-        grid = {}
-        for _ in range(num_grid_rows * num_grid_cols):
-            w = self.get_short()
-            r = self.get_short()
-            c = self.get_short()
-            grid[w] = [r, c]
-        pgrid = ProcessGrid(num_grid_rows, num_grid_cols, grid)
+        if self.message_part < self.message_parts:
+            self.fill(num_grid_rows * num_grid_cols * ProcessGrid.wire_dtype.itemsize)
+        pgrid = ProcessGrid.from_buffer(self.message_buffer, self.read_pos, num_grid_rows, num_grid_cols)
+        self.read_pos += pgrid.get_num_workers() * ProcessGrid.wire_dtype.itemsize
 
         return MatrixHandle(id, name, num_rows, num_cols, sparse, layout, pgrid)
 
-    def get_matrix_block(self, matrix=np.zeros((1,1))):
+    def get_matrix_block(self, matrix=None, row_offset=0, col_offset=0):
+        # matrix holds the rows and columns of the whole matrix from row_offset and col_offset on, without a matrix a
+        # new one with just the block is returned
 
-        row_start = self.get_long()
-        row_end = self.get_long()
-        row_skip = self.get_long()
-        col_start = self.get_long()
-        col_end = self.get_long()
-        col_skip = self.get_long()
-        empty = self.get_byte()
+        if self.message_part < self.message_parts:
+            self.fill(self.block_struct.size)
+        row_start, row_end, row_skip, col_start, col_end, col_skip, flag = \
+            self.block_struct.unpack_from(self.message_buffer, self.read_pos)
+        self.read_pos += self.block_struct.size
+        dtype = self.get_block_dtype(flag)
 
-        row_range = np.array(np.arange(row_start, row_end+1, row_skip), dtype=np.intp)
-        col_range = np.array(np.arange(col_start, col_end+1, col_skip), dtype=np.intp)
+        row_range = range(row_start, row_end + 1, row_skip)
+        col_range = range(col_start, col_end + 1, col_skip)
 
         block_num_rows = len(row_range)
         block_num_cols = len(col_range)
         num_elements = block_num_rows * block_num_cols
 
-        if matrix.size == 1:
-            matrix = np.zeros((block_num_rows, block_num_cols))
-            ixgrid = np.ix_(np.arange(block_num_rows), np.arange(block_num_cols))
-        else:
-            ixgrid = np.ix_(row_range, col_range)
-
-        if empty == 1:
-            matrix[ixgrid] = np.frombuffer(self.message_buffer[self.read_pos:self.read_pos + 8*num_elements], dtype=np.float64).reshape((block_num_rows, block_num_cols))
-            self.read_pos += 8 * num_elements
+        rows = [row_start, row_end, row_skip]
+        cols = [col_start, col_end, col_skip]
+
+        if matrix is None:
+            matrix = np.zeros((block_num_rows, block_num_cols), dtype=dtype)
+            rows = [0, block_num_rows - 1, 1]
+            cols = [0, block_num_cols - 1, 1]
+            row_offset, col_offset = 0, 0
+
+        if flag == self.block_flags["SPARSE"]:
+            # Entries have global indices, which are mapped onto the block's rows and columns in matrix
+            row_indices, col_indices, values = self.get_sparse_entries(dtype)
+            matrix[(row_indices - row_start) // row_skip * rows[2] + rows[0] - row_offset,
+                   (col_indices - col_start) // col_skip * cols[2] + cols[0] - col_offset] = values
+        elif flag != self.block_flags["EMPTY"] and self.message_part < self.message_parts:
+            self.get_streamed_block(MatrixBlock.pack(matrix, rows, cols, row_offset, col_offset), dtype)
+        elif flag != self.block_flags["EMPTY"]:
+            # Decode straight from the message buffer, the only copy made is into the destination matrix
+            if self.payload is not None and self.read_pos == self.payload_pos:
+                source, offset = self.payload, 0
+            else:
+                source, offset = self.message_buffer, self.read_pos
+            block = np.frombuffer(source, dtype=dtype, count=num_elements, offset=offset)
+            MatrixBlock.unpack(matrix, rows, cols, block.reshape((block_num_rows, block_num_cols)), row_offset,
+                               col_offset)
+            self.read_pos += dtype.itemsize * num_elements
 
         return matrix, row_range, col_range
 
+    def get_streamed_block(self, block, dtype):
+        # Decodes the data of a block that continues in later parts of a streamed message into the block (a view of
+        # the destination matrix), one part at a time
+        num_elements = block.size
+        position = 0
+        while position < num_elements:
+            self.fill(dtype.itemsize)
+            count = min(num_elements - position,
+                        (self.header_length + self.body_length - self.read_pos) // dtype.itemsize)
+            if count == 0:
+                print("ERROR: Message ended inside a matrix block")
+                break
+            values = np.frombuffer(self.message_buffer, dtype=dtype, count=count, offset=self.read_pos)
+            MatrixBlock.unpack_range(block, position, values)
+            self.read_pos += dtype.itemsize * count
+            position += count
+
+    def get_sparse_block(self):
+        # Returns the row indices, column indices and values of the nonzero entries of a matrix block, whether it was
+        # sent sparse or dense
+        if self.message_part < self.message_parts:
+            self.fill(self.block_struct.size)
+        descriptor = self.block_struct.unpack_from(self.message_buffer, self.read_pos)
+        self.read_pos += self.block_struct.size
+        rows = list(descriptor[0:3])
+        cols = list(descriptor[3:6])
+        flag = descriptor[6]
+        dtype = self.get_block_dtype(flag)
+
+        if flag == self.block_flags["SPARSE"]:
+            return self.get_sparse_entries(dtype)
+
+        row_range = np.arange(rows[0], rows[1] + 1, rows[2], dtype=self.index_dtype)
+        col_range = np.arange(cols[0], cols[1] + 1, cols[2], dtype=self.index_dtype)
+        if flag == self.block_flags["EMPTY"]:
+            block = np.zeros((0, 0), dtype=dtype)
+        else:
+            num_elements = len(row_range) * len(col_range)
+            block = np.frombuffer(self.message_buffer, dtype=dtype, count=num_elements, offset=self.read_pos)
+            block = block.reshape((len(row_range), len(col_range)))
+            self.read_pos += dtype.itemsize * num_elements
+        row_positions, col_positions = np.nonzero(block)
+        return row_range[row_positions], col_range[col_positions], block[row_positions, col_positions]
+
+    def get_sparse_entries(self, dtype):
+        num_entries = self.get_long()
+        if self.message_part < self.message_parts:
+            self.fill((2 * self.index_dtype.itemsize + dtype.itemsize) * num_entries)
+        entries = []
+        for entry_dtype in (self.index_dtype, self.index_dtype, dtype):
+            entries.append(np.frombuffer(self.message_buffer, dtype=entry_dtype, count=num_entries,
+                                         offset=self.read_pos).copy())
+            self.read_pos += entry_dtype.itemsize * num_entries
+        return entries
+
+    def get_block_dtype(self, flag):
+        # Element type of a matrix block's data, read from after its descriptor if the block is typed
+        if flag == self.block_flags["TYPED"] or flag == self.block_flags["SPARSE"]:
+            return self.element_dtypes[self.get_byte()]
+        return self.element_dtypes[self.double_code]
+
     def get_worker_id(self):
         return self.get_short()
 
@@ -272,6 +591,58 @@ class Message:
 
         return WorkerInfo(worker_id, hostname, address, port, group_id)
 
+    def read_worker_infos(self, num_workers):
+        # WORKER_INFO records contain strings and so are not fixed width, but each is decoded with two unpacks
+        # and two string slices instead of one call per field. The records of a streamed multipart message may span
+        # parts, so they are then read one field at a time.
+        if self.message_part < self.message_parts:
+            workers = []
+            for _ in range(num_workers):
+                worker = self.read_worker_info()
+                if worker == 0:
+                    print("Actual datatype does not match expected datatype WORKER INFO")
+                    break
+                workers.append(worker)
+            return workers
+
+        buffer = self.message_buffer
+        pos = self.read_pos
+        unpack_head = self.worker_info_head_struct.unpack_from
+        unpack_tail = self.worker_info_tail_struct.unpack_from
+        unpack_short = self.short_struct.unpack_from
+
+        workers = []
+        for _ in range(num_workers):
+            code, worker_id, hostname_length = unpack_head(buffer, pos)
+            if code != self.worker_info_code:
+                print("Actual datatype does not match expected datatype WORKER INFO")
+                pos += 1
+                break
+            pos += 5
+            hostname = buffer[pos:pos + hostname_length].decode('utf-8')
+            pos += hostname_length
+            address_length = unpack_short(buffer, pos)[0]
+            pos += 2
+            address = buffer[pos:pos + address_length].decode('utf-8')
+            pos += address_length
+            port, group_id = unpack_tail(buffer, pos)
+            pos += 4
+            workers.append(WorkerInfo(worker_id, hostname, address, port, group_id))
+
+        self.read_pos = pos
+        return workers
+
+    def read_shorts(self, count):
+        # Decodes count consecutive SHORT values with a single np.frombuffer
+        if self.message_part < self.message_parts:
+            self.fill(count * self.typed_short_dtype.itemsize)
+        values = np.frombuffer(self.message_buffer, dtype=self.typed_short_dtype, count=count, offset=self.read_pos)
+        if np.any(values["code"] != self.short_code):
+            print("Actual datatype does not match expected datatype SHORT")
+            return np.zeros(0, dtype=np.int16)
+        self.read_pos += count * self.typed_short_dtype.itemsize
+        return values["value"].astype(np.int16)
+
     def get_parameter(self):
 
         name = self.read_string()
@@ -302,70 +673,77 @@ class Message:
 
     def read_byte(self):
 
-        if self.get_code() != self.datatypes["BYTE"]:
+        value = self.get_typed(self.byte_code, self.typed_byte_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype BYTE")
             return 0
         else:
-            return self.get_byte()
+            return value
 
     def read_char(self):
 
-        if self.get_code() != self.datatypes["CHAR"]:
+        value = self.get_typed(self.char_code, self.typed_byte_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype CHAR")
             return 0
         else:
-            return self.get_char()
+            return value
 
     def read_short(self):
 
-        if self.get_code() != self.datatypes["SHORT"]:
+        value = self.get_typed(self.short_code, self.typed_short_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype SHORT")
             return 0
         else:
-            return self.get_short()
+            return value
 
     def read_int(self):
 
-        if self.get_code() != self.datatypes["INT"]:
+        value = self.get_typed(self.int_code, self.typed_int_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype INT")
             return 0
         else:
-            return self.get_int()
+            return value
 
     def read_long(self):
 
-        if self.get_code() != self.datatypes["LONG"]:
+        value = self.get_typed(self.long_code, self.typed_long_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype LONG")
             return 0
         else:
-            return self.get_long()
+            return value
 
     def read_float(self):
 
-        if self.get_code() != self.datatypes["FLOAT"]:
+        value = self.get_typed(self.float_code, self.typed_float_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype FLOAT")
             return 0.0
         else:
-            return self.get_float()
+            return value
 
     def read_double(self):
 
-        if self.get_code() != self.datatypes["DOUBLE"]:
+        value = self.get_typed(self.double_code, self.typed_double_struct)
+        if value is None:
             print("Actual datatype does not match expected datatype DOUBLE")
             return 0.0
         else:
-            return self.get_double()
+            return value
 
     def read_string(self):
 
-        if self.get_code() != self.datatypes["STRING"]:
+        if self.get_code() != self.string_code:
             return "Actual datatype does not match expected datatype STRING"
         else:
             return self.get_string()
 
     def read_library_id(self):
 
-        if self.get_code() != self.datatypes["LIBRARY_ID"]:
+        if self.get_code() != self.library_id_code:
             message = "Actual datatype does not match expected datatype LIBRARY ID"
             return 0
         else:
@@ -373,7 +751,7 @@ class Message:
 
     def read_matrix_id(self):
 
-        if self.get_code() != self.datatypes["MATRIX_ID"]:
+        if self.get_code() != self.matrix_id_code:
             message = "Actual datatype does not match expected datatype MATRIX ID"
             return 0
         else:
@@ -381,23 +759,31 @@ class Message:
 
     def read_matrix_info(self):
 
-        if self.get_code() != self.datatypes["MATRIX_INFO"]:
+        if self.get_code() != self.matrix_info_code:
             message = "Actual datatype does not match expected datatype MATRIX INFO"
             return 0
         else:
             return self.get_matrix_info()
 
-    def read_matrix_block(self, matrix=np.zeros((1,1))):
+    def read_matrix_block(self, matrix=None, row_offset=0, col_offset=0):
+
+        if self.get_code() != self.matrix_block_code:
+            message = "Actual datatype does not match expected datatype MATRIX BLOCK"
+            return 0
+        else:
+            return self.get_matrix_block(matrix, row_offset, col_offset)
 
-        if self.get_code() != self.datatypes["MATRIX_BLOCK"]:
+    def read_sparse_block(self):
+
+        if self.get_code() != self.matrix_block_code:
             message = "Actual datatype does not match expected datatype MATRIX BLOCK"
             return 0
         else:
-            return self.get_matrix_block(matrix)
+            return self.get_sparse_block()
 
     def read_worker_id(self):
 
-        if self.get_code() != self.datatypes["WORKER_ID"]:
+        if self.get_code() != self.worker_id_code:
             message = "Actual datatype does not match expected datatype WORKER ID"
             return 0
         else:
@@ -405,7 +791,7 @@ class Message:
 
     def read_worker_info(self):
 
-        if self.get_code() != self.datatypes["WORKER_INFO"]:
+        if self.get_code() != self.worker_info_code:
             message = "Actual datatype does not match expected datatype WORKER INFO"
             return 0
         else:
@@ -413,7 +799,7 @@ class Message:
 
     def read_parameter(self):
 
-        if self.get_code() != self.datatypes["PARAMETER"]:
+        if self.get_code() != self.parameter_code:
             print("Actual datatype does not match expected datatype PARAMETER")
             return []
         else:
@@ -422,10 +808,9 @@ class Message:
     # ============================================ Writing data ============================================
 
     def start(self, client_id, session_id, command_code, error_code="NONE"):
-        self.message_buffer[0:2] = client_id.to_bytes(2, 'big')
-        self.message_buffer[2:4] = session_id.to_bytes(2, 'big')
-        self.message_buffer[4] = self.commands[command_code]
-        self.message_buffer[5] = self.errors[error_code]
+        self.reserve(self.write_pos)
+        self.header_start_struct.pack_into(self.message_buffer, 0, client_id, session_id,
+                                           self.commands[command_code], self.errors[error_code])
 
         return self
 
@@ -442,102 +827,142 @@ class Message:
         return self
 
     def put_datatype(self, name):
-        self.message_buffer[self.write_pos] = self.datatypes[name].to_bytes(1, 'big')[0]
+        self.reserve(self.write_pos + 1)
+        self.message_buffer[self.write_pos] = self.datatypes[name]
         self.write_pos += 1
 
         return self
 
     def put_byte(self, value):
-        self.message_buffer[self.write_pos] = value.to_bytes(1, 'big')[0]
+        self.reserve(self.write_pos + 1)
+        self.byte_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 1
 
         return self
 
     def put_char(self, value):
+        self.reserve(self.write_pos + 1)
         self.message_buffer[self.write_pos] = value.encode('utf-8')[0]
         self.write_pos += 1
 
         return self
 
     def put_short(self, value):
-        self.message_buffer[self.write_pos:self.write_pos+2] = value.to_bytes(2, 'big')
+        self.reserve(self.write_pos + 2)
+        self.short_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 2
 
         return self
 
     def put_int(self, value):
-        self.message_buffer[self.write_pos:self.write_pos+4] = value.to_bytes(4, 'big')
+        self.reserve(self.write_pos + 4)
+        self.int_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 4
 
         return self
 
     def put_long(self, value):
-        self.message_buffer[self.write_pos:self.write_pos+8] = value.to_bytes(8, 'big')
+        self.reserve(self.write_pos + 8)
+        self.long_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 8
 
         return self
 
     def put_float(self, value):
-        self.message_buffer[self.write_pos:self.write_pos+4] = struct.pack('>f', value)
+        self.reserve(self.write_pos + 4)
+        self.float_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 4
 
         return self
 
     def put_double(self, value):
-        self.message_buffer[self.write_pos:self.write_pos+8] = struct.pack('>d', value)
+        self.reserve(self.write_pos + 8)
+        self.double_struct.pack_into(self.message_buffer, self.write_pos, value)
         self.write_pos += 8
 
         return self
 
     def put_string(self, s):
         self.put_short(len(s))
+        self.reserve(self.write_pos + len(s))
         self.message_buffer[self.write_pos:self.write_pos+len(s)] = s.encode('utf-8')
         self.write_pos += len(s)
 
         return self
 
     def put_matrix_id(self, v):
-        self.message_buffer[self.write_pos:self.write_pos+2] = v.to_bytes(2, 'big')
+        self.reserve(self.write_pos + 2)
+        self.short_struct.pack_into(self.message_buffer, self.write_pos, v)
         self.write_pos += 2
 
         return self
 
     def put_library_id(self, v):
-        self.message_buffer[self.write_pos] = v.to_bytes(1, 'big')[0]
+        self.reserve(self.write_pos + 1)
+        self.byte_struct.pack_into(self.message_buffer, self.write_pos, v)
         self.write_pos += 1
 
         return self
 
-    def put_matrix_block(self, block, rows, cols):
+    def put_sparse_block(self, row_indices, col_indices, values, rows, cols):
+        # The block covers the given ranges, of which only the listed entries (with global indices) are sent
+        code = self.get_element_code(values.dtype)
 
-        if rows[1] == 0:
-            rows[1] = block.shape[0]
+        self.reserve(self.write_pos + self.block_struct.size)
+        self.block_struct.pack_into(self.message_buffer, self.write_pos, rows[0], rows[1], rows[2],
+                                    cols[0], cols[1], cols[2], self.block_flags["SPARSE"])
+        self.write_pos += self.block_struct.size
+        self.put_byte(code)
+        self.put_long(len(values))
 
-        if cols[1] == 0:
-            cols[1] = block.shape[1]
+        for entries, entry_dtype in ((row_indices, self.index_dtype), (col_indices, self.index_dtype),
+                                     (values, self.element_dtypes[code])):
+            entries = np.ascontiguousarray(entries, dtype=entry_dtype)
+            self.reserve(self.write_pos + entries.nbytes)
+            self.message_buffer[self.write_pos:self.write_pos + entries.nbytes] = memoryview(entries).cast('B')
+            self.write_pos += entries.nbytes
 
-        self.put_long(rows[0])
-        self.put_long(rows[1])
-        self.put_long(rows[2])
-        self.put_long(cols[0])
-        self.put_long(cols[1])
-        self.put_long(cols[2])
+        return self
 
-        if block.size > 0:
-            self.put_byte(1)
-            # start = time.time()
-            # self.message_buffer[self.write_pos:self.write_pos + 8*block.size] = block.tobytes('C')
-            # # self.message_buffer[self.write_pos:self.write_pos + block.size] = block.view(dtype=np.uint8)
-            # send_time = time.time() - start
-            # print("Send time 3 {0}".format(send_time))
-            # start = time.time()
-            # self.message_buffer[self.write_pos:self.write_pos + 8*block.size] = pa.serialize(block).to_buffer()
-            # send_time = time.time() - start
-            # print("Send time 2 {0}".format(send_time))
-            self.message_buffer[self.write_pos:self.write_pos + 8 * block.size] = block.tobytes('C')
-            self.write_pos += 8 * block.size
+    def put_matrix_block(self, block, rows, cols, copy=True):
+
+        # An end of 0 stands for the whole block, unless the block has a single row or column, which [0, 0, 1] covers
+        if rows[1] == 0 and block.shape[0] > 1:
+            rows = [rows[0], block.shape[0], rows[2]]
+
+        if cols[1] == 0 and block.shape[1] > 1:
+            cols = [cols[0], block.shape[1], cols[2]]
+
+        # DOUBLE blocks keep the original encoding, other element types are sent as they are with their datatype code
+        code = self.get_element_code(block.dtype)
+        dtype = self.element_dtypes[code]
+        if block.size == 0:
+            flag = self.block_flags["EMPTY"]
+        elif code == self.double_code:
+            flag = self.block_flags["DOUBLE"]
         else:
-            self.put_byte(0)
+            flag = self.block_flags["TYPED"]
+
+        self.reserve(self.write_pos + self.block_struct.size)
+        self.block_struct.pack_into(self.message_buffer, self.write_pos, rows[0], rows[1], rows[2],
+                                    cols[0], cols[1], cols[2], flag)
+        self.write_pos += self.block_struct.size
+
+        if flag == self.block_flags["TYPED"]:
+            self.put_byte(code)
+
+        if block.size > 0:
+            if copy:
+                num_bytes = dtype.itemsize * block.size
+                self.reserve(self.write_pos + num_bytes)
+                self.message_buffer[self.write_pos:self.write_pos + num_bytes] = \
+                    np.ascontiguousarray(block, dtype=dtype).tobytes('C')
+                self.write_pos += num_bytes
+            else:
+                # Only the block metadata goes into the buffer, the data is sent from the array itself. This
+                # avoids any copy for C-contiguous blocks; the block must be the last item in the message.
+                self.payload = np.ascontiguousarray(block, dtype=dtype)
+                self.payload_pos = self.write_pos
 
         return self
 
@@ -564,8 +989,9 @@ class Message:
             self.write_matrix_id(p.value)
 
     def write_byte(self, value):
-        self.put_datatype("BYTE")
-        self.put_byte(value)
+        self.reserve(self.write_pos + self.typed_byte_struct.size)
+        self.typed_byte_struct.pack_into(self.message_buffer, self.write_pos, self.byte_code, value)
+        self.write_pos += self.typed_byte_struct.size
 
         return self
 
@@ -576,32 +1002,37 @@ class Message:
         return self
 
     def write_short(self, value):
-        self.put_datatype("SHORT")
-        self.put_short(value)
+        self.reserve(self.write_pos + self.typed_short_struct.size)
+        self.typed_short_struct.pack_into(self.message_buffer, self.write_pos, self.short_code, value)
+        self.write_pos += self.typed_short_struct.size
 
         return self
 
     def write_int(self, value):
-        self.put_datatype("INT")
-        self.put_int(value)
+        self.reserve(self.write_pos + self.typed_int_struct.size)
+        self.typed_int_struct.pack_into(self.message_buffer, self.write_pos, self.int_code, value)
+        self.write_pos += self.typed_int_struct.size
 
         return self
 
     def write_long(self, value):
-        self.put_datatype("LONG")
-        self.put_long(value)
+        self.reserve(self.write_pos + self.typed_long_struct.size)
+        self.typed_long_struct.pack_into(self.message_buffer, self.write_pos, self.long_code, value)
+        self.write_pos += self.typed_long_struct.size
 
         return self
 
     def write_float(self, value):
-        self.put_datatype("FLOAT")
-        self.put_float(value)
+        self.reserve(self.write_pos + self.typed_float_struct.size)
+        self.typed_float_struct.pack_into(self.message_buffer, self.write_pos, self.float_code, value)
+        self.write_pos += self.typed_float_struct.size
 
         return self
 
     def write_double(self, value):
-        self.put_datatype("DOUBLE")
-        self.put_double(value)
+        self.reserve(self.write_pos + self.typed_double_struct.size)
+        self.typed_double_struct.pack_into(self.message_buffer, self.write_pos, self.double_code, value)
+        self.write_pos += self.typed_double_struct.size
 
         return self
 
@@ -617,9 +1048,15 @@ class Message:
 
         return self
 
-    def write_matrix_block(self, block, rows=[0, 0, 1], cols=[0, 0, 1]):
+    def write_matrix_block(self, block, rows=[0, 0, 1], cols=[0, 0, 1], copy=True):
+        self.put_datatype("MATRIX_BLOCK")
+        self.put_matrix_block(block, rows, cols, copy)
+
+        return self
+
+    def write_sparse_block(self, row_indices, col_indices, values, rows=[0, 0, 1], cols=[0, 0, 1]):
         self.put_datatype("MATRIX_BLOCK")
-        self.put_matrix_block(block, rows, cols)
+        self.put_sparse_block(row_indices, col_indices, values, rows, cols)
 
         return self
 
@@ -638,14 +1075,21 @@ class Message:
     # ==================================================================================================
 
     def update_body_length(self):
-        self.body_length = self.write_pos - self.header_length
-        self.message_buffer[6:10] = self.body_length.to_bytes(4, 'big')
+        if self.payload is None:
+            self.payload_pos = self.write_pos
+            self.body_length = self.write_pos - self.header_length
+        else:
+            self.body_length = self.payload_pos - self.header_length + self.payload.nbytes
+        # Messages too long for the field are sent in parts, which have their own headers
+        self.int_struct.pack_into(self.message_buffer, 6, min(self.body_length, 0xFFFFFFFF))
 
     def reset_write_position(self):
         self.write_pos = self.header_length
 
     def reset_read_position(self):
         self.read_pos = self.header_length
+        if self.message_part > 0 and self.is_part():
+            self.read_pos += self.part_struct.size
 
     def finish(self):
         self.update_body_length()
@@ -654,20 +1098,49 @@ class Message:
 
     # ========================================================================================
 
-    def print(self):
+    def header_to_string(self):
+        return "client {0} | session {1} | command {2} ({3}) | error {4} ({5}) | body length {6}".format(
+            self.client_id, self.session_id, self.command_code, self.get_command_name(self.command_code),
+            self.error_code, self.get_error_name(self.error_code), self.body_length)
+
+    def get_matrix_block_summary(self):
+        # Describes the next matrix block from its metadata only, skipping over the data without decoding it
+        self.get_code()
+        descriptor = self.block_struct.unpack_from(self.message_buffer, self.read_pos)
+        self.read_pos += self.block_struct.size
+        rows = list(descriptor[0:3])
+        cols = list(descriptor[3:6])
+        flag = descriptor[6]
+        dtype = self.get_block_dtype(flag)
+
+        block_num_rows = len(range(rows[0], rows[1] + 1, rows[2]))
+        block_num_cols = len(range(cols[0], cols[1] + 1, cols[2]))
+        if flag == self.block_flags["EMPTY"]:
+            return "{0}x{1} | rows {2} | cols {3}".format(block_num_rows, block_num_cols, rows, cols)
+
+        if flag == self.block_flags["SPARSE"]:
+            num_entries = self.get_long()
+            self.read_pos += (2 * self.index_dtype.itemsize + dtype.itemsize) * num_entries
+            return "{0}x{1} {2} sparse, {3} entries | rows {4} | cols {5}".format(
+                block_num_rows, block_num_cols, dtype.name, num_entries, rows, cols)
+
+        self.read_pos += dtype.itemsize * block_num_rows * block_num_cols
+        return "{0}x{1} {2} | rows {3} | cols {4}".format(block_num_rows, block_num_cols, dtype.name, rows, cols)
+
+    def to_string(self):
 
         space = "{0:8s}".format(" ")
 
         self.read_header()
 
-        print(" ")
-        print("{} ================================================================================".format(space))
-        print("{}  Client ID:                  {}".format(space, self.client_id))
-        print("{}  Session ID:                 {}".format(space, self.session_id))
-        print("{}  Command code:               {} ({})".format(space, self.command_code, self.get_command_name(self.command_code)))
-        print("{}  Error code:                 {} ({})".format(space, self.error_code, self.get_error_name(self.error_code)))
-        print("{}  Message body length:        {}".format(space, self.body_length))
-        print("{} -------------------------------------------------------------------------------".format(space))
+        lines = [" "]
+        lines.append("{} ================================================================================".format(space))
+        lines.append("{}  Client ID:                  {}".format(space, self.client_id))
+        lines.append("{}  Session ID:                 {}".format(space, self.session_id))
+        lines.append("{}  Command code:               {} ({})".format(space, self.command_code, self.get_command_name(self.command_code)))
+        lines.append("{}  Error code:                 {} ({})".format(space, self.error_code, self.get_error_name(self.error_code)))
+        lines.append("{}  Message body length:        {}".format(space, self.body_length))
+        lines.append("{} -------------------------------------------------------------------------------".format(space))
 
         while not self.eom():
             next_datatype = self.preview_next_datatype()
@@ -695,18 +1168,28 @@ class Message:
             elif next_datatype == self.datatypes["MATRIX_INFO"]:
                 data = " {0:24s}    \n{1}".format("MATRIX INFO", self.read_matrix_info().to_string(display_layout=True, space=space + "{0:29s}".format(" ")))
             elif next_datatype == self.datatypes["MATRIX_BLOCK"]:
-                block, row_range, col_range = self.read_matrix_block()
-                block_string = "{0}x{1} | {2} | {3}".format(block.shape[0], block.shape[1], row_range, col_range)
-                data = " {0:24s}    {1}".format("MATRIX BLOCK", block_string)
+                data = " {0:24s}    {1}".format("MATRIX BLOCK", self.get_matrix_block_summary())
             elif next_datatype == self.datatypes["WORKER_ID"]:
                 data = " {0:24s}    {1}".format("WORKER ID", self.read_worker_id())
             elif next_datatype == self.datatypes["WORKER_INFO"]:
                 data = " {0:24s}    \n{1}".format("WORKER INFO", self.read_worker_info().to_string(space + "{0:29s}".format(" ")))
+            elif next_datatype == self.datatypes["MESSAGE_PART"]:
+                _, part, parts = self.part_struct.unpack_from(self.message_buffer, self.read_pos)
+                self.read_pos += self.part_struct.size
+                data = " {0:24s}    {1} of {2}".format("MESSAGE PART", part, parts)
             elif next_datatype == self.datatypes["PARAMETER"]:
                 data = " {0:9s} {1}".format("PARAMETER", self.read_parameter().to_string(space + "{0:10s}".format(" ")))
+            else:
+                data = " {0:24s}    {1}".format("UNKNOWN DATATYPE", next_datatype)
+                self.read_pos = self.header_length + self.body_length
 
-            print("{} {}".format(space, data))
+            lines.append("{} {}".format(space, data))
 
-        print("{} ================================================================================".format(space))
+        lines.append("{} ================================================================================".format(space))
 
         self.reset_read_position()
+
+        return "\n".join(lines)
+
+    def print(self):
+        print(self.to_string())
@@ -1,11 +1,45 @@
+import numpy as np
+
+
 class ProcessGrid:
 
+    # One record per worker with its position in the grid; wire_dtype is the big-endian layout in MATRIX_INFO
+    dtype = np.dtype([("worker", np.uint16), ("row", np.uint16), ("col", np.uint16)])
+    wire_dtype = np.dtype([("worker", ">u2"), ("row", ">u2"), ("col", ">u2")])
+
     num_rows = 0
     num_cols = 0
-    array = {}
+    array = np.zeros(0, dtype=dtype)
 
-    def __init__(self, num_rows=1, num_cols=1, array={}):
+    def __init__(self, num_rows=1, num_cols=1, array=None):
         self.num_rows = num_rows
         self.num_cols = num_cols
-        self.array = array
 
+        if array is None:
+            self.array = np.zeros(0, dtype=self.dtype)
+        elif isinstance(array, dict):
+            self.array = np.array([(w, v[0], v[1]) for w, v in array.items()], dtype=self.dtype)
+        else:
+            self.array = np.asarray(array).astype(self.dtype)
+
+    @staticmethod
+    def from_buffer(buffer, offset, num_rows, num_cols):
+        # Decodes num_rows * num_cols wire records in one pass, copying them out of the buffer
+        array = np.frombuffer(buffer, dtype=ProcessGrid.wire_dtype, count=num_rows * num_cols, offset=offset)
+        return ProcessGrid(num_rows, num_cols, array)
+
+    def get_num_workers(self):
+        return len(self.array)
+
+    def get_worker_ids(self):
+        return self.array["worker"]
+
+    def get_position(self, worker_id):
+        index = np.flatnonzero(self.array["worker"] == worker_id)
+        if len(index) == 0:
+            return None
+        record = self.array[index[-1]]
+        return int(record["row"]), int(record["col"])
+
+    def to_string(self):
+        return "{" + ", ".join("{0}: [{1}, {2}]".format(w, r, c) for w, r, c in self.array.tolist()) + "}"
@@ -0,0 +1,133 @@
+import json
+import mmap
+import os
+import numpy as np
+
+
+class ShardedArray:
+
+    # A matrix stored on disk as one or more .npy files of consecutive rows. The files are memory-mapped and rows
+    # are only read when a block of them is requested, so sending a matrix of any size needs about one message of
+    # memory per worker. Readahead hints ask the OS to read the next rows early and to drop rows that have been sent.
+    shape = (0, 0)
+    dtype = np.dtype(np.float64)
+
+    shards = []
+    row_offsets = []
+
+    def __init__(self, shards):
+        # shards is a list of (array, mapping, offset) triples, where mapping is the mmap object the array starts
+        # offset bytes into (or None if the array is not mapped by ShardedArray)
+        self.shards = shards
+        self.row_offsets = [0]
+        for array, _, _ in shards:
+            self.row_offsets.append(self.row_offsets[-1] + array.shape[0])
+        self.shape = (self.row_offsets[-1], shards[0][0].shape[1])
+        self.dtype = shards[0][0].dtype
+
+    @staticmethod
+    def open(path):
+        # path is a .npy file, a directory of .npy row shards (in file name order), or a JSON manifest listing the
+        # shard files (relative to the manifest) as a list or under "shards"
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".npy")]
+        elif path.endswith(".json"):
+            with open(path) as f:
+                manifest = json.load(f)
+            if isinstance(manifest, dict):
+                manifest = manifest["shards"]
+            files = [os.path.join(os.path.dirname(path), f) for f in manifest]
+        else:
+            files = [path]
+
+        if len(files) == 0:
+            print("ERROR: No .npy shards found in {0}".format(path))
+            return None
+
+        shards = [ShardedArray.map_npy(f) for f in files]
+        for (array, _, _), f in zip(shards, files):
+            if array.ndim != 2 or array.shape[1] != shards[0][0].shape[1] or array.dtype != shards[0][0].dtype:
+                print("ERROR: Shard {0} does not match the shape or dtype of the first shard".format(f))
+                return None
+
+        return ShardedArray(shards)
+
+    @staticmethod
+    def from_memmap(matrix):
+        # Maps the file behind an np.memmap again, so that readahead hints can be given for it
+        if matrix.filename is None or not matrix.flags.c_contiguous or not isinstance(matrix.base, mmap.mmap):
+            return ShardedArray([(matrix, None, 0)])
+        return ShardedArray([ShardedArray.map_file(matrix.filename, matrix.offset, matrix.dtype, matrix.shape)])
+
+    @staticmethod
+    def map_npy(filename):
+        with open(filename, "rb") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+
+        if fortran_order:
+            # Rows of column-major files are not contiguous, numpy reads them through its own memory map instead
+            return np.load(filename, mmap_mode="r"), None, 0
+        return ShardedArray.map_file(filename, offset, dtype, shape)
+
+    @staticmethod
+    def map_file(filename, offset, dtype, shape):
+        with open(filename, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = int(np.prod(shape))
+        array = np.frombuffer(mapping, dtype=dtype, count=count, offset=offset).reshape(shape)
+        return array, mapping, offset
+
+    def get_shard_rows(self, rows):
+        # Yields, for every shard that holds rows of the strided range [start, end, skip] (inclusive end), the shard
+        # and the slice of its own rows
+        start, end, skip = rows
+        for s in range(len(self.shards)):
+            first = max(start, self.row_offsets[s])
+            last = min(end, self.row_offsets[s + 1] - 1)
+            if first > last:
+                continue
+            first += (start - first) % skip
+            if first > last:
+                continue
+            offset = self.row_offsets[s]
+            yield self.shards[s], slice(first - offset, last - offset + 1, skip)
+
+    def __getitem__(self, index):
+        # Supports the (row slice, column slice) indexing used by MatrixBlock, a view whenever one shard holds the rows
+        row_index, col_index = index
+        start, stop, skip = row_index.indices(self.shape[0])
+        if stop <= start:
+            return np.zeros((0, self.shape[1]), dtype=self.dtype)[:, col_index]
+
+        pieces = [array[row_slice, col_index] for (array, _, _), row_slice in
+                  self.get_shard_rows([start, stop - 1, skip])]
+        if len(pieces) == 1:
+            return pieces[0]
+        return np.concatenate(pieces)
+
+    def advise(self, rows, advice):
+        for (array, mapping, offset), row_slice in self.get_shard_rows(rows):
+            if mapping is None:
+                continue
+            row_bytes = array.strides[0]
+            start = offset + row_slice.start * row_bytes
+            length = (row_slice.stop - row_slice.start) * row_bytes
+            # madvise needs a page-aligned start
+            aligned_start = start - start % mmap.PAGESIZE
+            length = min(length + start - aligned_start, len(mapping) - aligned_start)
+            if length > 0:
+                mapping.madvise(advice, aligned_start, length)
+
+    def will_need(self, rows):
+        if hasattr(mmap, "MADV_WILLNEED"):
+            self.advise(rows, mmap.MADV_WILLNEED)
+
+    def dont_need(self, rows):
+        # Sent rows are dropped from memory, they are read from the file again if they are needed later
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self.advise(rows, mmap.MADV_DONTNEED)
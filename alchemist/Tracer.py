@@ -0,0 +1,57 @@
+import logging
+
+
+class Tracer:
+
+    # OFF traces nothing, HEADERS logs one line per message, FULL also decodes the message body (matrix blocks are
+    # summarized from their metadata, their data is never decoded)
+    levels = {"OFF": 0,
+              "HEADERS": 1,
+              "FULL": 2}
+
+    level = levels["OFF"]
+
+    logger = logging.getLogger("alchemist.protocol")
+
+    handler = None
+
+    @classmethod
+    def set_level(cls, level, stream=None):
+        if isinstance(level, str):
+            level = cls.levels[level.upper()]
+        cls.level = level
+
+        if level > cls.levels["OFF"]:
+            cls.logger.setLevel(logging.DEBUG)
+
+        # Optionally send the trace to a stream (such as sys.stdout in a notebook) without configuring logging
+        if stream is not None:
+            if cls.handler is not None:
+                cls.logger.removeHandler(cls.handler)
+            cls.handler = logging.StreamHandler(stream)
+            cls.handler.setFormatter(logging.Formatter("%(message)s"))
+            cls.logger.addHandler(cls.handler)
+
+    @classmethod
+    def get_level(cls):
+        return cls.level
+
+    @classmethod
+    def get_level_name(cls, level):
+        for name, code in cls.levels.items():
+            if code == level:
+                return name
+        return ""
+
+    @classmethod
+    def trace(cls, message, direction, peer="", header_only=False):
+        # Callers check Tracer.level first, so tracing costs a single attribute lookup when it is off. Streamed
+        # messages are only traced by their header, since decoding the body would consume the stream.
+        if not cls.logger.isEnabledFor(logging.DEBUG):
+            return
+
+        if cls.level == cls.levels["HEADERS"] or header_only:
+            message.read_header()
+            cls.logger.debug("%s %s: %s", direction, peer, message.header_to_string())
+        elif cls.level == cls.levels["FULL"]:
+            cls.logger.debug("%s %s:\n%s", direction, peer, message.to_string())
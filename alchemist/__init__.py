@@ -7,3 +7,10 @@ from alchemist.MatrixHandle import MatrixHandle
 from alchemist.ProcessGrid import ProcessGrid
 from alchemist.LibraryHandle import LibraryHandle
 from alchemist.Parameter import Parameter
+from alchemist.Tracer import Tracer
+from alchemist.BufferPool import BufferPool
+from alchemist.ChunkPlanner import ChunkPlanner
+from alchemist.ShardedArray import ShardedArray
+from alchemist.ArrowBlocks import ArrowBlocks
+from alchemist.BlockCache import BlockCache
+from alchemist.MatrixRegistry import MatrixRegistry
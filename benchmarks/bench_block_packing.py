@@ -0,0 +1,89 @@
+import argparse
+import time
+from types import SimpleNamespace
+import numpy as np
+from alchemist.Client import WorkerClient
+from alchemist.MatrixBlock import MatrixBlock
+from alchemist.MatrixHandle import MatrixHandle
+from alchemist.ProcessGrid import ProcessGrid
+
+
+# Compares packing and unpacking every worker's share of a matrix with np.ix_ fancy indexing against the strided
+# views used by MatrixBlock, for each of the layouts that WorkerClient.get_layout supports.
+
+def best_time(f, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def get_shares(mh):
+    shares = []
+    for w in mh.grid.get_worker_ids():
+        rows, cols = WorkerClient.get_layout(SimpleNamespace(id=w), mh)
+        rows = [rows[0], rows[1] - 1, rows[2]]
+        cols = [cols[0], cols[1] - 1, cols[2]]
+        shares.append((rows, cols))
+    return shares
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark matrix block packing for each layout")
+    parser.add_argument("--rows", type=int, default=4000)
+    parser.add_argument("--cols", type=int, default=1000)
+    parser.add_argument("--grid-rows", type=int, default=2)
+    parser.add_argument("--grid-cols", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    grid = {}
+    w = 1
+    for c in range(args.grid_cols):
+        for r in range(args.grid_rows):
+            grid[w] = [r, c]
+            w += 1
+    pgrid = ProcessGrid(args.grid_rows, args.grid_cols, grid)
+
+    matrix = np.random.rand(args.rows, args.cols)
+    out = np.zeros_like(matrix)
+
+    print("{0}x{1} matrix, {2}x{3} process grid, best of {4}".format(args.rows, args.cols, args.grid_rows,
+                                                                    args.grid_cols, args.repeats))
+    print("  Layout     |  Pack (np.ix_)  |  Pack (slices)  |  Unpack (np.ix_)  |  Unpack (copyto)  |  Speedup")
+    print("  -----------------------------------------------------------------------------------------------")
+
+    for name, layout in MatrixHandle.layouts.items():
+        if name == "CIRC_CIRC":
+            continue
+        mh = MatrixHandle(0, name, args.rows, args.cols, 0, layout, pgrid)
+        shares = get_shares(mh)
+        blocks = [matrix[MatrixBlock.get_index(r, c)] for r, c in shares]
+        index_arrays = [(np.arange(r[0], r[1] + 1, r[2]), np.arange(c[0], c[1] + 1, c[2])) for r, c in shares]
+
+        def pack_fancy():
+            for r, c in index_arrays:
+                matrix[np.ix_(r, c)]
+
+        def pack_slices():
+            for r, c in shares:
+                np.ascontiguousarray(MatrixBlock.pack(matrix, r, c))
+
+        def unpack_fancy():
+            for (r, c), block in zip(index_arrays, blocks):
+                out[np.ix_(r, c)] = block
+
+        def unpack_slices():
+            for (r, c), block in zip(shares, blocks):
+                MatrixBlock.unpack(out, r, c, block)
+
+        times = [best_time(f, args.repeats) for f in [pack_fancy, pack_slices, unpack_fancy, unpack_slices]]
+        speedup = (times[0] + times[2]) / (times[1] + times[3])
+        print("  {0:10s} |   {1:.4e}s  |   {2:.4e}s  |    {3:.4e}s   |    {4:.4e}s   |  {5:.2f}x".format(
+            name, times[0], times[1], times[2], times[3], speedup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import subprocess
+import sys
+import time
+
+
+# Measures how long 'import alchemist' takes in a fresh interpreter and fails (exit status 1) when it is slower than
+# the allowed time or when it pulls in one of the optional dependencies that should only be imported on first use.
+
+deferred_modules = ["h5py", "pandas", "pyarrow", "scipy"]
+
+
+def time_import(python):
+    start = time.perf_counter()
+    subprocess.run([python, "-W", "ignore", "-c", "import alchemist"], check=True)
+    return time.perf_counter() - start
+
+
+def time_baseline(python):
+    start = time.perf_counter()
+    subprocess.run([python, "-W", "ignore", "-c", "import numpy"], check=True)
+    return time.perf_counter() - start
+
+
+def find_deferred_modules(python):
+    check = "import sys, alchemist; print(' '.join(m for m in {0} if m in sys.modules))".format(deferred_modules)
+    result = subprocess.run([python, "-W", "ignore", "-c", check], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing alchemist stays fast")
+    parser.add_argument("--max-overhead", type=float, default=0.25,
+                        help="maximum time in seconds that 'import alchemist' may add to 'import numpy'")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--python", default=sys.executable)
+    args = parser.parse_args()
+
+    import_time = min(time_import(args.python) for _ in range(args.repeats))
+    baseline_time = min(time_baseline(args.python) for _ in range(args.repeats))
+    overhead = import_time - baseline_time
+
+    print("import alchemist:  {0:.4f}s".format(import_time))
+    print("import numpy:      {0:.4f}s".format(baseline_time))
+    print("overhead:          {0:.4f}s (allowed {1:.4f}s)".format(overhead, args.max_overhead))
+
+    failed = False
+
+    imported = find_deferred_modules(args.python)
+    if len(imported) > 0:
+        print("ERROR: 'import alchemist' imports optional dependencies: {0}".format(", ".join(imported)))
+        failed = True
+
+    if overhead > args.max_overhead:
+        print("ERROR: 'import alchemist' is {0:.4f}s slower than allowed".format(overhead - args.max_overhead))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import socket
+import struct
+import threading
+import numpy as np
+
+
+class MockAlchemist:
+
+    # A stand-in for an Alchemist server that speaks the driver and worker protocol over local sockets, enough for
+    # the client to connect, request workers, create matrices and send and fetch their blocks. Matrices are kept as
+    # NumPy arrays in matrices, by ID.
+    element_dtypes = {33: "u1", 34: "<i2", 35: "<i4", 36: "<i8", 15: "<f4", 16: "<f8", 17: "<c8", 18: "<c16"}
+    element_codes = {np.dtype(v).str: k for k, v in element_dtypes.items()}
+
+    def __init__(self, num_workers=4, grid=None, part_length=0, buffer_length=0, double_replies=False):
+        # grid is (grid rows, grid columns, [(worker ID, row, column), ...]), a 2 x 2 grid by default
+        if grid is None:
+            grid = (2, 2, [(1, 0, 0), (2, 1, 0), (3, 0, 1), (4, 1, 1)])
+        self.num_workers = num_workers
+        self.grid = grid
+        # Replies longer than part_length are sent in parts; buffer_length is the longest message announced in the
+        # handshake (0 announces none); with double_replies all blocks are returned as DOUBLE, as Alchemist does
+        self.part_length = part_length
+        self.buffer_length = buffer_length
+        self.double_replies = double_replies
+        # Matrices with these names are not created, their MATRIX_INFO requests get an error reply
+        self.rejected_names = set()
+        # Tasks run by RUN_TASK, by name: functions of the server that return the encoded output parameters
+        self.tasks = {}
+
+        self.matrices = {}
+        self.sparse = set()
+        self.next_id = 1
+        self.num_messages = 0
+        self.max_body_length = 0
+        self.num_parts_received = 0
+        self.num_parts_sent = 0
+        self.lock = threading.Lock()
+
+        self.sockets = []
+        for _ in range(num_workers + 1):
+            s = socket.socket()
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("127.0.0.1", 0))
+            s.listen(16)
+            self.sockets.append(s)
+        self.port = self.sockets[0].getsockname()[1]
+        self.worker_ports = [s.getsockname()[1] for s in self.sockets[1:]]
+        for s in self.sockets:
+            threading.Thread(target=self.serve, args=(s,), daemon=True).start()
+
+    def close(self):
+        for s in self.sockets:
+            s.close()
+
+    def serve(self, listening_socket):
+        while True:
+            try:
+                connection, _ = listening_socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def receive(connection, length):
+        data = bytearray()
+        while len(data) < length:
+            packet = connection.recv(length - len(data))
+            if not packet:
+                raise ConnectionError
+            data += packet
+        return bytes(data)
+
+    def reply(self, connection, command, body, error_code=0):
+        # Sends body in parts of at most part_length bytes when it is longer than that
+        if self.part_length and len(body) > self.part_length:
+            pieces = [body[i:i + self.part_length] for i in range(0, len(body), self.part_length)]
+            message = b""
+            for k, piece in enumerate(pieces):
+                part = bytes([56]) + struct.pack(">II", k + 1, len(pieces)) + piece
+                message += struct.pack(">HHBBI", 7, 9, command, error_code, len(part)) + part
+            with self.lock:
+                self.num_parts_sent += len(pieces)
+            connection.sendall(message)
+        else:
+            connection.sendall(struct.pack(">HHBBI", 7, 9, command, error_code, len(body)) + body)
+
+    def handle(self, connection):
+        pending = None
+        while True:
+            try:
+                header = self.receive(connection, 10)
+                _, _, command, _, body_length = struct.unpack(">HHBBI", header)
+                body = self.receive(connection, body_length)
+            except (ConnectionError, OSError):
+                return
+            with self.lock:
+                self.num_messages += 1
+                self.max_body_length = max(self.max_body_length, body_length)
+
+            # Parts of a multipart message are put together before the message is handled
+            if len(body) >= 9 and body[0] == 56:
+                part, parts = struct.unpack(">II", body[1:9])
+                pending = bytearray(body[9:]) if part == 1 else pending + body[9:]
+                with self.lock:
+                    self.num_parts_received += 1
+                if part < parts:
+                    continue
+                body = bytes(pending)
+
+            reader = Reader(body)
+            if command == 1:
+                self.reply(connection, 1, self.handshake())
+            elif command == 11:
+                self.reply(connection, 11, self.request_workers(reader))
+            elif command == 31:
+                body = self.send_matrix_info(reader)
+                self.reply(connection, 31, body, 0 if body else 1)
+            elif command == 34:
+                self.reply(connection, 34, self.send_matrix_blocks(reader))
+            elif command == 36:
+                self.reply(connection, 36, self.request_matrix_blocks(reader))
+            elif command == 41:
+                self.reply(connection, 41, self.run_task(reader))
+            else:
+                self.reply(connection, command, b"")
+
+    def handshake(self):
+        body = bytes([34]) + struct.pack(">H", 4321) + bytes([46]) + struct.pack(">H", 4) + b"DCBA" + \
+            bytes([16]) + struct.pack(">d", 1.11)
+        if self.buffer_length:
+            body += bytes([35]) + struct.pack(">I", self.buffer_length)
+        return body
+
+    def request_workers(self, reader):
+        reader.code()
+        num_workers = reader.unsigned(2)
+        body = bytes([34]) + struct.pack(">H", num_workers)
+        for i in range(num_workers):
+            body += bytes([52]) + struct.pack(">HH", i + 1, 9) + b"localhost" + struct.pack(">H", 9) + \
+                b"127.0.0.1" + struct.pack(">HH", self.worker_ports[i], 0)
+        return body
+
+    def send_matrix_info(self, reader):
+        reader.code()
+        name = reader.string()
+        reader.code()
+        num_rows = reader.unsigned(8)
+        reader.code()
+        num_cols = reader.unsigned(8)
+        reader.code()
+        sparse = reader.unsigned(1)
+        reader.code()
+        layout = reader.unsigned(1)
+        if name in self.rejected_names:
+            return b""
+        matrix_id = self.add_matrix(np.zeros((num_rows, num_cols)), sparse)
+        return self.matrix_info(matrix_id, name, layout)
+
+    def add_matrix(self, matrix, sparse=0):
+        with self.lock:
+            matrix_id = self.next_id
+            self.next_id += 1
+            self.matrices[matrix_id] = matrix
+            if sparse:
+                self.sparse.add(matrix_id)
+        return matrix_id
+
+    def matrix_info(self, matrix_id, name="", layout=0):
+        num_rows, num_cols = self.matrices[matrix_id].shape
+        sparse = 1 if matrix_id in self.sparse else 0
+        grid_rows, grid_cols, records = self.grid
+        body = bytes([54]) + struct.pack(">HH", matrix_id, len(name)) + name.encode() + \
+            struct.pack(">QQBBHH", num_rows, num_cols, sparse, layout, grid_rows, grid_cols)
+        for record in records:
+            body += struct.pack(">HHH", *record)
+        return body
+
+    @staticmethod
+    def parameter(name, value):
+        # A PARAMETER called name, with value already encoded with its datatype code
+        return bytes([100, 46]) + struct.pack(">H", len(name)) + name.encode() + value
+
+    def run_task(self, reader):
+        reader.code()
+        reader.unsigned(1)
+        reader.code()
+        return self.tasks[reader.string()](self)
+
+    def store(self, matrix_id, dtype, index, values):
+        with self.lock:
+            matrix = self.matrices[matrix_id]
+            if matrix.dtype != dtype:
+                self.matrices[matrix_id] = matrix = matrix.astype(dtype)
+            matrix[index] = values
+
+    def send_matrix_blocks(self, reader):
+        assert reader.code() == 53
+        matrix_id = reader.unsigned(2)
+        while not reader.eom():
+            rows, cols, flag = reader.block_descriptor()
+            dtype = np.dtype(self.element_dtypes[reader.unsigned(1)] if flag in (2, 3) else "<f8")
+            if flag == 3:
+                num_entries = reader.unsigned(8)
+                row_indices = np.frombuffer(reader.take(8 * num_entries), "<i8")
+                col_indices = np.frombuffer(reader.take(8 * num_entries), "<i8")
+                values = np.frombuffer(reader.take(num_entries * dtype.itemsize), dtype)
+                assert np.isin(row_indices, rows).all() and np.isin(col_indices, cols).all()
+                self.store(matrix_id, dtype, (row_indices, col_indices), values)
+            elif flag in (1, 2):
+                num_elements = len(rows) * len(cols)
+                values = np.frombuffer(reader.take(num_elements * dtype.itemsize), dtype)
+                self.store(matrix_id, dtype, np.ix_(rows, cols), values.reshape((len(rows), len(cols))))
+        return bytes([53]) + struct.pack(">H", matrix_id)
+
+    def request_matrix_blocks(self, reader):
+        assert reader.code() == 53
+        matrix_id = reader.unsigned(2)
+        body = bytes([53]) + struct.pack(">H", matrix_id)
+        while not reader.eom():
+            rows, cols, _ = reader.block_descriptor()
+            matrix = self.matrices[matrix_id]
+            block = np.ascontiguousarray(matrix[np.ix_(rows, cols)])
+            body += bytes([55]) + struct.pack(">QQQQQQ", rows[0], rows[-1], reader.skips[0], cols[0], cols[-1],
+                                              reader.skips[1])
+            if matrix_id in self.sparse:
+                row_positions, col_positions = np.nonzero(block)
+                body += bytes([3, self.element_codes[matrix.dtype.str]]) + struct.pack(">Q", len(row_positions))
+                body += rows[row_positions].astype("<i8").tobytes() + cols[col_positions].astype("<i8").tobytes()
+                body += block[row_positions, col_positions].tobytes()
+            elif self.double_replies or matrix.dtype == np.float64:
+                body += bytes([1]) + block.astype("<f8").tobytes()
+            else:
+                body += bytes([2, self.element_codes[matrix.dtype.str]]) + block.tobytes()
+        return body
+
+
+class Reader:
+
+    def __init__(self, body):
+        self.body = body
+        self.pos = 0
+        self.skips = (1, 1)
+
+    def eom(self):
+        return self.pos >= len(self.body)
+
+    def take(self, length):
+        self.pos += length
+        return self.body[self.pos - length:self.pos]
+
+    def code(self):
+        return self.take(1)[0]
+
+    def unsigned(self, length):
+        return int.from_bytes(self.take(length), "big")
+
+    def string(self):
+        return self.take(self.unsigned(2)).decode()
+
+    def block_descriptor(self):
+        assert self.code() == 55
+        r = [self.unsigned(8) for _ in range(6)]
+        self.skips = (r[2], r[5])
+        return np.arange(r[0], r[1] + 1, r[2]), np.arange(r[3], r[4] + 1, r[5]), self.unsigned(1)
@@ -0,0 +1,37 @@
+import pytest
+from alchemist import AlchemistSession
+from MockAlchemist import MockAlchemist
+
+
+@pytest.fixture
+def server():
+    server = MockAlchemist()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def connect():
+    # Returns a function that starts a mock server with the given options and a session connected to its four workers
+    servers = []
+    sessions = []
+
+    def connect(worker_buffer_length=10000000, session_options={}, **server_options):
+        server = MockAlchemist(**server_options)
+        servers.append(server)
+        als = AlchemistSession(worker_buffer_length=worker_buffer_length, verbose=False, **session_options)
+        als.connect_to_alchemist("127.0.0.1", server.port)
+        als.request_workers(server.num_workers)
+        sessions.append(als)
+        return als, server
+
+    yield connect
+    for als in sessions:
+        als.stop()
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def session(connect):
+    return connect()[0]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR", "VR_STAR"])
+def test_append_rows(connect, layout):
+    als, server = connect()
+    mh = als.create_matrix(30, 6, layout=layout)
+    matrix = np.random.rand(30, 6)
+    for start, end in [(0, 7), (7, 8), (8, 30)]:
+        assert mh.append_rows(matrix[start:end]) is mh
+    assert mh.num_appended_rows == 30
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_append_errors(connect):
+    als, server = connect()
+    mh = als.create_matrix(5, 3)
+    assert als.append_rows(mh, np.zeros((2, 4))) is None
+    assert als.append_rows(mh, np.zeros((6, 3))) is None
+    assert als.append_rows(mh, np.arange(3.0)) is mh and mh.num_appended_rows == 1
+
+
+def test_append_casts_to_matrix_type(connect):
+    als, server = connect()
+    mh = als.create_matrix(4, 2, dtype=np.int32)
+    als.append_rows(mh, np.array([[1.0, 2.0], [3.0, 4.0]]))
+    assert server.matrices[mh.id].dtype == np.int32
+    assert np.array_equal(als.fetch_matrix(mh, rows=(0, 2)), [[1, 2], [3, 4]])
+
+
+@pytest.mark.parametrize("max_rows", [0, 50])
+def test_send_row_batches(connect, max_rows):
+    als, server = connect()
+    batches = [np.random.rand(n, 5) for n in [4, 0, 11, 1, 9]]
+    mh = als.send_row_batches(iter(batches), max_rows=max_rows)
+    matrix = np.concatenate(batches)
+    assert mh.num_rows == (max_rows or 25)
+    assert np.array_equal(server.matrices[mh.id][0:25], matrix)
+
+
+def test_send_no_batches(connect):
+    als, server = connect()
+    assert als.send_row_batches([]) is None
+    assert als.send_row_batches([np.zeros((0, 3))], max_rows=10) is None
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def get_table():
+    return pa.table({"a": pa.array(np.arange(30, dtype=np.int32)),
+                     "name": pa.array(["x"] * 30),
+                     "b": pa.array([float(i) if i % 4 else None for i in range(30)]),
+                     "c": pa.array([i % 3 == 0 for i in range(30)])})
+
+
+def get_expected():
+    expected = np.zeros((30, 3))
+    expected[:, 0] = np.arange(30)
+    expected[:, 1] = [float(i) if i % 4 else np.nan for i in range(30)]
+    expected[:, 2] = [i % 3 == 0 for i in range(30)]
+    return expected
+
+
+def test_send_arrow_table(connect):
+    als, server = connect()
+    mh = als.send_arrow_table(get_table(), band_rows=7, num_readers=2)
+    assert np.array_equal(server.matrices[mh.id], get_expected(), equal_nan=True)
+
+
+def test_send_parquet_row_groups(connect, tmp_path):
+    als, server = connect()
+    pq.write_table(get_table(), str(tmp_path / "t.parquet"), row_group_size=8)
+    mh = als.send_parquet(str(tmp_path / "t.parquet"), columns=["c", "a"])
+    assert np.array_equal(server.matrices[mh.id], get_expected()[:, [2, 0]])
+
+
+def test_non_numeric_column(connect):
+    als, server = connect()
+    assert als.send_arrow_table(get_table(), columns=["name"]) is None
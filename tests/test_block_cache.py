@@ -0,0 +1,105 @@
+import tracemalloc
+import numpy as np
+from alchemist import BlockCache
+
+
+def test_tile_rectangles():
+    cache = BlockCache()
+    assert cache.get_tile_rectangles([]) == []
+    tiles = [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+    assert cache.get_tile_rectangles(tiles) == [[0, 2, 0, 1]]
+    # A cached tile (1, 1) in the middle splits the missing tiles, the rectangles never hold it
+    tiles = [(0, 0), (0, 1), (0, 2), (1, 0), (1, 2), (2, 0), (2, 1), (2, 2)]
+    assert cache.get_tile_rectangles(tiles) == [[0, 0, 0, 2], [1, 1, 0, 0], [1, 1, 2, 2], [2, 2, 0, 2]]
+    tiles = [(0, 0), (0, 1), (1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]
+    assert cache.get_tile_rectangles(tiles) == [[0, 0, 0, 1], [1, 2, 0, 2]]
+
+
+def test_lru_eviction():
+    cache = BlockCache(max_bytes=3 * 800)
+    for j in range(3):
+        cache.put(1, (0, j), np.zeros((10, 10)))
+    cache.get(1, (0, 0))
+    cache.put(1, (0, 3), np.zeros((10, 10)))
+    assert cache.get(1, (0, 1)) is None
+    assert cache.get(1, (0, 0)) is not None and cache.get_num_bytes() == 3 * 800
+    cache.put(1, (0, 4), np.zeros((100, 100)))
+    assert cache.get(1, (0, 4)) is None
+
+
+def connect_cached(connect, max_bytes):
+    als, server = connect(session_options={"block_cache_bytes": max_bytes})
+    als.block_cache.tile_rows = 8
+    als.block_cache.tile_cols = 4
+    return als, server
+
+
+def test_cached_fetches(connect):
+    als, server = connect_cached(connect, 1000000)
+    matrix = np.random.rand(40, 10)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(als.fetch_matrix(mh, rows=(3, 20), cols=(1, 6)), matrix[3:20, 1:6])
+
+    num_messages = server.num_messages
+    assert np.array_equal(als.fetch_matrix(mh, rows=(8, 16), cols=(4, 8)), matrix[8:16, 4:8])
+    assert server.num_messages == num_messages
+
+    # Only the tiles around the ones already cached are fetched
+    als.block_cache.reset_counters()
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+    assert als.block_cache.get_hits() == 6 and als.block_cache.get_misses() == 15 - 6
+    assert np.array_equal(als.fetch_matrix(mh, dtype=np.float32), matrix.astype(np.float32))
+
+
+def test_tiles_larger_than_cache(connect):
+    # A range smaller than the cache of a matrix whose tiles do not fit is fetched without the cache
+    als, server = connect_cached(connect, 200)
+    matrix = np.random.rand(40, 10)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(als.fetch_matrix(mh, rows=(0, 2), cols=(0, 2)), matrix[0:2, 0:2])
+    assert als.block_cache.get_num_bytes() == 0 and als.block_cache.get_misses() == 0
+
+
+def test_cache_invalidated_by_update(connect):
+    als, server = connect_cached(connect, 1000000)
+    matrix = np.random.rand(20, 10)
+    mh = als.send_matrix(matrix)
+    als.fetch_matrix(mh)
+    matrix[5, 5] = -1.0
+    als.update_matrix(mh, matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+
+
+def get_fetch_peak(als, mh, out):
+    tracemalloc.start()
+    als.fetch_matrix(mh, out=out)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def test_fetch_larger_than_cache_bypasses_it(connect):
+    als, server = connect(worker_buffer_length=50000, session_options={"block_cache_bytes": 1000000})
+    als.block_cache.tile_rows = als.block_cache.tile_cols = 64
+    matrix = np.random.rand(600, 600)
+    mh = als.send_matrix(matrix)
+    out = np.zeros_like(matrix)
+    # Received in place, without a temporary copy of the range or tiles that would not stay in the cache
+    assert get_fetch_peak(als, mh, out) < matrix.nbytes // 4
+    assert np.array_equal(out, matrix)
+    assert als.block_cache.get_num_bytes() == 0
+
+
+def test_cached_fetch_received_in_place(connect):
+    als, server = connect(worker_buffer_length=50000, session_options={"block_cache_bytes": 10000000})
+    als.block_cache.tile_rows = als.block_cache.tile_cols = 64
+    matrix = np.random.rand(600, 600)
+    mh = als.send_matrix(matrix)
+    out = np.zeros_like(matrix)
+    # Only the cached tiles are a second copy of the matrix
+    assert get_fetch_peak(als, mh, out) < matrix.nbytes * 5 // 4
+    assert np.array_equal(out, matrix)
+    assert als.block_cache.get_num_bytes() == matrix.nbytes
+    out[:] = 0
+    als.fetch_matrix(mh, out=out)
+    assert np.array_equal(out, matrix)
@@ -0,0 +1,66 @@
+import numpy as np
+from alchemist import BufferPool, Message
+
+
+def test_size_classes():
+    pool = BufferPool()
+    assert pool.get_size_class(1) == BufferPool.min_buffer_length
+    assert pool.get_size_class(4096) == 4096
+    assert pool.get_size_class(4097) == 8192
+    assert len(pool.acquire(100000)) == 131072
+
+
+def test_released_buffer_is_reused():
+    pool = BufferPool(1000000)
+    buffer = pool.acquire(5000)
+    pool.release(buffer)
+    assert pool.get_pooled_bytes() == 8192
+    assert pool.acquire(6000) is buffer
+    assert pool.get_pooled_bytes() == 0
+    # Buffers of other size classes are not handed out
+    pool.release(buffer)
+    assert pool.acquire(9000) is not buffer
+    assert pool.acquire(100) is not buffer
+
+
+def test_idle_bytes_stay_under_limit():
+    pool = BufferPool(3 * 8192)
+    buffers = [pool.acquire(8000) for _ in range(5)]
+    for buffer in buffers:
+        pool.release(buffer)
+        assert pool.get_pooled_bytes() <= 3 * 8192
+    assert pool.get_pooled_bytes() == 3 * 8192
+
+    pool.set_max_pooled_bytes(8192)
+    assert pool.get_pooled_bytes() == 8192
+    pool.clear()
+    assert pool.get_pooled_bytes() == 0
+
+
+def test_small_buffers_are_not_pooled():
+    pool = BufferPool(1000000)
+    pool.release(bytearray(100))
+    assert pool.get_pooled_bytes() == 0
+
+
+def test_message_buffers_are_lazy_and_released():
+    pool = BufferPool(1000000)
+    message = Message(10000000, pool)
+    assert len(message.message_buffer) == 0
+    message.reserve(20000)
+    buffer = message.message_buffer
+    assert len(buffer) == 32768
+    message.release()
+    assert len(message.message_buffer) == 0 and pool.get_pooled_bytes() == 32768
+    message.reserve(30000)
+    assert message.message_buffer is buffer
+
+
+def test_idle_connections_hold_no_buffers(connect):
+    als, server = connect()
+    mh = als.send_matrix(np.random.rand(50, 10))
+    als.fetch_matrix(mh)
+    for worker in als.workers.workers:
+        assert len(worker.input_message.message_buffer) == 0
+        assert len(worker.output_message.message_buffer) == 0
+    assert als.buffer_pool.get_pooled_bytes() <= als.buffer_pool.max_pooled_bytes
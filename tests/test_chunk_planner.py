@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from alchemist.ChunkPlanner import ChunkPlanner
+
+
+def get_elements(rows, cols):
+    return {(i, j) for i in range(rows[0], rows[1] + 1, rows[2]) for j in range(cols[0], cols[1] + 1, cols[2])}
+
+
+@pytest.mark.parametrize("rows, cols", [([0, 99, 1], [0, 9, 1]), ([1, 97, 4], [2, 3000, 3]), ([5, 5, 1], [0, 0, 1])])
+def test_plan_covers_share_once(rows, cols):
+    planner = ChunkPlanner(1000, min_message_bytes=0)
+    chunks = planner.plan(rows, cols, 8)
+    elements = [element for chunk_rows, chunk_cols in chunks for element in get_elements(chunk_rows, chunk_cols)]
+    assert len(elements) == len(set(elements))
+    assert set(elements) == get_elements(rows, cols)
+    for chunk_rows, chunk_cols in chunks:
+        assert len(get_elements(chunk_rows, chunk_cols)) * 8 <= planner.get_message_bytes()
+
+
+def test_wide_rows_are_split_into_column_bands():
+    planner = ChunkPlanner(1000, min_message_bytes=0)
+    chunks = planner.plan([0, 2, 1], [0, 999, 1], 8)
+    assert all(chunk_rows[0] == chunk_rows[1] for chunk_rows, _ in chunks)
+    assert len(chunks) == 3 * len(range(0, 1000, planner.get_message_bytes() // 8))
+
+
+def test_message_bytes_limits():
+    # Without a length from Alchemist, messages stay within the client's buffer length
+    assert ChunkPlanner(100000).get_message_bytes() == 100000 - ChunkPlanner.overhead_bytes
+    assert ChunkPlanner(1000, max_message_length=5000).get_message_bytes() == 5000 - ChunkPlanner.overhead_bytes
+    assert ChunkPlanner(1000, max_message_length=5000000).get_message_bytes() == \
+        ChunkPlanner.min_message_bytes - ChunkPlanner.overhead_bytes
+    assert ChunkPlanner(1000, max_message_length=5000, min_message_bytes=0).get_message_bytes() == \
+        1000 - ChunkPlanner.overhead_bytes
+
+
+def test_messages_within_buffer_length(connect):
+    # Alchemist announces no message length, so the worker buffer length of 100000 bytes bounds the messages
+    als, server = connect(worker_buffer_length=100000)
+    matrix = np.random.rand(1000, 100)
+    mh = als.send_matrix(matrix)
+    assert server.max_body_length <= 100000
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_empty_share():
+    assert ChunkPlanner(1000).plan([3, 2, 1], [0, 9, 1], 8) == []
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR"])
+@pytest.mark.parametrize("shape", [(1, 500), (500, 1), (3, 2000)])
+def test_thin_and_wide_round_trip(connect, layout, shape):
+    # Small messages split single rows into column bands and single columns into row bands
+    als, server = connect(worker_buffer_length=1000)
+    als.set_min_message_bytes(0)
+    matrix = np.random.rand(*shape)
+    mh = als.send_matrix(matrix, layout=layout)
+    assert np.array_equal(server.matrices[mh.id], matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
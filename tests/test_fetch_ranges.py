@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VR_STAR"])
+@pytest.mark.parametrize("rows, cols", [(None, None), ((5, 30), None), (None, slice(2, 9)), ((0, 1), (12, 13)),
+                                        (slice(33, 40), slice(1, 4))])
+def test_fetch_subrange(connect, layout, rows, cols):
+    als, server = connect()
+    matrix = np.random.rand(40, 13)
+    mh = als.send_matrix(matrix, layout=layout)
+    row_slice = slice(*rows) if isinstance(rows, tuple) else rows or slice(None)
+    col_slice = slice(*cols) if isinstance(cols, tuple) else cols or slice(None)
+    assert np.array_equal(als.fetch_matrix(mh, rows=rows, cols=cols), matrix[row_slice, col_slice])
+
+
+def test_fetch_into_out(connect, tmp_path):
+    als, server = connect()
+    matrix = np.random.rand(40, 13)
+    mh = als.send_matrix(matrix)
+
+    out = np.zeros((40, 13))
+    assert als.fetch_matrix(mh, out=out) is out
+    assert np.array_equal(out, matrix)
+
+    memmap = np.memmap(str(tmp_path / "out.dat"), dtype=np.float64, mode="w+", shape=(10, 5))
+    mh.fetch(out=memmap, rows=(20, 30), cols=(3, 8))
+    assert np.array_equal(memmap, matrix[20:30, 3:8])
+
+
+def test_fetch_errors(connect):
+    als, server = connect()
+    mh = als.send_matrix(np.random.rand(10, 4))
+    assert als.fetch_matrix(mh, out=np.zeros((10, 5))) is None
+    assert als.fetch_matrix(mh, rows=slice(0, 10, 2)) is None
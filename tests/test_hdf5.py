@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+
+@pytest.mark.parametrize("chunks", [None, (7, 5)])
+def test_send_hdf5_in_bands(connect, tmp_path, chunks):
+    als, server = connect()
+    matrix = np.random.rand(45, 5)
+    with h5py.File(str(tmp_path / "m.h5"), "w") as f:
+        f.create_dataset("m", data=matrix, chunks=chunks)
+    # Bands of a few rows, so that the dataset is sent in several of them
+    als.hdf5_band_bytes = 500
+    with h5py.File(str(tmp_path / "m.h5"), "r") as f:
+        band_rows = als.get_hdf5_band_rows(f["m"], matrix.dtype)
+        assert band_rows < 45 and (chunks is None or band_rows % chunks[0] == 0)
+        mh = als.send_hdf5(f, name="m")
+    assert np.array_equal(server.matrices[mh.id], matrix)
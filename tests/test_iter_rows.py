@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def test_iter_rows(connect):
+    als, server = connect()
+    matrix = np.random.rand(103, 7)
+    mh = als.send_matrix(matrix)
+    blocks = list(mh.iter_rows(10))
+    assert [len(block) for block in blocks] == [10] * 10 + [3]
+    assert np.array_equal(np.concatenate(blocks), matrix)
+    assert np.array_equal(np.concatenate(list(als.iter_rows(mh, 25, rows=(40, 90)))), matrix[40:90])
+
+
+def test_transfers_during_iteration(connect):
+    # Transfers made while a block is being prefetched use the same worker sockets, they wait for the prefetch
+    als, server = connect(worker_buffer_length=2000)
+    als.set_min_message_bytes(0)
+    matrix = np.random.rand(400, 30)
+    other = np.random.rand(60, 30)
+    mh = als.send_matrix(matrix)
+    other_mh = als.send_matrix(other)
+    blocks = []
+    for block in als.iter_rows(mh, 20):
+        blocks.append(block)
+        assert np.array_equal(als.fetch_matrix(other_mh), other)
+        sent = als.send_matrix(block)
+        assert np.array_equal(server.matrices[sent.id], block)
+    assert np.array_equal(np.concatenate(blocks), matrix)
+
+
+def test_stop_early(connect):
+    als, server = connect()
+    matrix = np.random.rand(50, 4)
+    mh = als.send_matrix(matrix)
+    for block in als.iter_rows(mh, 10):
+        break
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
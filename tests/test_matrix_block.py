@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from alchemist import MatrixBlock
+
+
+def test_pack_strided_is_view():
+    matrix = np.arange(48.0).reshape((6, 8))
+    block = MatrixBlock.pack(matrix, [1, 5, 2], [0, 6, 3])
+    assert np.shares_memory(block, matrix)
+    assert np.array_equal(block, matrix[1:6:2, 0:7:3])
+
+
+def test_pack_index_arrays():
+    matrix = np.arange(48.0).reshape((6, 8))
+    rows = np.array([0, 2, 5])
+    block = MatrixBlock.pack(matrix, rows, [1, 7, 2])
+    assert np.array_equal(block, matrix[np.ix_(rows, [1, 3, 5, 7])])
+
+
+@pytest.mark.parametrize("rows, cols", [([1, 5, 2], [0, 6, 3]), (np.array([0, 3, 4]), [2, 6, 4])])
+def test_unpack_round_trip(rows, cols):
+    matrix = np.random.rand(6, 8)
+    copy = np.zeros_like(matrix)
+    MatrixBlock.unpack(copy, rows, cols, MatrixBlock.pack(matrix, rows, cols))
+    assert np.array_equal(MatrixBlock.pack(copy, rows, cols), MatrixBlock.pack(matrix, rows, cols))
+
+
+def test_unpack_with_offsets():
+    matrix = np.arange(48.0).reshape((6, 8))
+    window = np.zeros((3, 4))
+    MatrixBlock.unpack(window, [2, 4, 1], [4, 7, 1], matrix[2:5, 4:8], row_offset=2, col_offset=4)
+    assert np.array_equal(window, matrix[2:5, 4:8])
+
+
+def test_unpack_range():
+    block = np.zeros((3, 4))
+    MatrixBlock.unpack_range(block, 2, np.arange(1.0, 9.0))
+    assert np.array_equal(block.ravel()[2:10], np.arange(1.0, 9.0))
+    assert block.ravel()[:2].sum() == 0 and block.ravel()[10:].sum() == 0
+
+
+def test_unpack_casts_to_matrix_type():
+    matrix = np.zeros((4, 6), dtype=np.int64)
+    MatrixBlock.unpack(matrix, [0, 2, 2], [1, 5, 2], np.full((2, 3), 7.0))
+    assert matrix[0, 1] == 7 and matrix[2, 5] == 7 and matrix.sum() == 42
@@ -0,0 +1,75 @@
+import numpy as np
+from alchemist import AlchemistSession
+
+
+def test_resend_returns_handle(connect):
+    als, server = connect()
+    als.enable_matrix_registry()
+    matrix = np.random.rand(30, 8)
+    mh = als.send_matrix(matrix)
+    num_messages = server.num_messages
+    assert als.send_matrix(matrix.copy()) is mh
+    assert server.num_messages == num_messages
+
+    # Other contents, element types, layouts and views are other matrices
+    assert als.send_matrix(matrix.astype(np.float32)) is not mh
+    assert als.send_matrix(matrix, layout="VC_STAR") is not mh
+    assert als.send_matrix(matrix[:, 0:7]).id != mh.id
+
+
+def test_strided_matrices_share_keys(connect):
+    als, server = connect()
+    als.enable_matrix_registry()
+    matrix = np.random.rand(30, 16)
+    mh = als.send_matrix(matrix[:, ::2])
+    assert als.send_matrix(np.ascontiguousarray(matrix[:, ::2])) is mh
+
+
+def test_changed_matrices_are_forgotten(connect):
+    als, server = connect()
+    als.enable_matrix_registry()
+    matrix = np.random.rand(10, 4)
+    mh = als.send_matrix(matrix)
+    als.update_matrix(mh, matrix + 1.0)
+    assert als.send_matrix(matrix) is not mh
+
+
+def test_registry_file_shared_between_sessions(connect, tmp_path):
+    als, server = connect()
+    path = str(tmp_path / "registry.json")
+    als.enable_matrix_registry(path)
+    matrix = np.random.rand(25, 6)
+    mh = als.send_matrix(matrix)
+
+    later = AlchemistSession(verbose=False)
+    later.connect_to_alchemist("127.0.0.1", server.port)
+    later.request_workers(server.num_workers)
+    try:
+        later.enable_matrix_registry(path)
+        num_messages = server.num_messages
+        reused = later.send_matrix(matrix)
+        assert server.num_messages == num_messages
+        assert reused.id == mh.id and reused.dtype == mh.dtype
+        assert list(reused.grid.get_worker_ids()) == list(mh.grid.get_worker_ids())
+        assert np.array_equal(later.fetch_matrix(reused), matrix)
+    finally:
+        later.stop()
+
+
+def test_empty_matrices(connect):
+    als, server = connect()
+    als.enable_matrix_registry()
+    mh = als.send_matrix(np.zeros((0, 5)))
+    assert mh is not None and (mh.num_rows, mh.num_cols) == (0, 5)
+    assert als.send_matrix(np.zeros((0, 5))) is mh
+    assert als.send_matrix(np.zeros((5, 0))) is not mh
+
+
+def test_handles_are_kept_per_server(connect):
+    als, server = connect()
+    registry = als.enable_matrix_registry()
+    matrix = np.random.rand(10, 4)
+    mh = als.send_matrix(matrix)
+    key = registry.get_key(matrix, "MC_MR")
+    assert registry.lookup(key, als.get_server_name()) is mh
+    assert registry.lookup(key, "elsewhere:24960") is None
@@ -0,0 +1,58 @@
+import socket
+import struct
+import numpy as np
+from alchemist import DriverClient
+from MockAlchemist import Reader
+
+
+def test_send_in_parts(connect):
+    als, server = connect()
+    als.set_max_part_length(500)
+    matrix = np.random.rand(50, 20)
+    mh = als.send_matrix(matrix)
+    assert server.num_parts_received > 0
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_fetch_streamed_parts(connect):
+    als, server = connect(part_length=1000)
+    matrix = np.random.rand(60, 25)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+    assert server.num_parts_sent > 0
+
+
+def test_pipelined_matrix_infos_in_parts(connect):
+    # The grid records of every MATRIX_INFO reply are split across parts that are read as they arrive
+    als, server = connect(part_length=24)
+    matrices = [np.random.rand(5 + i, 3) for i in range(6)]
+    handles = als.send_matrices(matrices)
+    for mh, matrix in zip(handles, matrices):
+        assert list(mh.grid.get_worker_ids()) == [1, 2, 3, 4]
+        assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def receive_streamed(server, command, body):
+    client = DriverClient(buffer_length=10000, verbose=False)
+    client.sock, server_socket = socket.socketpair()
+    server.reply(server_socket, command, body)
+    client.receive_message(stream=True)
+    server_socket.close()
+    return client
+
+
+def test_worker_infos_streamed(server):
+    server.part_length = 16
+    body = server.request_workers(Reader(bytes([34]) + struct.pack(">H", 4)))
+    client = receive_streamed(server, 11, body)
+    assert client.input_message.read_short() == 4
+    workers = client.input_message.read_worker_infos(4)
+    assert [worker.id for worker in workers] == [1, 2, 3, 4]
+    assert [worker.port for worker in workers] == server.worker_ports
+    assert all(worker.address == "127.0.0.1" for worker in workers)
+
+
+def test_shorts_streamed(server):
+    server.part_length = 8
+    client = receive_streamed(server, 0, b"".join(bytes([34]) + struct.pack(">h", i) for i in range(20)))
+    assert list(client.input_message.read_shorts(20)) == list(range(20))
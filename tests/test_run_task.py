@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def test_returned_handles_are_attached(connect):
+    als, server = connect()
+    U = np.random.rand(40, 3)
+
+    def truncated_svd(server):
+        return server.parameter("U", server.matrix_info(server.add_matrix(U.copy()), "U"))
+
+    server.tasks["truncated_svd"] = truncated_svd
+    out_args = als.run_task(1, "truncated_svd", {})
+    mh = out_args["U"].value
+    assert mh.session is als
+    assert np.array_equal(mh[0:10], U[0:10])
+    assert np.array_equal(mh[:, 2], U[:, 2])
+    assert np.array_equal(np.concatenate(list(mh.iter_rows(15))), U)
+    assert np.array_equal(mh.fetch(), U)
+
+
+def test_overwritten_matrices_are_invalidated(connect):
+    als, server = connect(worker_buffer_length=1000, session_options={"block_cache_bytes": 1000000})
+    als.set_min_message_bytes(0)
+    als.hash_sent_blocks = True
+    matrix = np.random.rand(30, 8)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+    assert mh.id in als.block_hashes
+
+    # The task scales the matrix in place and returns it as MATRIX_INFO under the same ID
+    def scale(server):
+        server.matrices[mh.id] *= 2.0
+        return server.parameter("A", server.matrix_info(mh.id, "A"))
+
+    server.tasks["scale"] = scale
+    als.run_task(1, "scale", {})
+    assert mh.id not in als.block_hashes
+    assert np.array_equal(als.fetch_matrix(mh), 2.0 * matrix)
+
+    # Without the hashes of the blocks sent before the task, the update sends every block again
+    matrix[0, 0] = 5.0
+    als.update_matrix(mh, matrix)
+    assert np.array_equal(server.matrices[mh.id], matrix)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+scipy_sparse = pytest.importorskip("scipy.sparse")
+
+
+def test_send_and_fetch_matrices(connect):
+    als, server = connect()
+    matrices = [np.random.rand(1 + i % 5, 2 + i % 3) for i in range(40)]
+    matrices[3] = matrices[3].astype(np.int32)
+    handles = als.send_matrices(matrices, names=["m{0}".format(i) for i in range(40)])
+    assert [mh.name for mh in handles] == ["m{0}".format(i) for i in range(40)]
+    for mh, matrix in zip(handles, matrices):
+        assert np.array_equal(server.matrices[mh.id], matrix)
+    fetched = als.fetch_matrices(handles)
+    assert fetched[3].dtype == np.int32
+    assert all(np.array_equal(f, m) for f, m in zip(fetched, matrices))
+
+
+def test_send_mixed_matrices(connect):
+    als, server = connect()
+    sparse = scipy_sparse.random(10, 5, density=0.3, format="csr", random_state=3)
+    vector = np.arange(6.0)
+    handles = als.send_matrices([np.ones((2, 2)), sparse, vector])
+    assert handles[1].sparse and handles[2].num_rows == 6 and handles[2].num_cols == 1
+    fetched = als.fetch_matrices(handles)
+    assert np.array_equal(fetched[1].toarray(), sparse.toarray())
+    assert np.array_equal(fetched[2][:, 0], vector)
+
+
+def test_pipelined_batches(connect):
+    # More matrices than are pipelined at a time
+    als, server = connect()
+    als.driver.max_pipelined_messages = 7
+    matrices = [np.full((2, 3), float(i)) for i in range(30)]
+    handles = als.send_matrices(matrices)
+    assert len({mh.id for mh in handles}) == 30
+    assert all(np.array_equal(server.matrices[mh.id], m) for mh, m in zip(handles, matrices))
+
+
+def test_rejected_matrix_info(connect, capsys):
+    als, server = connect()
+    server.rejected_names.add("bad")
+    num_matrices = len(server.matrices)
+    assert als.send_matrices([np.ones((2, 2)), np.ones((3, 3)), np.ones((2, 2))], names=["a", "bad", "c"]) is None
+    assert "ERROR: Alchemist did not create array bad (3 x 3, matrix 2 of 3)" in capsys.readouterr().out
+    # The other matrices were created but not sent
+    assert len(server.matrices) == num_matrices + 2
+    assert all(not matrix.any() for matrix in server.matrices.values())
+    assert als.send_matrices([np.ones((2, 2))], names=["d"])[0].name == "d"
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR", "VR_STAR", "STAR_STAR"])
+def test_send_fetch_round_trip(connect, layout):
+    als, server = connect()
+    matrix = np.random.rand(37, 11)
+    mh = als.send_matrix(matrix, layout=layout)
+    assert np.array_equal(server.matrices[mh.id], matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+
+
+def test_send_fetch_small_messages(connect):
+    # A worker buffer much smaller than the matrix splits the transfers into many messages
+    als, server = connect(worker_buffer_length=2000)
+    matrix = np.random.rand(120, 30)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
@@ -0,0 +1,66 @@
+import json
+import os
+import numpy as np
+import pytest
+from alchemist import ShardedArray
+
+
+@pytest.fixture
+def shards(tmp_path):
+    matrix = np.random.rand(50, 7)
+    for k, (start, end) in enumerate([(0, 12), (12, 13), (13, 40), (40, 50)]):
+        np.save(str(tmp_path / "part{0}.npy".format(k)), matrix[start:end])
+    return matrix, tmp_path
+
+
+def test_strided_rows_across_shards(shards):
+    matrix, path = shards
+    array = ShardedArray.open(str(path))
+    assert array.shape == matrix.shape and array.dtype == matrix.dtype
+    for rows in [slice(0, 50, 1), slice(3, 47, 5), slice(12, 13, 1), slice(11, 41, 29), slice(20, 20, 1)]:
+        assert np.array_equal(array[rows, 1:6:2], matrix[rows, 1:6:2])
+
+
+def test_manifest(shards):
+    matrix, path = shards
+    with open(str(path / "manifest.json"), "w") as f:
+        json.dump({"shards": sorted(f for f in os.listdir(str(path)) if f.endswith(".npy"))}, f)
+    array = ShardedArray.open(str(path / "manifest.json"))
+    assert np.array_equal(array[0:50, 0:7], matrix)
+
+
+def test_mismatched_shards(tmp_path):
+    np.save(str(tmp_path / "a.npy"), np.zeros((3, 4)))
+    np.save(str(tmp_path / "b.npy"), np.zeros((3, 5)))
+    assert ShardedArray.open(str(tmp_path)) is None
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR"])
+def test_send_shards(connect, shards, layout):
+    als, server = connect(worker_buffer_length=1000)
+    als.set_min_message_bytes(0)
+    matrix, path = shards
+    mh = als.send_matrix(str(path), layout=layout)
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_send_npy_and_memmap(connect, tmp_path):
+    als, server = connect()
+    matrix = np.random.rand(30, 9).astype(np.float32)
+    np.save(str(tmp_path / "m.npy"), matrix)
+    mh = als.send_matrix(str(tmp_path / "m.npy"))
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+    memmap = np.memmap(str(tmp_path / "m.dat"), dtype=np.float32, mode="w+", shape=matrix.shape)
+    memmap[:] = matrix
+    memmap.flush()
+    mh = als.send_matrix(np.memmap(str(tmp_path / "m.dat"), dtype=np.float32, mode="r", shape=matrix.shape))
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+
+
+def test_fortran_order_npy(connect, tmp_path):
+    als, server = connect()
+    matrix = np.asfortranarray(np.random.rand(20, 6))
+    np.save(str(tmp_path / "f.npy"), matrix)
+    mh = als.send_matrix(str(tmp_path / "f.npy"))
+    assert np.array_equal(server.matrices[mh.id], matrix)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("index", [3, -1, slice(2, 9), (slice(None), 4), (slice(1, 30, 3), slice(None, None, -2)),
+                                   (7, slice(2, 5)), (-2, -3), (slice(5, 5), slice(None))])
+def test_getitem(connect, index):
+    als, server = connect()
+    matrix = np.random.rand(31, 11)
+    mh = als.send_matrix(matrix)
+    fetched = mh[index]
+    expected = matrix[index]
+    assert np.shape(fetched) == np.shape(expected)
+    assert np.array_equal(fetched, expected)
+
+
+def test_getitem_requests_only_the_range(connect):
+    als, server = connect()
+    matrix = np.random.rand(200, 20)
+    mh = als.send_matrix(matrix)
+    num_messages = server.num_messages
+    assert mh[10, 4] == matrix[10, 4]
+    # Row 10 and column 4 are only held by the worker in the first row and column of the 2 x 2 grid
+    assert server.num_messages - num_messages == 1
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+scipy_sparse = pytest.importorskip("scipy.sparse")
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR", "STAR_STAR"])
+def test_sparse_round_trip(connect, layout):
+    als, server = connect()
+    matrix = scipy_sparse.random(40, 17, density=0.1, format="csr", random_state=1)
+    mh = als.send_matrix(matrix, layout=layout)
+    assert mh.id in server.sparse
+    assert np.array_equal(server.matrices[mh.id], matrix.toarray())
+    fetched = als.fetch_sparse_matrix(mh)
+    assert fetched.shape == matrix.shape
+    assert np.array_equal(fetched.toarray(), matrix.toarray())
+
+
+def test_sparse_duplicates_are_summed(connect):
+    als, server = connect()
+    matrix = scipy_sparse.coo_matrix(([1.0, 2.0, 5.0], ([3, 3, 7], [2, 2, 4])), shape=(10, 6))
+    mh = als.send_matrix(matrix)
+    fetched = als.fetch_sparse_matrix(mh)
+    assert fetched[3, 2] == 3.0 and fetched[7, 4] == 5.0 and fetched.nnz == 2
+
+
+def test_sparse_typed_values(connect):
+    als, server = connect()
+    matrix = scipy_sparse.random(30, 12, density=0.2, format="csr", random_state=2, dtype=np.float32)
+    mh = als.send_matrix(matrix)
+    fetched = als.fetch_sparse_matrix(mh)
+    assert fetched.dtype == np.float32
+    assert np.array_equal(fetched.toarray(), matrix.toarray())
+
+
+def test_empty_sparse_matrix(connect):
+    als, server = connect()
+    mh = als.send_matrix(scipy_sparse.csr_matrix((8, 5)))
+    assert als.fetch_sparse_matrix(mh).nnz == 0
@@ -0,0 +1,48 @@
+import io
+import numpy as np
+import pytest
+from alchemist import Tracer
+
+
+@pytest.fixture
+def trace():
+    stream = io.StringIO()
+    yield stream
+    Tracer.set_level("OFF")
+    Tracer.logger.removeHandler(Tracer.handler)
+    Tracer.handler = None
+
+
+def test_off_by_default(connect, trace):
+    Tracer.set_level("OFF", trace)
+    als, server = connect()
+    als.send_matrix(np.random.rand(10, 4))
+    assert Tracer.get_level() == Tracer.levels["OFF"]
+    assert trace.getvalue() == ""
+
+
+def test_headers(connect, trace):
+    als, server = connect()
+    als.set_trace_level("HEADERS", trace)
+    als.send_matrix(np.random.rand(10, 4))
+    lines = trace.getvalue().splitlines()
+    assert any(line.startswith("Sent to") and "SEND_MATRIX_BLOCKS" in line for line in lines)
+    assert any(line.startswith("Received from") and "body length" in line for line in lines)
+
+
+def test_full_summarizes_blocks(connect, trace):
+    als, server = connect()
+    als.set_trace_level("FULL", trace)
+    mh = als.send_matrix(np.random.rand(10, 4))
+    als.fetch_matrix(mh)
+    # Blocks are described by their shape and ranges, their data is not decoded
+    assert "MATRIX BLOCK                5x2 float64 | rows [0, 8, 2] | cols [0, 2, 2]" in trace.getvalue()
+
+
+def test_new_session_keeps_level(connect, trace):
+    als, server = connect()
+    als.set_trace_level("HEADERS", trace)
+    connect()
+    assert Tracer.get_level() == Tracer.levels["HEADERS"]
+    connect(session_options={"trace_level": "OFF"})
+    assert Tracer.get_level() == Tracer.levels["OFF"]
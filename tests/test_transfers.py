@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("max_concurrent_transfers", [None, 0, 1, 2])
+def test_concurrent_transfers(connect, max_concurrent_transfers):
+    als, server = connect(worker_buffer_length=2000,
+                          session_options={"max_concurrent_transfers": max_concurrent_transfers})
+    als.set_min_message_bytes(0)
+    matrix = np.random.rand(90, 12)
+    mh = als.send_matrix(matrix)
+    assert np.array_equal(server.matrices[mh.id], matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
+
+
+@pytest.mark.parametrize("send_window", [1, 3, 100])
+def test_send_window(connect, send_window):
+    # Up to send_window messages are sent before their acknowledgements are read; the matrix takes several messages
+    # per worker
+    als, server = connect(worker_buffer_length=1000, session_options={"send_window": send_window})
+    als.set_min_message_bytes(0)
+    matrix = np.random.rand(70, 15)
+    num_messages = server.num_messages
+    mh = als.send_matrix(matrix)
+    assert server.num_messages - num_messages > 8
+    assert np.array_equal(server.matrices[mh.id], matrix)
+    assert np.array_equal(als.fetch_matrix(mh), matrix)
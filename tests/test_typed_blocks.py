@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int32, np.int64, np.uint8, np.complex128])
+def test_typed_round_trip(connect, dtype):
+    als, server = connect()
+    matrix = (np.random.rand(23, 9) * 100).astype(dtype)
+    mh = als.send_matrix(matrix)
+    assert server.matrices[mh.id].dtype == matrix.dtype
+    fetched = als.fetch_matrix(mh)
+    assert fetched.dtype == matrix.dtype
+    assert np.array_equal(fetched, matrix)
+
+
+@pytest.mark.parametrize("block_cache_bytes", [0, 10000000])
+def test_fetch_int_matrix_from_double_replies(connect, block_cache_bytes):
+    # Alchemist itself replies with DOUBLE blocks whatever the element type of the matrix
+    als, server = connect(double_replies=True, session_options={"block_cache_bytes": block_cache_bytes})
+    matrix = np.arange(23 * 9, dtype=np.int32).reshape((23, 9))
+    mh = als.send_matrix(matrix)
+
+    fetched = als.fetch_matrix(mh)
+    assert fetched.dtype == np.int32 and np.array_equal(fetched, matrix)
+
+    fetched = als.fetch_matrix(mh, dtype=int)
+    assert fetched.dtype == int and np.array_equal(fetched, matrix)
+
+    out = np.zeros((23, 9), dtype=np.int64)
+    als.fetch_matrix(mh, out=out)
+    assert np.array_equal(out, matrix)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+
+def count_block_messages(server, update):
+    num_messages = server.num_messages
+    update()
+    return server.num_messages - num_messages
+
+
+@pytest.mark.parametrize("layout", ["MC_MR", "VC_STAR"])
+def test_update_sends_changed_blocks(connect, layout):
+    als, server = connect(worker_buffer_length=1000)
+    als.set_min_message_bytes(0)
+    als.hash_sent_blocks = True
+    matrix = np.random.rand(60, 10)
+    mh = als.send_matrix(matrix, layout=layout)
+
+    # The hashes recorded by send_matrix make the first update send only the changed block
+    matrix[17, 3] = -1.0
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix)) == 1
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix)) == 0
+
+    matrix[:, 0] = 0.0
+    als.update_matrix(mh, matrix)
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_update_without_sent_hashes(connect):
+    # send_matrix does not hash the blocks it sends by default
+    als, server = connect()
+    matrix = np.random.rand(20, 6)
+    mh = als.send_matrix(matrix)
+    assert mh.id not in als.block_hashes
+    matrix[0, 0] = 5.0
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix)) == 4
+    assert np.array_equal(server.matrices[mh.id], matrix)
+
+
+def test_update_with_missing_worker_hashes(connect):
+    als, server = connect()
+    als.hash_sent_blocks = True
+    matrix = np.random.rand(20, 6)
+    mh = als.send_matrix(matrix)
+    # A worker without recorded hashes, as after the worker set changed, is sent every block of its share
+    del als.block_hashes[mh.id][1]
+    matrix[0, 0] = 5.0
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix)) == 1
+    assert np.array_equal(server.matrices[mh.id], matrix)
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix)) == 0
+
+
+def test_update_casts_to_matrix_type(connect):
+    als, server = connect()
+    als.hash_sent_blocks = True
+    matrix = np.arange(48, dtype=np.int32).reshape((8, 6))
+    mh = als.send_matrix(matrix)
+    # The same values as float64 hash like the int32 blocks that were sent, so nothing changed
+    assert count_block_messages(server, lambda: als.update_matrix(mh, matrix.astype(np.float64))) == 0
+    update = matrix.astype(np.float64)
+    update[2, 2] = 100.0
+    als.update_matrix(mh, update)
+    assert server.matrices[mh.id].dtype == np.int32
+    assert np.array_equal(server.matrices[mh.id], update.astype(np.int32))
+
+
+def test_update_errors(connect, tmp_path):
+    als, server = connect()
+    mh = als.send_matrix(np.random.rand(5, 4))
+    assert als.update_matrix(mh, np.zeros((4, 5))) is None
+    np.save(str(tmp_path / "m.npy"), np.zeros((5, 4), dtype=np.float32))
+    memmap = np.load(str(tmp_path / "m.npy"), mmap_mode="r")
+    assert als.update_matrix(mh, memmap) is None
+
+
+def test_update_after_append(connect):
+    als, server = connect()
+    mh = als.create_matrix(10, 3)
+    matrix = np.random.rand(10, 3)
+    mh.append_rows(matrix)
+    matrix[9, 2] = 7.0
+    als.update_matrix(mh, matrix)
+    assert np.array_equal(server.matrices[mh.id], matrix)